@@ -3,6 +3,7 @@
 处理环境变量加载和应用配置
 """
 import os
+import tempfile
 from functools import lru_cache
 from dotenv import load_dotenv
 
@@ -41,6 +42,23 @@ class Settings:
         # 频率限制配置
         self.rate_limit = os.getenv("RATE_LIMIT", "10/minute")
 
+        # 运行指标接口的访问令牌（未设置时不开放 /api/metrics）
+        self.metrics_token = os.getenv("METRICS_TOKEN", "")
+
+        # 快速回答任务存储配置（memory 或 sqlite）
+        self.job_store_backend = os.getenv("JOB_STORE_BACKEND", "memory")
+        self.job_store_path = os.getenv(
+            "JOB_STORE_PATH", os.path.join(tempfile.gettempdir(), "quick_answer_jobs.sqlite3")
+        )
+
+        # 历史记录本地暂存文件（Supabase不可用时记录保留在这里）
+        self.history_spool_path = os.getenv(
+            "HISTORY_SPOOL_PATH", os.path.join(tempfile.gettempdir(), "history_spool.sqlite3")
+        )
+
+        # 用户统计实现（counters 读取使用计数，supabase 在数据库中聚合）
+        self.history_stats_backend = os.getenv("HISTORY_STATS_BACKEND", "counters")
+
 
 @lru_cache()
 def get_settings() -> Settings:
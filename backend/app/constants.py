@@ -387,6 +387,114 @@ API_TIMEOUT = 180  # 增加到180秒支持5万字长内容生成
 API_TEMPERATURE = 0.5
 API_MAX_TOKENS = 2000  # 普通优化用的token限制
 API_MAX_TOKENS_THINKING = 8000  # 思考模式专用的更高token限制
+QUICK_ANSWER_MAX_TOKENS = 12000  # 快速回答的token限制
+
+# 批量优化配置
+BATCH_MAX_ITEMS = 500  # 单次批量请求的最大条目数
+BATCH_DEFAULT_PARALLELISM = 8  # 默认并行度
+BATCH_MAX_PARALLELISM = 32  # 客户端可指定的最大并行度
+
+# LLM连接池配置（每个提供商一个长连接客户端，在应用启动时创建）
+LLM_MAX_CONNECTIONS = 200  # 单个提供商的最大并发连接数
+LLM_MAX_KEEPALIVE_CONNECTIONS = 50  # 保持存活的空闲连接数
+LLM_KEEPALIVE_EXPIRY = 30  # 空闲连接保持时间（秒）
+
+# Supabase连接池配置（进程内共享一个客户端，在应用启动时创建）
+SUPABASE_TIMEOUT = 10  # 数据库请求超时时间（秒）
+SUPABASE_MAX_CONNECTIONS = 100  # 最大并发连接数
+SUPABASE_MAX_KEEPALIVE_CONNECTIONS = 20  # 保持存活的空闲连接数
+SUPABASE_KEEPALIVE_EXPIRY = 30  # 空闲连接保持时间（秒）
+SUPABASE_THREAD_POOL_SIZE = 32  # 执行数据库查询的线程数上限
+
+# 提示词优化结果缓存配置
+LLM_CACHE_MAX_BYTES = 32 * 1024 * 1024  # 缓存总容量上限（字节）
+LLM_CACHE_TTL = 3600  # 缓存有效期（秒）
+
+# LLM路由配置（故障切换与对冲请求）
+LLM_FALLBACK_MODELS = {  # 首选模型 -> 备用模型（备用提供商密钥已配置时生效）
+    "deepseek-v4-flash": "gemini-2.0-flash",
+    "gemini-2.5-pro-preview-03-25": "gemini-2.0-flash"
+}
+LLM_ROUTER_WINDOW = 200  # 滚动统计窗口的样本数
+LLM_ROUTER_MIN_SAMPLES = 20  # 计算p95和错误率所需的最少样本数
+LLM_ROUTER_ERROR_THRESHOLD = 0.5  # 错误率超过此值的模型降为备选
+LLM_HEDGE_MAX_RATIO = 0.1  # 对冲请求占总请求的最大比例
+
+# LLM重试与熔断配置
+LLM_MAX_RETRIES = 2  # 单次调用的最大重试次数
+LLM_RETRY_BASE_DELAY = 0.5  # 指数退避的基础等待时间（秒）
+LLM_RETRY_MAX_DELAY = 8  # 单次重试的最大等待时间（秒），Retry-After 超过此值时不再重试
+LLM_RETRY_BUDGET_RATIO = 0.2  # 重试预算：每个请求积累的重试令牌数
+LLM_RETRY_BUDGET_CAPACITY = 20  # 重试预算令牌桶容量
+CIRCUIT_FAILURE_THRESHOLD = 5  # 连续失败多少次后熔断
+CIRCUIT_RECOVERY_TIMEOUT = 30  # 熔断后多久放行探测请求（秒）
+
+# 上游并发准入控制配置
+LLM_PROVIDER_CONCURRENCY = {  # 每个提供商同时进行的最大上游调用数
+    "deepseek": 64,
+    "gemini": 32
+}
+LLM_DEFAULT_CONCURRENCY = 32  # 未单独配置的提供商的并发上限
+LLM_MAX_QUEUE = 256  # 每个提供商的最大排队请求数
+LLM_QUEUE_TIMEOUT = 10  # 最长排队时间（秒），超时返回503
+LLM_SHED_RETRY_AFTER = 5  # 过载拒绝时建议客户端等待的秒数
+
+# 加权公平调度配置（排队请求按 token上限 / 权重 分配上游名额）
+LLM_DEFAULT_WEIGHT = 1  # 普通用户和匿名用户的权重
+LLM_SUBSCRIBER_WEIGHT = 4  # 有效订阅用户的权重
+ACTIVE_SUBSCRIPTION_STATUSES = ("active", "trialing")  # 视为有效订阅的状态
+
+# 快速回答任务队列配置
+JOB_WORKERS = 4  # 后台工作协程数
+JOB_QUEUE_MAX_DEPTH = 100  # 排队任务上限，已满时拒绝提交
+JOB_MAX_PER_USER = 3  # 每个用户同时排队/运行的任务上限
+JOB_RESULT_TTL = 3600  # 已完成任务结果保留时间（秒）
+JOB_CLEANUP_INTERVAL = 60  # 过期任务清理间隔（秒）
+JOB_LEASE_RENEW_INTERVAL = 15  # 进程为自己未完成的任务续约的间隔（秒）
+JOB_LEASE_TIMEOUT = 90  # 任务超过该时间未续约，视为所属进程已退出（秒）
+JOB_EVENTS_HEARTBEAT = 15  # 任务事件流的心跳间隔（秒）
+
+# 历史记录批量写入配置
+HISTORY_WRITE_BATCH_SIZE = 50  # 每批最多写入的行数
+HISTORY_FLUSH_INTERVAL = 0.2  # 一批记录最长等待时间（秒）
+HISTORY_QUEUE_MAX = 5000  # 写入队列上限
+HISTORY_ENQUEUE_TIMEOUT = 1  # 队列已满时等待的最长时间（秒），超时后直接写入
+HISTORY_DRAIN_TIMEOUT = 10  # 关闭时排空队列的最长时间（秒）
+HISTORY_REPLAY_BATCH_SIZE = 200  # 每次同步到Supabase的最大行数
+HISTORY_REPLAY_INTERVAL = 5  # 暂存区空闲时的检查间隔（秒）
+HISTORY_RETRY_BASE_DELAY = 1  # 同步失败重试的基础等待时间（秒）
+HISTORY_RETRY_MAX_DELAY = 300  # 同步失败重试的最长等待时间（秒）
+
+# 历史记录读取缓存配置（按用户缓存前几页，写入时失效）
+HISTORY_CACHE_MAX_BYTES = 32 * 1024 * 1024  # 缓存容量上限
+HISTORY_CACHE_TTL = 60  # 缓存页有效期（秒）
+HISTORY_CACHE_MAX_PAGES = 3  # 每个用户缓存的页数（页码分页），游标分页只缓存第一页
+
+# 历史记录摘要配置（列表只返回预览，完整内容按ID获取）
+HISTORY_PREVIEW_CHARS = 200  # 摘要中原始和优化后提示词的预览字符数
+HISTORY_EXPORT_CHUNK_SIZE = 200  # 导出时每次从数据库读取的行数（决定导出占用的内存）
+
+# 历史记录搜索配置
+HISTORY_SEARCH_MAX_QUERY_LENGTH = 100  # 搜索内容的最大字符数
+HISTORY_SEARCH_MAX_TERMS = 5  # 最多使用的搜索词数量（按空白分词）
+HISTORY_SEARCH_LOCAL_LIMIT = 1000  # 进程内索引覆盖的最近记录数（数据库搜索函数不可用时使用）
+HISTORY_SEARCH_INDEX_TTL = 600  # 进程内索引的有效期（秒），写入该用户的历史记录时立即失效
+HISTORY_SEARCH_FUNCTION_RECHECK = 300  # 数据库搜索函数不存在时，多久后再尝试调用（秒）
+
+# 用户资料缓存配置（profile和订阅信息，按用户ID缓存）
+PROFILE_CACHE_MAX_BYTES = 4 * 1024 * 1024  # 每个缓存的容量上限
+PROFILE_CACHE_TTL = 300  # profile有效期（秒），更新profile时立即刷新
+SUBSCRIPTION_CACHE_TTL = 600  # 订阅信息有效期（秒）
+PROFILE_NEGATIVE_CACHE_TTL = 60  # 不存在的profile或订阅的缓存有效期（秒）
+
+# 用户使用计数配置（历史记录总数和使用统计直接读取计数）
+USER_STATS_CACHE_MAX_BYTES = 8 * 1024 * 1024  # 计数快照缓存容量上限
+USER_STATS_CACHE_TTL = 300  # 计数快照有效期（秒），过期后重新从 user_stats 读取
+USER_STATS_FLUSH_INTERVAL = 5  # 计数增量合并到数据库的间隔（秒）
+
+# 用户使用统计配置
+USER_STATS_RECENT_DAYS = 7  # 近期使用统计的天数
+USER_STATS_MODES = ("general", "business", "drawing", "academic", "thinking")  # 数据库统计函数不可用时逐个精确计数的模式，其余计入 unknown
 
 # 辅助函数
 def is_gemini_model(model: str) -> bool:
@@ -0,0 +1,36 @@
+"""
+通用路由依赖模块
+"""
+from fastapi import Depends, Request
+from typing import Optional
+
+from .config import get_settings, Settings
+from .auth import get_optional_user, User
+from .limiter import get_real_ip
+from .services.scheduler import LLMFlow, set_llm_flow, resolve_user_weight
+from .services.job_queue import QuickAnswerJobQueue, init_job_queue
+
+
+def get_requester_id(
+    request: Request,
+    user: Optional[User] = Depends(get_optional_user)
+) -> str:
+    """获取请求者标识（已登录用户按用户ID，匿名用户按IP）"""
+    if user and user.id:
+        return f"user:{user.id}"
+    return f"ip:{get_real_ip(request)}"
+
+
+async def bind_llm_flow(
+    settings: Settings = Depends(get_settings),
+    user: Optional[User] = Depends(get_optional_user),
+    requester_id: str = Depends(get_requester_id)
+) -> None:
+    """将当前请求绑定到LLM公平调度队列"""
+    weight = await resolve_user_weight(settings, user)
+    set_llm_flow(LLMFlow(requester_id, weight))
+
+
+async def get_job_queue(settings: Settings = Depends(get_settings)) -> QuickAnswerJobQueue:
+    """获取快速回答任务队列"""
+    return await init_job_queue(settings)
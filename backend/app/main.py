@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from slowapi import _rate_limit_exceeded_handler
@@ -6,16 +7,47 @@ from slowapi.middleware import SlowAPIMiddleware
 
 from .config import get_settings
 from .limiter import limiter  # 导入limiter实例
-from .routers import health, models, optimize, history, debug, user, quick_answer
+from .routers import health, models, optimize, history, debug, user, quick_answer, metrics
+from .services.llm_service import init_llm_clients, close_llm_clients
+from .services.supabase_service import init_supabase_client, close_supabase_client
+from .services.job_queue import init_job_queue, close_job_queue
+from .services.history_writer import init_history_writer, close_history_writer
+from .services.history_spool import init_history_replayer, close_history_replayer
+from .services.history_counter import history_counter
 
 # 获取配置
 settings = get_settings()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期：启动时创建共享资源，关闭时释放"""
+    # 每个LLM提供商创建一个长连接、带连接池的异步客户端
+    init_llm_clients(settings)
+    # 进程内共享一个Supabase客户端（HTTP/2 长连接）
+    init_supabase_client(settings)
+    # 快速回答任务队列的后台工作协程
+    await init_job_queue(settings)
+    # 历史记录后台批量写入本地暂存区，再同步到Supabase
+    init_history_writer(settings)
+    init_history_replayer(settings)
+    # 用户使用计数定期合并到 user_stats
+    history_counter.start()
+    yield
+    await close_job_queue()
+    await close_history_writer()
+    await close_history_replayer()
+    await history_counter.close()
+    close_supabase_client()
+    await close_llm_clients()
+
+
 # 创建FastAPI应用
 app = FastAPI(
     title=settings.app_title,
     description=settings.app_description,
-    version=settings.app_version
+    version=settings.app_version,
+    lifespan=lifespan
 )
 
 # 将 limiter 添加到应用状态
@@ -45,6 +77,7 @@ app.include_router(history.router)
 app.include_router(debug.router)
 app.include_router(user.router)
 app.include_router(quick_answer.router)
+app.include_router(metrics.router)
 
 
 @app.get("/")
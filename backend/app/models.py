@@ -1,8 +1,9 @@
 """
 Pydantic数据模型定义
 """
+from typing import Optional
 from pydantic import BaseModel, Field
-from .constants import DEFAULT_MODEL
+from .constants import DEFAULT_MODEL, BATCH_MAX_ITEMS, BATCH_DEFAULT_PARALLELISM, BATCH_MAX_PARALLELISM
 
 
 class PromptRequest(BaseModel):
@@ -10,6 +11,13 @@ class PromptRequest(BaseModel):
     original_prompt: str = Field(..., max_length=2000, description="原始提示词，最大长度2000")
     model: str = DEFAULT_MODEL
     mode: str = "general"  # 可选值: general, business, drawing, academic, thinking
+    bypass_cache: bool = Field(False, description="跳过结果缓存，强制重新生成")
+
+
+class BatchOptimizeRequest(BaseModel):
+    """批量优化请求模型"""
+    items: list[PromptRequest] = Field(..., min_length=1, max_length=BATCH_MAX_ITEMS, description=f"待优化的提示词列表，最多{BATCH_MAX_ITEMS}条")
+    parallelism: int = Field(BATCH_DEFAULT_PARALLELISM, ge=1, le=BATCH_MAX_PARALLELISM, description="最大并行优化数")
 
 
 class PromptResponse(BaseModel):
@@ -88,3 +96,13 @@ class QuickAnswerResponse(BaseModel):
     final_answer: str = Field(..., description="最终回答")
     model_used: str = Field(..., description="使用的模型")
     success: bool = True
+
+
+class QuickAnswerJobResponse(BaseModel):
+    """快速回答任务状态模型"""
+    job_id: str = Field(..., description="任务ID")
+    status: str = Field(..., description="任务状态: queued, running, succeeded, failed")
+    created_at: float = Field(..., description="提交时间（Unix时间戳）")
+    updated_at: float = Field(..., description="最近更新时间（Unix时间戳）")
+    result: Optional[QuickAnswerResponse] = Field(None, description="任务成功时的回答")
+    error: Optional[str] = Field(None, description="任务失败时的错误信息")
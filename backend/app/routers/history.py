@@ -2,13 +2,23 @@
 历史记录路由
 """
 from fastapi import APIRouter, Depends, Request, Query, HTTPException, Response
-from typing import List, Optional
+from fastapi.responses import StreamingResponse
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple, Union
 from datetime import datetime
+import asyncio
+import base64
+import csv
+import io
+import json
+import re
 from pydantic import BaseModel, Field
 
-from ..config import get_settings, Settings
-from ..auth import get_current_user, get_optional_user, get_authenticated_user, User
-from ..services.supabase_service import SupabaseService
+from ..auth import get_optional_user, get_authenticated_user, User
+from ..services.supabase_service import SupabaseService, get_supabase_service
+from ..services.history_counter import history_counter
+from ..services.history_search import HistorySearch, get_history_search
+from ..constants import HISTORY_PREVIEW_CHARS, HISTORY_EXPORT_CHUNK_SIZE, HISTORY_SEARCH_MAX_QUERY_LENGTH
+from ..streaming import NDJSON_MEDIA_TYPE, ndjson_line, gzip_stream
 
 router = APIRouter(prefix="/api", tags=["history"])
 
@@ -24,6 +34,19 @@ class OptimizationHistoryItem(BaseModel):
     user_type: str = Field(..., description="用户类型")
 
 
+class OptimizationHistorySummary(BaseModel):
+    """优化历史记录摘要模型（列表视图，只包含预览，完整内容通过 /api/history/{id} 获取）"""
+    id: int = Field(..., description="记录ID")
+    user_id: Optional[str] = Field(None, description="用户ID")
+    original_preview: str = Field(..., description="原始提示词预览")
+    optimized_preview: str = Field(..., description="优化后的提示词预览")
+    original_length: int = Field(..., description="原始提示词字符数")
+    optimized_length: int = Field(..., description="优化后的提示词字符数")
+    mode: str = Field(..., description="优化模式")
+    created_at: str = Field(..., description="创建时间")
+    user_type: str = Field(..., description="用户类型")
+
+
 class HistoryResponse(BaseModel):
     """历史记录响应模型"""
     data: List[OptimizationHistoryItem] = Field(..., description="历史记录列表")
@@ -33,23 +56,136 @@ class HistoryResponse(BaseModel):
     total_pages: int = Field(..., description="总页数")
 
 
-@router.get("/history", response_model=List[OptimizationHistoryItem])
+class HistoryCursorResponse(BaseModel):
+    """历史记录游标分页响应模型"""
+    data: Union[List[OptimizationHistoryItem], List[OptimizationHistorySummary]] = Field(..., description="历史记录列表")
+    next_cursor: Optional[str] = Field(None, description="下一页游标，没有更多记录时为空")
+
+
+# 游标中的时间戳：PostgREST返回的ISO 8601时间，小数位数不固定（末尾的0会被去掉）
+_CURSOR_TIMESTAMP_PATTERN = re.compile(
+    r"\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}(\.\d{1,9})?(Z|[+-]\d{2}(:?\d{2})?)?"
+)
+
+
+def encode_history_cursor(item: Dict[str, Any]) -> str:
+    """根据一页最后一条记录生成不透明游标（created_at + id）"""
+    payload = json.dumps([item["created_at"], item["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_history_cursor(cursor: str) -> Tuple[str, int]:
+    """解析游标，返回 (created_at, id)"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        # 只校验格式，原样交给PostgREST比较（datetime.fromisoformat 在Python 3.9中不接受1-5位小数）
+        if not isinstance(created_at, str) or not _CURSOR_TIMESTAMP_PATTERN.fullmatch(created_at):
+            raise ValueError(created_at)
+        return created_at, int(item_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="游标无效")
+
+
+def _format_history_item(item: Dict[str, Any]) -> OptimizationHistoryItem:
+    return OptimizationHistoryItem(
+        id=item.get("id"),
+        user_id=item.get("user_id"),
+        original_prompt=item.get("original_prompt", ""),
+        optimized_prompt=item.get("optimized_prompt", ""),
+        mode=item.get("mode", "general"),
+        created_at=item.get("created_at", ""),
+        user_type=item.get("user_type", "authenticated")
+    )
+
+
+def _format_history_items(
+    items: List[Dict[str, Any]],
+    view: str
+) -> Union[List[OptimizationHistoryItem], List[OptimizationHistorySummary]]:
+    """按视图格式化历史记录列表：full 返回完整记录，summary 返回摘要"""
+    if view == "summary":
+        return [
+            OptimizationHistorySummary(**_summarize_history_item(_format_history_item(item).model_dump()))
+            for item in items
+        ]
+    return [_format_history_item(item) for item in items]
+
+
+def _preview(text: Optional[str]) -> str:
+    text = text or ""
+    return text if len(text) <= HISTORY_PREVIEW_CHARS else text[:HISTORY_PREVIEW_CHARS] + "…"
+
+
+def _summarize_history_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """把完整记录转换为摘要：提示词只保留预览和字符数"""
+    summary = {
+        key: value for key, value in item.items()
+        if key not in ("original_prompt", "optimized_prompt")
+    }
+    summary.update(
+        original_preview=_preview(item.get("original_prompt")),
+        optimized_preview=_preview(item.get("optimized_prompt")),
+        original_length=len(item.get("original_prompt") or ""),
+        optimized_length=len(item.get("optimized_prompt") or "")
+    )
+    return summary
+
+
+# 导出文件包含的字段（按顺序）
+_EXPORT_COLUMNS = ("id", "created_at", "mode", "user_type", "original_prompt", "optimized_prompt")
+
+
+def _csv_bytes(rows: Iterable[Iterable[Any]]) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode("utf-8")
+
+
+def _encode_export_chunk(rows: List[Dict[str, Any]], export_format: str) -> bytes:
+    """把一批历史记录编码为CSV行或NDJSON行"""
+    if export_format == "csv":
+        return _csv_bytes([row.get(column) for column in _EXPORT_COLUMNS] for row in rows)
+    return "".join(
+        ndjson_line({column: row.get(column) for column in _EXPORT_COLUMNS}) for row in rows
+    ).encode("utf-8")
+
+
+def _default_session_id(request: Request) -> str:
+    """未提供session_id的匿名用户，根据IP生成默认session_id"""
+    client_ip = request.client.host if request.client else "unknown"
+    return f"anonymous_{client_ip}_{hash(client_ip) % 10000}"
+
+
+@router.get(
+    "/history",
+    response_model=Union[List[OptimizationHistoryItem], List[OptimizationHistorySummary], HistoryCursorResponse]
+)
 async def get_optimization_history_production(
     response: Response,
-    page: int = Query(1, ge=1, description="页码，从1开始"),
+    page: int = Query(1, ge=1, description="页码，从1开始（兼容模式）"),
     page_size: int = Query(20, ge=1, le=100, description="每页记录数，最大100"),
+    pagination: str = Query("page", pattern="^(page|cursor)$", description="分页方式：page（页码）或 cursor（游标）"),
+    cursor: Optional[str] = Query(None, description="游标分页：上一页返回的 next_cursor"),
+    view: str = Query("full", pattern="^(full|summary)$", description="返回内容：full（完整提示词）或 summary（预览和字符数）"),
+    count_mode: str = Query("exact", pattern="^(exact|estimated|none)$", description="总数计算方式：exact（精确计数，默认）、estimated（用户计数）、none（不计算）"),
     start_date: Optional[str] = Query(None, description="开始日期，ISO格式"),
     end_date: Optional[str] = Query(None, description="结束日期，ISO格式"),
     user: User = Depends(get_authenticated_user),
-    settings: Settings = Depends(get_settings)
+    supabase_service: SupabaseService = Depends(get_supabase_service)
 ):
     """
     获取用户优化历史记录（生产级别，仅支持已登录用户）
 
     - **认证要求**: 必须提供有效的JWT令牌
-    - **分页支持**: 支持分页查询，默认每页20条记录
-    - **排序**: 按创建时间降序排列（最新的在前）
-    - **响应头**: 包含总记录数信息
+    - **分页支持**: 默认按页码分页（兼容模式）；pagination=cursor 或提供 cursor 时按游标分页，
+      返回 {data, next_cursor}，翻页深度不影响查询速度，翻页期间新增记录也不会造成重复或遗漏
+    - **排序**: 按创建时间降序排列（最新的在前），时间相同按ID降序
+    - **总数**: 默认 exact，与当前页在同一次查询中精确计算；estimated 直接读取用户使用计数
+      （不带日期筛选时有效，可能与实际记录数略有偏差，响应头 X-Total-Count-Estimated: true）；none 时不返回总数
+    - **摘要视图**: view=summary 时提示词只返回前 HISTORY_PREVIEW_CHARS 个字符的预览和字符数，
+      完整内容通过 /api/history/{id} 获取
+    - **响应头**: 包含总记录数信息；X-Next-Cursor 为下一页游标（两种模式都提供）
     """
     try:
         # 验证用户ID
@@ -59,9 +195,6 @@ async def get_optimization_history_production(
                 detail="无法提取用户ID"
             )
 
-        # 创建Supabase服务实例
-        supabase_service = SupabaseService(settings)
-
         # 解析日期参数
         parsed_start_date = None
         parsed_end_date = None
@@ -78,45 +211,73 @@ async def get_optimization_history_production(
             except ValueError:
                 raise HTTPException(status_code=400, detail="结束日期格式无效")
 
-        # 获取用户历史记录（带分页和日期筛选）
-        history_data = await supabase_service.get_user_optimization_history_paginated(
-            user_id=str(user.id),
-            page=page,
-            page_size=page_size,
-            start_date=parsed_start_date,
-            end_date=parsed_end_date
-        )
+        user_id = str(user.id)
+        filtered = parsed_start_date is not None or parsed_end_date is not None
 
-        # 获取总记录数（带日期筛选）
-        total_count = await supabase_service.get_user_optimization_history_count(
-            user_id=str(user.id),
-            start_date=parsed_start_date,
-            end_date=parsed_end_date
-        )
+        # 总数：estimated 模式读取用户使用计数，没有计数时再精确计数
+        cached_total = None
+        if count_mode == "estimated" and not filtered:
+            cached_total = await history_counter.get_total(user_id)
+        need_count = count_mode != "none" and cached_total is None
+
+        use_cursor = pagination == "cursor" or cursor is not None
+        if use_cursor:
+            # 游标分页：多取一条判断是否还有下一页；游标条件会影响计数，总数与当前页并发查询
+            page_query = supabase_service.get_user_optimization_history_keyset(
+                user_id=user_id,
+                limit=page_size + 1,
+                after=decode_history_cursor(cursor) if cursor else None,
+                start_date=parsed_start_date,
+                end_date=parsed_end_date
+            )
+            if need_count:
+                history_data, total_count = await asyncio.gather(
+                    page_query,
+                    supabase_service.get_user_optimization_history_count(
+                        user_id=user_id,
+                        start_date=parsed_start_date,
+                        end_date=parsed_end_date
+                    )
+                )
+            else:
+                history_data, total_count = await page_query, None
+            has_more = len(history_data) > page_size
+        else:
+            # 页码分页（兼容模式）：当前页和总数在同一次查询中返回
+            history_data, total_count = await supabase_service.get_user_optimization_history_paginated(
+                user_id=user_id,
+                page=page,
+                page_size=page_size,
+                start_date=parsed_start_date,
+                end_date=parsed_end_date,
+                with_count=need_count
+            )
+            # 整页时可能还有下一页，提供游标便于客户端切换到游标分页
+            has_more = len(history_data) == page_size
+        history_data = history_data[:page_size]
+        next_cursor = encode_history_cursor(history_data[-1]) if has_more and history_data else None
 
-        # 计算总页数
-        total_pages = (total_count + page_size - 1) // page_size
+        if cached_total is not None:
+            total_count = cached_total
+            response.headers["X-Total-Count-Estimated"] = "true"
 
         # 设置响应头
-        response.headers["X-Total-Count"] = str(total_count)
-        response.headers["X-Total-Pages"] = str(total_pages)
-        response.headers["X-Current-Page"] = str(page)
+        if total_count is not None:
+            # 计算总页数
+            total_pages = (total_count + page_size - 1) // page_size
+            response.headers["X-Total-Count"] = str(total_count)
+            response.headers["X-Total-Pages"] = str(total_pages)
         response.headers["X-Page-Size"] = str(page_size)
+        if not use_cursor:
+            response.headers["X-Current-Page"] = str(page)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
 
         # 格式化响应数据
-        formatted_history = []
-        for item in history_data:
-            formatted_item = OptimizationHistoryItem(
-                id=item.get("id"),
-                user_id=item.get("user_id"),
-                original_prompt=item.get("original_prompt", ""),
-                optimized_prompt=item.get("optimized_prompt", ""),
-                mode=item.get("mode", "general"),
-                created_at=item.get("created_at", ""),
-                user_type=item.get("user_type", "authenticated")
-            )
-            formatted_history.append(formatted_item)
+        formatted_history = _format_history_items(history_data, view)
 
+        if use_cursor:
+            return HistoryCursorResponse(data=formatted_history, next_cursor=next_cursor)
         return formatted_history
 
     except HTTPException:
@@ -134,12 +295,11 @@ async def get_optimization_history_production(
 async def get_optimization_history_legacy(
     request: Request,
     session_id: Optional[str] = Query(None, description="匿名用户的会话ID"),
+    view: str = Query("full", pattern="^(full|summary)$", description="返回内容：full（完整提示词）或 summary（预览和字符数）"),
     user: Optional[User] = Depends(get_optional_user),
-    settings: Settings = Depends(get_settings)
+    supabase_service: SupabaseService = Depends(get_supabase_service)
 ):
-    """获取优化历史记录（兼容旧版本，支持已登录用户和匿名用户）"""
-    supabase_service = SupabaseService(settings)
-
+    """获取优化历史记录（兼容旧版本，支持已登录用户和匿名用户；view=summary 时只返回预览）"""
     if user and user.id:
         # 已登录用户，获取用户的历史记录
         history = await supabase_service.get_user_optimization_history(user_id=str(user.id))
@@ -150,13 +310,109 @@ async def get_optimization_history_legacy(
         user_type = "anonymous"
     else:
         # 如果没有提供session_id，尝试根据IP生成默认session_id
-        client_ip = request.client.host if request.client else "unknown"
-        default_session_id = f"anonymous_{client_ip}_{hash(client_ip) % 10000}"
-        history = await supabase_service.get_user_optimization_history(session_id=default_session_id)
+        history = await supabase_service.get_user_optimization_history(session_id=_default_session_id(request))
         user_type = "anonymous"
 
+    if view == "summary":
+        history = [_summarize_history_item(item) for item in history]
+
     return {
         "history": history,
         "total": len(history),
         "user_type": user_type
     }
+
+
+@router.get("/history/{history_id:int}", response_model=OptimizationHistoryItem)
+async def get_optimization_history_item(
+    history_id: int,
+    request: Request,
+    session_id: Optional[str] = Query(None, description="匿名用户的会话ID"),
+    user: Optional[User] = Depends(get_optional_user),
+    supabase_service: SupabaseService = Depends(get_supabase_service)
+):
+    """获取一条完整的历史记录（摘要列表中的详情按需加载，只能读取本人或本会话的记录）"""
+    if user and user.id:
+        item = await supabase_service.get_optimization_history_item(history_id, user_id=str(user.id))
+    else:
+        item = await supabase_service.get_optimization_history_item(
+            history_id, session_id=session_id or _default_session_id(request)
+        )
+
+    if item is None:
+        raise HTTPException(status_code=404, detail="历史记录不存在")
+    return _format_history_item(item)
+
+
+@router.get("/history/search", response_model=Union[List[OptimizationHistoryItem], List[OptimizationHistorySummary]])
+async def search_optimization_history(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=HISTORY_SEARCH_MAX_QUERY_LENGTH, description="搜索内容，多个词用空格分隔"),
+    page: int = Query(1, ge=1, description="页码，从1开始"),
+    page_size: int = Query(20, ge=1, le=100, description="每页记录数，最大100"),
+    view: str = Query("full", pattern="^(full|summary)$", description="返回内容：full（完整提示词）或 summary（预览和字符数）"),
+    user: User = Depends(get_authenticated_user),
+    history_search: HistorySearch = Depends(get_history_search)
+):
+    """
+    搜索当前用户的优化历史记录（仅支持已登录用户）
+
+    - **匹配**: 每个搜索词都必须出现在原始或优化后的提示词中（不区分大小写）
+    - **排序**: 按相关度降序，相同时最新的在前
+    - **响应头**: X-Total-Count 为匹配总数，分页信息与 /api/history 相同
+    """
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="搜索内容不能为空")
+
+    results, total_count = await history_search.search(str(user.id), q, page, page_size)
+
+    response.headers["X-Total-Count"] = str(total_count)
+    response.headers["X-Total-Pages"] = str((total_count + page_size - 1) // page_size)
+    response.headers["X-Page-Size"] = str(page_size)
+    response.headers["X-Current-Page"] = str(page)
+
+    return _format_history_items(results, view)
+
+
+@router.get("/history/export")
+async def export_optimization_history(
+    export_format: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$", description="导出格式：ndjson 或 csv"),
+    compress: bool = Query(False, alias="gzip", description="是否gzip压缩导出文件"),
+    user: User = Depends(get_authenticated_user),
+    supabase_service: SupabaseService = Depends(get_supabase_service)
+) -> StreamingResponse:
+    """
+    导出当前用户的全部优化历史记录（仅支持已登录用户）
+
+    按游标分页每次从数据库读取 HISTORY_EXPORT_CHUNK_SIZE 行，边读边写出，
+    占用的内存与历史记录总量无关；gzip=true 时边写出边压缩，下载文件为 .gz
+    """
+    chunks = supabase_service.iter_user_optimization_history(str(user.id), HISTORY_EXPORT_CHUNK_SIZE)
+    # 第一批在响应开始前读取，数据库不可用时返回普通的HTTP错误
+    try:
+        first_rows = await chunks.__anext__()
+    except StopAsyncIteration:
+        first_rows = []
+
+    async def export_body() -> AsyncIterator[bytes]:
+        if export_format == "csv":
+            # 带BOM，便于Excel按UTF-8识别中文
+            yield "\ufeff".encode("utf-8") + _csv_bytes([_EXPORT_COLUMNS])
+        if first_rows:
+            yield _encode_export_chunk(first_rows, export_format)
+        async for rows in chunks:
+            yield _encode_export_chunk(rows, export_format)
+
+    filename = f"optimization-history-{datetime.now().strftime('%Y%m%d')}.{export_format}"
+    media_type = "text/csv; charset=utf-8" if export_format == "csv" else NDJSON_MEDIA_TYPE
+    body = export_body()
+    if compress:
+        filename += ".gz"
+        media_type = "application/gzip"
+        body = gzip_stream(body)
+
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
@@ -0,0 +1,54 @@
+"""
+运行指标路由
+只在设置了 METRICS_TOKEN 时开放，请求需携带 Authorization: Bearer <METRICS_TOKEN>
+"""
+import hmac
+from fastapi import APIRouter, Depends, HTTPException, Request
+from typing import Dict, Any
+
+from ..config import Settings, get_settings
+from ..limiter import limiter
+
+from ..services.llm_service import llm_result_cache, llm_single_flight, llm_router, llm_retry_budget
+from ..services.resilience import circuit_breaker_stats
+from ..services.admission import admission_stats
+from ..services.job_queue import job_queue_stats
+from ..services.history_writer import history_writer_stats
+from ..services.history_spool import history_replayer_stats
+from ..services.history_counter import history_counter
+from ..services.history_cache import history_cache
+from ..services.supabase_service import profile_cache, subscription_cache
+
+router = APIRouter(prefix="/api", tags=["metrics"])
+
+
+def require_metrics_token(request: Request, settings: Settings = Depends(get_settings)) -> None:
+    """校验运行指标接口的访问令牌"""
+    if not settings.metrics_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+    authorization = request.headers.get("Authorization", "")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), settings.metrics_token.encode()):
+        raise HTTPException(status_code=401, detail="无效的访问令牌", headers={"WWW-Authenticate": "Bearer"})
+
+
+@router.get("/metrics", dependencies=[Depends(require_metrics_token)])
+@limiter.limit(lambda: get_settings().rate_limit)
+async def get_metrics(request: Request) -> Dict[str, Any]:
+    """获取进程内运行指标（缓存命中率、请求合并等）"""
+    return {
+        "llm_cache": llm_result_cache.stats(),
+        "llm_single_flight": llm_single_flight.stats(),
+        "llm_router": llm_router.stats(),
+        "llm_retry_budget": llm_retry_budget.stats(),
+        "circuit_breakers": circuit_breaker_stats(),
+        "admission": admission_stats(),
+        "quick_answer_jobs": job_queue_stats(),
+        "history_writer": history_writer_stats(),
+        "history_spool": history_replayer_stats(),
+        "user_stats": history_counter.stats(),
+        "history_cache": history_cache.stats(),
+        "profile_cache": profile_cache.stats(),
+        "subscription_cache": subscription_cache.stats()
+    }
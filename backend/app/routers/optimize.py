@@ -2,76 +2,115 @@
 提示词优化路由
 """
 from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
 from typing import Optional
 
 from ..limiter import limiter
-from ..config import get_settings, Settings
-from ..models import PromptRequest, PromptResponse, ThinkingAnalysisResponse, ThinkingOptimizationRequest, QuickOptionsRequest, QuickOptionsResponse
-from ..services.prompt_service import PromptService
-from ..auth import get_optional_user, User
+from ..config import get_settings
+from ..models import BatchOptimizeRequest, PromptRequest, PromptResponse, ThinkingAnalysisResponse, ThinkingOptimizationRequest, QuickOptionsRequest, QuickOptionsResponse
+from ..services.prompt_service import PromptService, get_prompt_service
+from ..auth import get_optional_user, get_authenticated_user, User
+from ..dependencies import bind_llm_flow
+from ..streaming import SSE_HEADERS, NDJSON_MEDIA_TYPE, prime_event_stream
 
 router = APIRouter(prefix="/api", tags=["optimize"])
 
 
-@router.post("/optimize", response_model=PromptResponse)
+@router.post("/optimize", response_model=PromptResponse, dependencies=[Depends(bind_llm_flow)])
 @limiter.limit(lambda: get_settings().rate_limit)
 async def optimize_prompt(
     request: Request,
     request_body: PromptRequest,
-    settings: Settings = Depends(get_settings),
+    prompt_service: PromptService = Depends(get_prompt_service),
     user: Optional[User] = Depends(get_optional_user)
 ):
     """优化提示词的API端点"""
     # 获取客户端IP地址
     client_ip = request.client.host if request.client else "unknown"
 
-    prompt_service = PromptService(settings)
     return await prompt_service.optimize_prompt(request_body, user, client_ip)
 
 
-@router.post("/thinking/analyze", response_model=ThinkingAnalysisResponse)
+@router.post("/optimize/stream", dependencies=[Depends(bind_llm_flow)])
+@limiter.limit(lambda: get_settings().rate_limit)
+async def optimize_prompt_stream(
+    request: Request,
+    request_body: PromptRequest,
+    prompt_service: PromptService = Depends(get_prompt_service),
+    user: Optional[User] = Depends(get_optional_user)
+):
+    """优化提示词的流式API端点（Server-Sent Events）
+
+    事件类型：delta（增量文本）、done（完整结果）、error（错误信息）
+    """
+    # 获取客户端IP地址
+    client_ip = request.client.host if request.client else "unknown"
+
+    event_stream = prompt_service.optimize_prompt_stream(request_body, user, client_ip)
+    event_stream = await prime_event_stream(event_stream)
+    return StreamingResponse(event_stream, media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@router.post("/optimize/batch", dependencies=[Depends(bind_llm_flow)])
+@limiter.limit(lambda: get_settings().rate_limit)
+async def optimize_prompt_batch(
+    request: Request,
+    request_body: BatchOptimizeRequest,
+    prompt_service: PromptService = Depends(get_prompt_service),
+    user: User = Depends(get_authenticated_user)
+):
+    """批量优化提示词的API端点（仅支持已登录用户，一次请求最多触发 BATCH_MAX_ITEMS 次上游调用）
+
+    条目按 parallelism 并发优化，每完成一条即输出一行NDJSON（按完成顺序，
+    以 index 对应输入位置），最后一行为汇总；历史记录在批次结束时批量写入。
+    """
+    # 获取客户端IP地址
+    client_ip = request.client.host if request.client else "unknown"
+
+    results = prompt_service.optimize_prompt_batch(request_body.items, user, client_ip, request_body.parallelism)
+    return StreamingResponse(results, media_type=NDJSON_MEDIA_TYPE)
+
+
+@router.post("/thinking/analyze", response_model=ThinkingAnalysisResponse, dependencies=[Depends(bind_llm_flow)])
 @limiter.limit(lambda: get_settings().rate_limit)
 async def analyze_thinking_prompt(
     request: Request,
     request_body: PromptRequest,
-    settings: Settings = Depends(get_settings),
+    prompt_service: PromptService = Depends(get_prompt_service),
     user: Optional[User] = Depends(get_optional_user)
 ):
     """思考模式第一阶段：分析提示词缺失信息"""
     # 获取客户端IP地址
     client_ip = request.client.host if request.client else "unknown"
 
-    prompt_service = PromptService(settings)
     return await prompt_service.analyze_thinking_prompt(request_body, user, client_ip)
 
 
-@router.post("/thinking/optimize", response_model=PromptResponse)
+@router.post("/thinking/optimize", response_model=PromptResponse, dependencies=[Depends(bind_llm_flow)])
 @limiter.limit(lambda: get_settings().rate_limit)
 async def optimize_thinking_prompt(
     request: Request,
     request_body: ThinkingOptimizationRequest,
-    settings: Settings = Depends(get_settings),
+    prompt_service: PromptService = Depends(get_prompt_service),
     user: Optional[User] = Depends(get_optional_user)
 ):
     """思考模式第二阶段：基于补充信息优化提示词"""
     # 获取客户端IP地址
     client_ip = request.client.host if request.client else "unknown"
 
-    prompt_service = PromptService(settings)
     return await prompt_service.optimize_thinking_prompt(request_body, user, client_ip)
 
 
-@router.post("/generate-quick-options", response_model=QuickOptionsResponse)
+@router.post("/generate-quick-options", response_model=QuickOptionsResponse, dependencies=[Depends(bind_llm_flow)])
 @limiter.limit(lambda: get_settings().rate_limit)
 async def generate_quick_options(
     request: Request,
     request_body: QuickOptionsRequest,
-    settings: Settings = Depends(get_settings),
+    prompt_service: PromptService = Depends(get_prompt_service),
     user: Optional[User] = Depends(get_optional_user)
 ):
     """使用Gemini生成快速选择选项"""
     # 获取客户端IP地址
     client_ip = request.client.host if request.client else "unknown"
 
-    prompt_service = PromptService(settings)
     return await prompt_service.generate_quick_options(request_body, user, client_ip)
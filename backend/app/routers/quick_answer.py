@@ -3,36 +3,36 @@
 处理基于优化提示词的快速回答请求
 """
 from fastapi import APIRouter, HTTPException, Depends
-from typing import Dict, Any
-import json
+from fastapi.responses import StreamingResponse
+from typing import Dict, Any, AsyncIterator
 
-from ..config import get_settings
-from ..models import QuickAnswerRequest, QuickAnswerResponse
-from ..services.quick_answer_service import QuickAnswerService
+from ..constants import JOB_EVENTS_HEARTBEAT
+from ..models import QuickAnswerRequest, QuickAnswerResponse, QuickAnswerJobResponse
+from ..dependencies import bind_llm_flow, get_requester_id, get_job_queue
+from ..services.quick_answer_service import QuickAnswerService, get_quick_answer_service
+from ..services.job_queue import QuickAnswerJobQueue, JOB_FINISHED_STATES, JOB_SUCCEEDED
+from ..streaming import SSE_HEADERS, sse_event, prime_event_stream
 
 # 创建路由器
 router = APIRouter(prefix="/api/quick-answer", tags=["quick-answer"])
 
 
-@router.post("/", response_model=QuickAnswerResponse)
+@router.post("/", response_model=QuickAnswerResponse, dependencies=[Depends(bind_llm_flow)])
 async def generate_quick_answer(
     request: QuickAnswerRequest,
-    settings = Depends(get_settings)
+    quick_answer_service: QuickAnswerService = Depends(get_quick_answer_service)
 ) -> QuickAnswerResponse:
     """
     基于优化后的提示词生成快速回答
     
     Args:
         request: 快速回答请求数据
-        settings: 应用配置
+        quick_answer_service: 快速回答服务
     
     Returns:
         包含思维过程和最终答案的响应
     """
     try:
-        # 创建快速回答服务实例
-        quick_answer_service = QuickAnswerService(settings)
-        
         # 生成快速回答
         result = await quick_answer_service.generate_answer(
             prompt=request.prompt,
@@ -48,6 +48,8 @@ async def generate_quick_answer(
         
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"快速回答生成错误: {str(e)}")
         raise HTTPException(
@@ -56,6 +58,118 @@ async def generate_quick_answer(
         )
 
 
+@router.post("/stream", dependencies=[Depends(bind_llm_flow)])
+async def generate_quick_answer_stream(
+    request: QuickAnswerRequest,
+    quick_answer_service: QuickAnswerService = Depends(get_quick_answer_service)
+) -> StreamingResponse:
+    """
+    流式生成快速回答（Server-Sent Events）
+    
+    Args:
+        request: 快速回答请求数据
+        quick_answer_service: 快速回答服务
+    
+    Returns:
+        SSE事件流，最后一个 done 事件包含与非流式接口相同的
+        thinking_process / final_answer / model_used 汇总
+    """
+    try:
+        event_stream = quick_answer_service.generate_answer_stream(
+            prompt=request.prompt,
+            model=request.model or "deepseek-v4-flash"
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # 等待首个事件后再返回响应，过载等错误以HTTP状态码返回
+    event_stream = await prime_event_stream(event_stream)
+    return StreamingResponse(event_stream, media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+def _job_response(job: Dict[str, Any]) -> QuickAnswerJobResponse:
+    """将任务记录转换为响应模型"""
+    result = job["result"]
+    return QuickAnswerJobResponse(
+        job_id=job["id"],
+        status=job["status"],
+        created_at=job["created_at"],
+        updated_at=job["updated_at"],
+        result=QuickAnswerResponse(**result) if result else None,
+        error=job["error"]
+    )
+
+
+@router.post("/jobs", response_model=QuickAnswerJobResponse, status_code=202, dependencies=[Depends(bind_llm_flow)])
+async def submit_quick_answer_job(
+    request: QuickAnswerRequest,
+    requester_id: str = Depends(get_requester_id),
+    job_queue: QuickAnswerJobQueue = Depends(get_job_queue)
+) -> QuickAnswerJobResponse:
+    """
+    提交快速回答任务，立即返回任务ID
+
+    通过 GET /api/quick-answer/jobs/{job_id} 轮询结果，
+    或订阅 GET /api/quick-answer/jobs/{job_id}/events 事件流
+    """
+    job = await job_queue.submit(
+        owner=requester_id,
+        prompt=request.prompt,
+        model=request.model or "deepseek-v4-flash"
+    )
+    return _job_response(job)
+
+
+@router.get("/jobs/{job_id}", response_model=QuickAnswerJobResponse)
+async def get_quick_answer_job(
+    job_id: str,
+    requester_id: str = Depends(get_requester_id),
+    job_queue: QuickAnswerJobQueue = Depends(get_job_queue)
+) -> QuickAnswerJobResponse:
+    """查询快速回答任务状态和结果"""
+    job = await job_queue.get(job_id, requester_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+    return _job_response(job)
+
+
+@router.get("/jobs/{job_id}/events")
+async def subscribe_quick_answer_job(
+    job_id: str,
+    requester_id: str = Depends(get_requester_id),
+    job_queue: QuickAnswerJobQueue = Depends(get_job_queue)
+) -> StreamingResponse:
+    """
+    订阅快速回答任务事件（Server-Sent Events）
+
+    状态变化时推送 status 事件，任务结束时推送 done 或 error 事件后关闭连接
+    """
+    job = await job_queue.get(job_id, requester_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在或已过期")
+
+    async def job_events(job: Dict[str, Any]) -> AsyncIterator[str]:
+        last_status = None
+        while True:
+            if job["status"] in JOB_FINISHED_STATES:
+                data = _job_response(job).model_dump()
+                yield sse_event("done" if job["status"] == JOB_SUCCEEDED else "error", data)
+                return
+            if job["status"] != last_status:
+                last_status = job["status"]
+                yield sse_event("status", {"job_id": job_id, "status": last_status})
+            else:
+                # 心跳注释，防止代理断开空闲连接
+                yield ": keepalive\n\n"
+            await job_queue.wait(job_id, timeout=JOB_EVENTS_HEARTBEAT)
+            job = await job_queue.get(job_id, requester_id)
+            if job is None:
+                yield sse_event("error", {"job_id": job_id, "error": "任务不存在或已过期"})
+                return
+
+    return StreamingResponse(job_events(job), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
 @router.get("/models")
 async def get_supported_models() -> Dict[str, Any]:
     """
@@ -3,11 +3,12 @@
 """
 from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import Dict, Any, Optional
+import asyncio
 from pydantic import BaseModel, Field, EmailStr
 
-from ..config import get_settings, Settings
 from ..auth import get_current_user, User
-from ..services.supabase_service import SupabaseService
+from ..services.supabase_service import SupabaseService, get_supabase_service
+from ..services.history_stats import get_history_stats
 
 router = APIRouter(prefix="/api", tags=["user"])
 
@@ -15,7 +16,7 @@ router = APIRouter(prefix="/api", tags=["user"])
 @router.get("/check-email")
 async def check_email_exists(
     email: str = Query(..., description="要检查的邮箱地址"),
-    settings: Settings = Depends(get_settings)
+    supabase_service: SupabaseService = Depends(get_supabase_service)
 ) -> Dict[str, Any]:
     """检查邮箱是否已存在"""
     try:
@@ -29,7 +30,6 @@ async def check_email_exists(
         # 标准化邮箱地址
         normalized_email = email.lower().strip()
         
-        supabase_service = SupabaseService(settings)
         result = await supabase_service.check_email_exists(normalized_email)
         
         # 添加邮箱地址到结果中
@@ -59,17 +59,15 @@ class ProfileUpdateRequest(BaseModel):
 @router.get("/user/profile")
 async def get_user_profile(
     user: User = Depends(get_current_user),
-    settings: Settings = Depends(get_settings)
+    supabase_service: SupabaseService = Depends(get_supabase_service)
 ) -> Dict[str, Any]:
     """获取当前用户的profile信息"""
-    supabase_service = SupabaseService(settings)
-    
-    # 获取用户profile
-    profile = await supabase_service.get_user_profile(str(user.id))
-    
-    # 获取用户订阅信息
-    subscription = await supabase_service.get_user_subscription(str(user.id))
-    
+    # 并发获取用户profile和订阅信息
+    profile, subscription = await asyncio.gather(
+        supabase_service.get_user_profile(str(user.id)),
+        supabase_service.get_user_subscription(str(user.id))
+    )
+
     return {
         "user_id": str(user.id),
         "email": user.email,
@@ -81,57 +79,20 @@ async def get_user_profile(
 @router.get("/user/stats")
 async def get_user_stats(
     user: User = Depends(get_current_user),
-    settings: Settings = Depends(get_settings)
+    history_stats = Depends(get_history_stats)
 ) -> Dict[str, Any]:
-    """获取用户的使用统计信息"""
-    supabase_service = SupabaseService(settings)
-    
-    # 获取历史记录
-    history = await supabase_service.get_user_optimization_history(str(user.id), limit=1000)
-    
-    # 统计信息
-    total_optimizations = len(history)
-    
-    # 按模式统计
-    mode_stats = {}
-    for record in history:
-        mode = record.get('mode', 'unknown')
-        mode_stats[mode] = mode_stats.get(mode, 0) + 1
-    
-    # 最近7天的使用情况（简单统计）
-    from datetime import datetime, timedelta
-    seven_days_ago = datetime.now() - timedelta(days=7)
-    recent_count = 0
-    
-    for record in history:
-        created_at = record.get('created_at')
-        if created_at:
-            # 简单的日期比较（实际项目中应该用更精确的日期解析）
-            try:
-                record_date = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
-                if record_date >= seven_days_ago:
-                    recent_count += 1
-            except:
-                pass
-    
-    return {
-        "total_optimizations": total_optimizations,
-        "recent_7_days": recent_count,
-        "mode_statistics": mode_stats,
-        "last_optimization": history[0] if history else None
-    }
+    """获取用户的使用统计信息（总数、按模式统计和最近7天的数量在数据库中聚合）"""
+    return await history_stats.get_user_stats(str(user.id))
 
 
 @router.put("/profile")
 async def update_user_profile(
     profile_data: ProfileUpdateRequest,
     user: User = Depends(get_current_user),
-    settings: Settings = Depends(get_settings)
+    supabase_service: SupabaseService = Depends(get_supabase_service)
 ) -> Dict[str, Any]:
     """更新当前用户的profile信息"""
     try:
-        supabase_service = SupabaseService(settings)
-
         # 验证用户ID
         if not user.id:
             raise HTTPException(
@@ -153,18 +114,15 @@ async def update_user_profile(
                 detail="没有提供要更新的数据"
             )
 
-        # 更新用户profile
-        success = await supabase_service.update_user_profile(str(user.id), update_data)
+        # 更新用户profile（一次请求完成更新或创建，并返回更新后的profile）
+        updated_profile = await supabase_service.update_user_profile(str(user.id), update_data)
 
-        if not success:
+        if updated_profile is None:
             raise HTTPException(
                 status_code=500,
                 detail="更新用户信息失败"
             )
 
-        # 获取更新后的profile信息
-        updated_profile = await supabase_service.get_user_profile(str(user.id))
-
         return {
             "success": True,
             "message": "用户信息更新成功",
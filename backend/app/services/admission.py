@@ -0,0 +1,192 @@
+"""
+准入控制模块
+按提供商限制并发的上游LLM调用，排队有上限和超时，超限时快速返回503；
+排队请求按用户加权公平调度
+"""
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List
+from fastapi import HTTPException
+
+from ..constants import (
+    LLM_PROVIDER_CONCURRENCY, LLM_DEFAULT_CONCURRENCY, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT, LLM_SHED_RETRY_AFTER
+)
+from .llm_router import LatencyWindow
+from .scheduler import current_llm_flow
+
+
+class AdmissionGate:
+    """并发闸门（带加权公平排队）
+
+    - 并发数未满且无人排队时直接放行
+    - 否则进入等待队列，队列已满时立即拒绝
+    - 排队超过 queue_timeout 仍未获得名额时拒绝
+    - 释放名额时移交给虚拟完成时间最小的等待者（加权公平排队）：
+      每个请求的完成标签 = max(虚拟时间, 该队列上一个标签) + 预估token成本 / 权重，
+      因此大量提交高成本请求的用户会排在其他用户之后，订阅用户权重更高
+    - 队列的上一个标签不晚于虚拟时间时不再影响排序，移交名额时删除，历史标签不会无限增长
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        # 堆元素: [完成标签, 序号, 等待者, 队列ID]
+        self._waiters: List[list] = []
+        self._queued = 0
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        # 队列ID -> 上一个请求的完成标签（只保留晚于虚拟时间的）
+        self._last_finish: Dict[str, float] = {}
+        self._wait_times = LatencyWindow(500)
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+
+    def _overloaded(self, reason: str) -> HTTPException:
+        return HTTPException(
+            status_code=503,
+            detail=f"服务繁忙（{reason}），请稍后重试",
+            headers={"Retry-After": str(LLM_SHED_RETRY_AFTER)}
+        )
+
+    def _finish_tag(self, flow_id: str, weight: float, cost: float) -> float:
+        """计算请求所属队列的虚拟完成标签"""
+        start = max(self._virtual_time, self._last_finish.get(flow_id, 0.0))
+        finish = start + cost / weight
+        self._last_finish[flow_id] = finish
+        return finish
+
+    def _advance_virtual_time(self, finish_tag: float) -> None:
+        """推进虚拟时间，删除已不影响排序的历史标签"""
+        if finish_tag <= self._virtual_time:
+            return
+        self._virtual_time = finish_tag
+        self._last_finish = {
+            flow_id: finish for flow_id, finish in self._last_finish.items() if finish > finish_tag
+        }
+
+    async def acquire(self, cost: float = 1.0) -> None:
+        """获取一个并发名额，过载时抛出503
+
+        Args:
+            cost: 预估成本（按请求的token上限计），用于公平排队
+        """
+        if self.in_flight < self.max_concurrency and not self._queued:
+            # 没有竞争时直接放行，并清空公平排队的历史标签
+            self.in_flight += 1
+            self.admitted += 1
+            self._wait_times.record(0.0)
+            self._last_finish.clear()
+            return
+
+        if self._queued >= self.max_queue:
+            self.rejected_queue_full += 1
+            print(f"准入控制 {self.name}: 等待队列已满（{self._queued}），拒绝请求")
+            raise self._overloaded("排队已满")
+
+        flow = current_llm_flow()
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(
+            self._waiters,
+            [self._finish_tag(flow.flow_id, flow.weight, cost), next(self._sequence), waiter, flow.flow_id]
+        )
+        self._queued += 1
+        start_time = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            if not self._give_up(waiter):
+                # 超时的同时恰好获得了名额，正常放行
+                self._record_admitted(start_time)
+                return
+            self.rejected_timeout += 1
+            print(f"准入控制 {self.name}: 排队超过 {self.queue_timeout}s，拒绝请求")
+            raise self._overloaded("排队超时")
+        except asyncio.CancelledError:
+            if not self._give_up(waiter):
+                # 已获得的名额要归还
+                self.release()
+            raise
+
+        self._record_admitted(start_time)
+
+    def _give_up(self, waiter: "asyncio.Future[None]") -> bool:
+        """放弃排队；返回False表示名额已经移交给该等待者
+
+        放弃的等待者留在堆中，出队时跳过。
+        """
+        if waiter.done():
+            return False
+        waiter.cancel()
+        self._queued -= 1
+        if not self._queued:
+            self._waiters.clear()
+        return True
+
+    def _record_admitted(self, start_time: float) -> None:
+        self.admitted += 1
+        self._wait_times.record(time.monotonic() - start_time)
+
+    def release(self) -> None:
+        """释放名额，有人排队时移交给完成标签最小的等待者"""
+        while self._waiters:
+            finish_tag, _, waiter, _ = heapq.heappop(self._waiters)
+            if not waiter.done():
+                self._queued -= 1
+                self._advance_virtual_time(finish_tag)
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    @asynccontextmanager
+    async def slot(self, cost: float = 1.0) -> AsyncIterator[None]:
+        """在并发名额内执行"""
+        await self.acquire(cost)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        p50 = self._wait_times.percentile(0.5)
+        p95 = self._wait_times.percentile(0.95)
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "queue_depth": self._queued,
+            "queued_flows": len({flow_id for _, _, waiter, flow_id in self._waiters if not waiter.done()}),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "wait_p50_seconds": round(p50, 3) if p50 is not None else None,
+            "wait_p95_seconds": round(p95, 3) if p95 is not None else None
+        }
+
+
+# 按提供商划分的并发闸门
+_admission_gates: Dict[str, AdmissionGate] = {}
+
+
+def get_admission_gate(provider: str) -> AdmissionGate:
+    """获取提供商对应的并发闸门"""
+    gate = _admission_gates.get(provider)
+    if gate is None:
+        gate = AdmissionGate(
+            provider,
+            max_concurrency=LLM_PROVIDER_CONCURRENCY.get(provider, LLM_DEFAULT_CONCURRENCY),
+            max_queue=LLM_MAX_QUEUE,
+            queue_timeout=LLM_QUEUE_TIMEOUT
+        )
+        _admission_gates[provider] = gate
+    return gate
+
+
+def admission_stats() -> Dict[str, Any]:
+    return {name: gate.stats() for name, gate in _admission_gates.items()}
@@ -0,0 +1,116 @@
+"""
+历史记录读取缓存模块
+按用户（或匿名会话）缓存历史记录的前几页，写入该用户或会话的历史记录时立即失效；
+反复打开历史记录面板时不再重复查询 optimization_history
+"""
+import time
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional
+
+from ..constants import HISTORY_CACHE_MAX_BYTES, HISTORY_CACHE_TTL
+from .cache import LRUCache, estimate_size
+
+
+def history_owner(user_id: Optional[str] = None, session_id: Optional[str] = None) -> Optional[str]:
+    """历史记录所属者的缓存键：已登录用户按用户ID，匿名用户按会话ID"""
+    if user_id:
+        return f"user:{user_id}"
+    if session_id:
+        return f"session:{session_id}"
+    return None
+
+
+class HistoryReadCache:
+    """按所属者分组的历史记录读取缓存
+
+    - 每个所属者一个缓存条目 {查询键: (结果, 过期时间, 字节数)}，失效时整体删除，占用字节数按条目统计
+    - 查询期间该所属者有写入时不缓存这次的结果，避免把写入前的旧数据放回缓存
+    - 只在当前进程内失效，多进程部署时其他进程依靠 HISTORY_CACHE_TTL 过期
+    """
+
+    def __init__(self):
+        # 所属者 -> {查询键: (结果, 过期时间, 字节数)}
+        self._cache = LRUCache("history_reads", HISTORY_CACHE_MAX_BYTES, HISTORY_CACHE_TTL)
+        # 所属者 -> 正在进行的查询状态 {"readers": 查询数, "generation": 失效次数}
+        self._loading: Dict[str, Dict[str, int]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    async def get_or_load(
+        self,
+        owner: str,
+        key: Hashable,
+        loader: Callable[[], Awaitable[Any]],
+        ttl: Optional[float] = None,
+        size: Optional[Callable[[Any], int]] = None
+    ) -> Any:
+        """读取缓存，未命中时调用 loader 查询并缓存结果
+
+        ttl 默认为 HISTORY_CACHE_TTL；size 用于估算非JSON结果（如搜索索引）占用的字节数。
+        """
+        pages = self._cache.get(owner)
+        if pages is not None and key in pages:
+            value, expires_at, _ = pages[key]
+            if expires_at > time.monotonic():
+                self.hits += 1
+                return value
+        self.misses += 1
+
+        state = self._loading.setdefault(owner, {"readers": 0, "generation": 0})
+        state["readers"] += 1
+        generation = state["generation"]
+        try:
+            value = await loader()
+        finally:
+            state["readers"] -= 1
+            if not state["readers"] and self._loading.get(owner) is state:
+                del self._loading[owner]
+
+        if state["generation"] == generation:
+            self._store(owner, key, value, HISTORY_CACHE_TTL if ttl is None else ttl, (size or estimate_size)(value))
+        return value
+
+    def _store(self, owner: str, key: Hashable, value: Any, ttl: float, size: int) -> None:
+        now = time.monotonic()
+        pages = {
+            page_key: entry
+            for page_key, entry in (self._cache.get(owner) or {}).items()
+            if entry[1] > now
+        }
+        pages[key] = (value, now + ttl, size)
+        # 条目在最晚过期的一页过期后整体淘汰
+        self._cache.set(
+            owner,
+            pages,
+            ttl=max(expires_at for _, expires_at, _ in pages.values()) - now,
+            size=sum(page_size for _, _, page_size in pages.values())
+        )
+
+    def invalidate(self, owners: Iterable[Optional[str]]) -> None:
+        """删除所属者的全部缓存页"""
+        for owner in set(owners):
+            if owner is None:
+                continue
+            self._cache.delete(owner)
+            state = self._loading.get(owner)
+            if state is not None:
+                state["generation"] += 1
+            self.invalidations += 1
+
+    def invalidate_rows(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """写入历史记录后，使这些记录所属用户和会话的缓存失效"""
+        self.invalidate(history_owner(row.get("user_id"), row.get("session_id")) for row in rows)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            **self._cache.stats(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations
+        }
+
+
+# 进程级历史记录读取缓存
+history_cache = HistoryReadCache()
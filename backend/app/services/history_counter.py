@@ -0,0 +1,176 @@
+"""
+用户使用计数模块
+每个用户维护总数、按模式计数和按天计数，历史记录写入数据库成功后在进程内累加，
+定期批量合并到 user_stats 表；历史记录总数和使用统计直接读取计数，不再查询 optimization_history
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+from ..constants import USER_STATS_CACHE_MAX_BYTES, USER_STATS_CACHE_TTL, USER_STATS_FLUSH_INTERVAL
+from .cache import LRUCache
+from .supabase_service import get_supabase_service
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def _empty_counts() -> Dict[str, Any]:
+    return {"total": 0, "modes": {}, "days": {}}
+
+
+def _add_counts(target: Dict[str, Any], delta: Dict[str, Any]) -> None:
+    """把增量累加到计数上（原地修改）"""
+    target["total"] += delta["total"]
+    for field in ("modes", "days"):
+        for key, count in delta[field].items():
+            target[field][key] = target[field].get(key, 0) + count
+
+
+class HistoryCounter:
+    """每个用户的使用计数
+
+    - record() 在进程内记录增量，同时更新已缓存的计数快照；只在记录成功写入数据库后调用
+      （回放成功或直接写入成功），被拒绝成为死信的记录不计入
+    - 增量每 USER_STATS_FLUSH_INTERVAL 秒批量合并到 user_stats 表（一次RPC），失败时保留到下一轮
+    - 计数快照从 user_stats 读取并叠加尚未合并的增量，缓存 USER_STATS_CACHE_TTL 秒后重新读取，
+      以纠正其他进程写入造成的偏差
+    - 读取快照与合并互斥：合并进行中时读取等待合并结束，读取进行中时合并等待读取结束，
+      否则读取可能既看不到已取出的增量、数据库中也还没有合并结果
+    - 按天计数以UTC日期为键，user_stats 中只保留最近30天（见 sql/004_user_stats.sql）
+    """
+
+    def __init__(self):
+        # user_id -> 计数快照，累加时原地修改
+        self._cache = LRUCache("user_stats", USER_STATS_CACHE_MAX_BYTES, USER_STATS_CACHE_TTL)
+        # user_id -> 尚未合并到数据库的增量
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._task: Optional["asyncio.Task[None]"] = None
+        # 正在读取 user_stats 的协程数；_flushing 为真时新的读取等待
+        self._readers = 0
+        self._flushing = False
+        # 在事件循环中首次使用时创建（模块导入时还没有运行中的事件循环）
+        self._idle_condition: Optional[asyncio.Condition] = None
+        self.flushes = 0
+        self.flush_failures = 0
+
+    def record(self, user_id: str, mode: Optional[str], count: int = 1) -> None:
+        """记录一次历史记录写入"""
+        delta = {"total": count, "modes": {mode or "unknown": count}, "days": {_today(): count}}
+        _add_counts(self._pending.setdefault(user_id, _empty_counts()), delta)
+
+        snapshot = self._cache.get(user_id)
+        if snapshot is not None:
+            _add_counts(snapshot, delta)
+        self.start()
+
+    def record_rows(self, rows: List[Dict[str, Any]]) -> None:
+        """已写入数据库的历史记录计入用户计数（匿名记录不计）"""
+        for row in rows:
+            if row.get("user_id"):
+                self.record(row["user_id"], row.get("mode"))
+
+    @property
+    def _idle(self) -> asyncio.Condition:
+        if self._idle_condition is None:
+            self._idle_condition = asyncio.Condition()
+        return self._idle_condition
+
+    async def get_counts(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """获取用户计数快照 {"total", "modes", "days"}；user_stats 中没有该用户时返回None"""
+        snapshot = self._cache.get(user_id)
+        if snapshot is not None:
+            return snapshot
+
+        async with self._idle:
+            await self._idle.wait_for(lambda: not self._flushing)
+            self._readers += 1
+        try:
+            row = await get_supabase_service().get_user_stats_row(user_id)
+            if row is None:
+                return None
+
+            snapshot = {
+                "total": int(row.get("total") or 0),
+                "modes": dict(row.get("mode_counts") or {}),
+                "days": dict(row.get("daily_counts") or {})
+            }
+            pending = self._pending.get(user_id)
+            if pending is not None:
+                _add_counts(snapshot, pending)
+            self._cache.set(user_id, snapshot)
+            return snapshot
+        finally:
+            async with self._idle:
+                self._readers -= 1
+                self._idle.notify_all()
+
+    async def get_total(self, user_id: str) -> Optional[int]:
+        counts = await self.get_counts(user_id)
+        return counts["total"] if counts is not None else None
+
+    @staticmethod
+    def count_since(counts: Dict[str, Any], days: int) -> int:
+        """最近 days 天（含今天，按UTC日期）的数量"""
+        first_day = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+        return sum(count for day, count in counts["days"].items() if day >= first_day)
+
+    def start(self) -> None:
+        """启动定期合并协程"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._flush_loop())
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(USER_STATS_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def flush(self) -> None:
+        """把累积的增量一次性合并到 user_stats 表"""
+        if not self._pending:
+            return
+
+        async with self._idle:
+            # 先置位，阻止新的读取，再等待进行中的读取结束
+            await self._idle.wait_for(lambda: not self._flushing)
+            self._flushing = True
+            await self._idle.wait_for(lambda: self._readers == 0)
+        try:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            deltas = [{"user_id": user_id, **delta} for user_id, delta in pending.items()]
+            try:
+                await get_supabase_service().increment_user_stats(deltas)
+                self.flushes += 1
+            except Exception as e:
+                # 合并失败时把增量放回，下一轮重试
+                self.flush_failures += 1
+                print(f"合并用户计数失败（{len(deltas)} 个用户），下次重试: {e}")
+                for user_id, delta in pending.items():
+                    _add_counts(self._pending.setdefault(user_id, _empty_counts()), delta)
+        finally:
+            async with self._idle:
+                self._flushing = False
+                self._idle.notify_all()
+
+    async def close(self) -> None:
+        """停止定期合并，并合并剩余的增量"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._cache.stats(),
+            "pending_users": len(self._pending),
+            "flushes": self.flushes,
+            "flush_failures": self.flush_failures
+        }
+
+
+# 进程级用户使用计数
+history_counter = HistoryCounter()
@@ -0,0 +1,183 @@
+"""
+历史记录搜索模块
+默认在数据库中搜索（Postgres函数 search_user_history，三元组索引），一次往返返回排序后的一页；
+数据库尚未创建该函数时，为用户最近的历史记录建立进程内倒排索引（中日韩文字按二元组切分），
+索引放在历史记录读取缓存中，写入该用户的历史记录时失效
+"""
+import asyncio
+import math
+import re
+import time
+from functools import lru_cache
+from typing import Any, Dict, List, Set, Tuple
+
+from fastapi import HTTPException
+from postgrest.exceptions import APIError
+
+from ..constants import (
+    HISTORY_SEARCH_MAX_TERMS, HISTORY_SEARCH_LOCAL_LIMIT, HISTORY_SEARCH_INDEX_TTL, HISTORY_SEARCH_FUNCTION_RECHECK,
+    HISTORY_EXPORT_CHUNK_SIZE
+)
+from .supabase_service import SupabaseService, get_supabase_service
+from .history_cache import history_cache, history_owner
+
+# 中日韩文字连续片段，或字母数字组成的单词（文本先转为小写）
+_TOKEN_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+|[0-9a-z]+")
+
+# 原始提示词中的匹配比优化后提示词中的匹配权重更高
+_ORIGINAL_WEIGHT = 2
+
+# 数据库函数不存在的错误码（PostgREST找不到函数、Postgres未定义函数）
+_FUNCTION_MISSING_CODES = ("PGRST202", "42883")
+
+
+def split_terms(query: str) -> List[str]:
+    """按空白切分搜索词（去重，小写，最多 HISTORY_SEARCH_MAX_TERMS 个）"""
+    terms: List[str] = []
+    for term in query.lower().split():
+        if term not in terms:
+            terms.append(term)
+    return terms[:HISTORY_SEARCH_MAX_TERMS]
+
+
+def like_patterns(terms: List[str]) -> List[str]:
+    """把搜索词转义为 ILIKE 子串模式，按长度降序（最长的最容易命中三元组索引）"""
+    escaped = [term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") for term in terms]
+    return [f"%{term}%" for term in sorted(escaped, key=len, reverse=True)]
+
+
+def tokenize(text: str) -> List[str]:
+    """分词：字母数字按单词，中日韩文字按相邻两个字（只有一个字时取单字）"""
+    tokens: List[str] = []
+    for run in _TOKEN_PATTERN.findall(text.lower()):
+        if run.isascii() or len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class HistorySearchIndex:
+    """一个用户历史记录的进程内倒排索引（建立后只读，可在线程中查询）
+
+    索引只用于筛选候选记录，最终以子串匹配确认，结果与数据库搜索一致：
+    每个搜索词都必须出现在原始或优化后的提示词中。
+    """
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        # rows 按时间降序，得分相同时保持该顺序
+        self.rows = rows
+        self._texts = [
+            ((row.get("original_prompt") or "").lower(), (row.get("optimized_prompt") or "").lower())
+            for row in rows
+        ]
+        self._postings: Dict[str, Set[int]] = {}
+        for position, (original, optimized) in enumerate(self._texts):
+            for token in set(tokenize(original)) | set(tokenize(optimized)):
+                self._postings.setdefault(token, set()).add(position)
+        # 估算占用的字节数：原文和小写副本按每字符2字节，每个索引词和每条倒排记录按固定开销
+        text_chars = sum(len(original) + len(optimized) for original, optimized in self._texts)
+        self.size = 4 * text_chars + sum(64 + 8 * len(positions) for positions in self._postings.values())
+
+    def _candidates(self, term: str) -> Set[int]:
+        """包含搜索词全部分词的记录（搜索词中的单字或单词可以是索引词的一部分）"""
+        candidates = set(range(len(self.rows)))
+        for token in set(tokenize(term)):
+            positions = self._postings.get(token)
+            if positions is None or len(token) == 1 or token.isascii():
+                # 单字和字母数字按子串匹配，合并所有包含它的索引词
+                positions = set().union(*(
+                    indexed_positions for indexed, indexed_positions in self._postings.items() if token in indexed
+                ))
+            candidates &= positions
+            if not candidates:
+                break
+        return candidates
+
+    def search(self, terms: List[str], offset: int, limit: int) -> Tuple[List[Dict[str, Any]], int]:
+        """返回 (当前页记录, 匹配总数)，按词频和逆文档频率排序"""
+        candidates = set(range(len(self.rows)))
+        for term in terms:
+            candidates &= self._candidates(term)
+
+        matches: Dict[int, float] = {}
+        for position in candidates:
+            original, optimized = self._texts[position]
+            if all(term in original or term in optimized for term in terms):
+                matches[position] = 0.0
+        if not matches:
+            return [], 0
+
+        for term in terms:
+            containing = [
+                position for position in matches
+                if term in self._texts[position][0] or term in self._texts[position][1]
+            ]
+            idf = math.log(1 + len(self.rows) / len(containing))
+            for position in containing:
+                original, optimized = self._texts[position]
+                matches[position] += (_ORIGINAL_WEIGHT * original.count(term) + optimized.count(term)) * idf
+
+        ranked = sorted(matches, key=lambda position: (-matches[position], position))
+        return [self.rows[position] for position in ranked[offset:offset + limit]], len(ranked)
+
+
+class HistorySearch:
+    """历史记录搜索：数据库函数优先，函数不存在时使用进程内索引
+
+    - 函数不存在时记住 HISTORY_SEARCH_FUNCTION_RECHECK 秒，期间不再调用，直接使用进程内索引
+    - 其他数据库错误（超时、连接失败等）返回503，不退回到进程内索引（建立索引要读取大量记录）
+    """
+
+    def __init__(self, supabase_service: SupabaseService):
+        self.supabase_service = supabase_service
+        # 在此时间（time.monotonic）之前认为数据库搜索函数不存在
+        self._function_missing_until = 0.0
+
+    async def search(self, user_id: str, query: str, page: int, page_size: int) -> Tuple[List[Dict[str, Any]], int]:
+        """搜索用户的历史记录，返回 (当前页记录, 匹配总数)"""
+        terms = split_terms(query)
+        if not terms:
+            return [], 0
+
+        offset = (page - 1) * page_size
+        if time.monotonic() < self._function_missing_until:
+            return await self._search_local(user_id, terms, offset, page_size)
+
+        try:
+            result = await self.supabase_service.search_user_history(
+                user_id, " ".join(terms), like_patterns(terms), page_size, offset
+            )
+        except Exception as e:
+            if not (isinstance(e, APIError) and e.code in _FUNCTION_MISSING_CODES):
+                print(f"调用搜索函数失败: {e}")
+                raise HTTPException(status_code=503, detail="搜索暂时不可用，请稍后重试")
+            print(f"数据库搜索函数不存在，{HISTORY_SEARCH_FUNCTION_RECHECK}s 内使用进程内索引")
+            self._function_missing_until = time.monotonic() + HISTORY_SEARCH_FUNCTION_RECHECK
+            return await self._search_local(user_id, terms, offset, page_size)
+
+        return result.get("items") or [], int(result.get("total") or 0)
+
+    async def _search_local(self, user_id: str, terms: List[str], offset: int, limit: int) -> Tuple[List[Dict[str, Any]], int]:
+        async def build_index() -> HistorySearchIndex:
+            rows: List[Dict[str, Any]] = []
+            async for chunk in self.supabase_service.iter_user_optimization_history(user_id, HISTORY_EXPORT_CHUNK_SIZE):
+                rows.extend(chunk)
+                if len(rows) >= HISTORY_SEARCH_LOCAL_LIMIT:
+                    break
+            return await asyncio.to_thread(HistorySearchIndex, rows[:HISTORY_SEARCH_LOCAL_LIMIT])
+
+        index = await history_cache.get_or_load(
+            history_owner(user_id),
+            ("search_index",),
+            build_index,
+            ttl=HISTORY_SEARCH_INDEX_TTL,
+            size=lambda index: index.size
+        )
+        return await asyncio.to_thread(index.search, terms, offset, limit)
+
+
+@lru_cache()
+def get_history_search() -> HistorySearch:
+    """获取历史记录搜索服务（单例模式）"""
+    return HistorySearch(get_supabase_service())
@@ -0,0 +1,294 @@
+"""
+历史记录本地暂存模块
+历史记录先追加到本地SQLite暂存文件，再由后台回放协程批量同步到Supabase；
+Supabase变慢或不可用时记录保留在本地，恢复后补写，不会丢失；
+补写顺序不保证与写入顺序一致（失败的记录按退避时间推迟），但每行在写入队列或暂存区时
+记下 created_at（UTC），补写后仍是优化发生的时间，排序和按天统计不受补写延迟影响
+"""
+import asyncio
+import json
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from postgrest.exceptions import APIError
+
+from ..config import Settings
+from ..constants import (
+    HISTORY_REPLAY_BATCH_SIZE, HISTORY_REPLAY_INTERVAL, HISTORY_RETRY_BASE_DELAY, HISTORY_RETRY_MAX_DELAY,
+    HISTORY_DRAIN_TIMEOUT
+)
+from .supabase_service import get_supabase_service
+from .history_counter import history_counter
+
+# 数据库明确拒绝的错误类别（数据异常、完整性约束），重试不会成功
+_REJECTED_ERROR_CLASSES = ("22", "23")
+
+
+def utc_now_iso() -> str:
+    """当前UTC时间（ISO格式），作为历史记录的 created_at"""
+    return datetime.now(timezone.utc).isoformat()
+
+
+class HistorySpool:
+    """只追加的本地暂存区（SQLite，线程安全）
+
+    每行分配一个 client_key，同步到Supabase时按该键去重，重复回放不会产生重复记录；
+    没有 created_at 的行在追加时补上，回放不会改变记录的时间。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS history_spool (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                client_key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                dead INTEGER NOT NULL DEFAULT 0,
+                last_error TEXT
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_history_spool_due ON history_spool (dead, next_attempt_at)"
+        )
+        self._conn.commit()
+
+    def append(self, rows: List[Dict[str, Any]]) -> int:
+        """追加历史记录（一个事务），返回写入的行数"""
+        now = time.time()
+        created_at = utc_now_iso()
+        values = []
+        for row in rows:
+            row = dict(row)
+            row.setdefault("client_key", str(uuid.uuid4()))
+            row.setdefault("created_at", created_at)
+            values.append((row["client_key"], json.dumps(row, ensure_ascii=False), now))
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO history_spool (client_key, payload, next_attempt_at) VALUES (?, ?, ?)",
+                values
+            )
+        return len(values)
+
+    def due(self, limit: int) -> List[Tuple[int, int, Dict[str, Any]]]:
+        """取出已到重试时间的记录：[(序号, 已尝试次数, 行)]"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT seq, attempts, payload FROM history_spool "
+                "WHERE dead = 0 AND next_attempt_at <= ? ORDER BY seq LIMIT ?",
+                (time.time(), limit)
+            ).fetchall()
+        entries = [(seq, attempts, json.loads(payload)) for seq, attempts, payload in rows]
+        # 升级前暂存的行没有 created_at，补上当前时间，使同一批的列保持一致
+        created_at = utc_now_iso()
+        for _, _, row in entries:
+            row.setdefault("created_at", created_at)
+        return entries
+
+    def ack(self, seqs: List[int]) -> None:
+        """删除已同步的记录"""
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM history_spool WHERE seq = ?", [(seq,) for seq in seqs])
+
+    def retry_later(self, seqs: List[int], delay: float, error: str) -> None:
+        """同步失败，推迟下一次尝试"""
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "UPDATE history_spool SET attempts = attempts + 1, next_attempt_at = ?, last_error = ? WHERE seq = ?",
+                [(time.time() + delay, error, seq) for seq in seqs]
+            )
+
+    def bury(self, seq: int, error: str) -> None:
+        """被数据库拒绝的记录不再重试，保留在本地供排查"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE history_spool SET attempts = attempts + 1, dead = 1, last_error = ? WHERE seq = ?",
+                (error, seq)
+            )
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            pending, dead = self._conn.execute(
+                "SELECT COALESCE(SUM(dead = 0), 0), COALESCE(SUM(dead = 1), 0) FROM history_spool"
+            ).fetchone()
+        return {"pending": pending, "dead": dead}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def _retry_delay(attempts: int) -> float:
+    """全抖动指数退避"""
+    return random.uniform(0, min(HISTORY_RETRY_MAX_DELAY, HISTORY_RETRY_BASE_DELAY * (2 ** attempts)))
+
+
+def _is_rejected(error: Exception) -> bool:
+    """判断是否为数据库明确拒绝的错误（而不是网络或服务不可用）"""
+    return isinstance(error, APIError) and str(error.code or "")[:2] in _REJECTED_ERROR_CLASSES
+
+
+class HistoryReplayer:
+    """把暂存区的记录批量同步到Supabase
+
+    - 每次最多同步 HISTORY_REPLAY_BATCH_SIZE 行，按 client_key 去重写入
+    - 网络错误或服务不可用时整批按指数退避重试，不设上限；同时整个回放器暂停同样的时间，
+      期间新写入暂存区的记录也不尝试同步，连续失败时退避时间逐次加倍
+    - 数据库拒绝整批时逐行重试，被拒绝的单行标记为死信，不阻塞其他记录
+    - 回放写入在专用的单线程池中执行（见 SupabaseService.upsert_optimization_history_batch），
+      同一时间最多一次
+    """
+
+    def __init__(self, settings: Settings, spool: HistorySpool):
+        self.supabase_service = get_supabase_service()
+        self.spool = spool
+        self._wakeup = asyncio.Event()
+        self._task: Optional["asyncio.Task[None]"] = None
+        # 连续的网络或服务错误次数，以及回放器暂停到的时间（time.monotonic）
+        self._failures = 0
+        self._paused_until = 0.0
+        self.shipped = 0
+        self.retried = 0
+        self.buried = 0
+
+    def start(self) -> None:
+        """启动后台回放协程"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._replay_loop())
+
+    def wake(self) -> None:
+        """有新记录写入暂存区时立即开始回放"""
+        self.start()
+        self._wakeup.set()
+
+    async def _replay_loop(self) -> None:
+        while True:
+            try:
+                shipped = await self.replay_once()
+            except Exception as e:
+                print(f"历史记录回放异常: {e}")
+                shipped = 0
+            if not shipped:
+                self._wakeup.clear()
+                timeout = max(HISTORY_REPLAY_INTERVAL, self._paused_until - time.monotonic())
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def replay_once(self) -> int:
+        """同步一批到期的记录，返回成功同步的行数；回放器暂停期间不同步"""
+        if time.monotonic() < self._paused_until:
+            return 0
+        entries = await asyncio.to_thread(self.spool.due, HISTORY_REPLAY_BATCH_SIZE)
+        if not entries:
+            return 0
+        return await self._ship(entries)
+
+    async def _ship(self, entries: List[Tuple[int, int, Dict[str, Any]]]) -> int:
+        seqs = [seq for seq, _, _ in entries]
+        try:
+            await self.supabase_service.upsert_optimization_history_batch([row for _, _, row in entries])
+        except Exception as e:
+            if not _is_rejected(e):
+                attempts = max(self._failures, *(attempts for _, attempts, _ in entries))
+                delay = _retry_delay(attempts)
+                self._failures += 1
+                self._paused_until = time.monotonic() + delay
+                self.retried += len(entries)
+                print(f"历史记录同步失败（{len(entries)} 条），回放暂停 {delay:.1f}s 后重试: {e}")
+                await asyncio.to_thread(self.spool.retry_later, seqs, delay, str(e))
+                return 0
+            if len(entries) == 1:
+                self.buried += 1
+                print(f"历史记录被数据库拒绝，不再重试: {e}")
+                await asyncio.to_thread(self.spool.bury, seqs[0], str(e))
+                return 0
+            # 整批被拒绝时逐行写入，找出有问题的行
+            shipped = 0
+            for entry in entries:
+                shipped += await self._ship([entry])
+            return shipped
+
+        self._failures = 0
+        history_counter.record_rows([row for _, _, row in entries])
+        await asyncio.to_thread(self.spool.ack, seqs)
+        self.shipped += len(entries)
+        return len(entries)
+
+    async def close(self) -> None:
+        """停止回放；关闭前尽量把到期记录同步完，剩余记录下次启动后继续同步"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        deadline = time.monotonic() + HISTORY_DRAIN_TIMEOUT
+        try:
+            while time.monotonic() < deadline:
+                shipped = await asyncio.wait_for(self.replay_once(), timeout=deadline - time.monotonic())
+                if not shipped:
+                    break
+        except Exception as e:
+            print(f"关闭时同步历史记录未完成，下次启动后继续: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self.spool.counts(),
+            "shipped": self.shipped,
+            "retried": self.retried,
+            "dead_lettered": self.buried,
+            "consecutive_failures": self._failures,
+            "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 1)
+        }
+
+
+# 进程级暂存区和回放器
+_history_spool: Optional[HistorySpool] = None
+_history_replayer: Optional[HistoryReplayer] = None
+
+
+def get_history_spool(settings: Settings) -> HistorySpool:
+    """获取本地暂存区"""
+    global _history_spool
+    if _history_spool is None:
+        _history_spool = HistorySpool(settings.history_spool_path)
+    return _history_spool
+
+
+def get_history_replayer(settings: Settings) -> HistoryReplayer:
+    """获取回放器（未在启动时创建则在首次使用时懒加载）"""
+    global _history_replayer
+    if _history_replayer is None:
+        _history_replayer = HistoryReplayer(settings, get_history_spool(settings))
+    return _history_replayer
+
+
+def init_history_replayer(settings: Settings) -> None:
+    """启动回放器，同步上次运行遗留在暂存区的记录"""
+    get_history_replayer(settings).wake()
+
+
+async def close_history_replayer() -> None:
+    """停止回放器并关闭暂存区"""
+    global _history_replayer, _history_spool
+    if _history_replayer is not None:
+        await _history_replayer.close()
+        _history_replayer = None
+    if _history_spool is not None:
+        _history_spool.close()
+        _history_spool = None
+
+
+def history_replayer_stats() -> Dict[str, Any]:
+    return _history_replayer.stats() if _history_replayer is not None else {}
@@ -0,0 +1,108 @@
+"""
+用户使用统计模块
+默认直接读取按用户维护的使用计数（user_stats）；没有计数的用户在数据库中聚合
+（Postgres函数 get_user_history_stats），应用只接收几个数字
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+from ..config import Settings, get_settings
+from ..constants import USER_STATS_RECENT_DAYS, USER_STATS_MODES
+from .supabase_service import SupabaseService, get_supabase_service
+from .history_counter import HistoryCounter, history_counter
+
+
+def format_user_stats(total: int, recent: int, modes: Dict[str, int], last: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """统一的统计结果格式（与 /api/user/stats 的响应一致）"""
+    return {
+        "total_optimizations": int(total or 0),
+        "recent_7_days": int(recent or 0),
+        "mode_statistics": {mode: int(count) for mode, count in (modes or {}).items()},
+        "last_optimization": last or None
+    }
+
+
+def recent_since() -> datetime:
+    """近期统计的起始时间（UTC）"""
+    return datetime.now(timezone.utc) - timedelta(days=USER_STATS_RECENT_DAYS)
+
+
+class SupabaseHistoryStats:
+    """基于Postgres函数的统计实现
+
+    数据库尚未创建 get_user_history_stats 函数时，退化为并发的精确计数查询（只返回数量，不读取记录）：
+    总数、近期数量和 USER_STATS_MODES 中每个模式各一次，其他模式和空模式合计为 unknown。
+    """
+
+    def __init__(self, supabase_service: SupabaseService):
+        self.supabase_service = supabase_service
+
+    async def get_user_stats(self, user_id: str) -> Dict[str, Any]:
+        since = recent_since()
+        try:
+            result = await self.supabase_service.get_user_history_stats(user_id, since)
+        except Exception as e:
+            if "Could not find the function" not in str(e):
+                print(f"调用统计函数失败，改为应用内统计: {e}")
+            return await self._aggregate_in_app(user_id, since)
+
+        result = result or {}
+        return format_user_stats(result.get("total"), result.get("recent"), result.get("modes"), result.get("last"))
+
+    async def _aggregate_in_app(self, user_id: str, since: datetime) -> Dict[str, Any]:
+        count = self.supabase_service.get_user_optimization_history_count
+        total, recent, last, *mode_counts = await asyncio.gather(
+            count(user_id),
+            count(user_id, start_date=since),
+            self.supabase_service.get_user_optimization_history(user_id, limit=1),
+            *(count(user_id, mode=mode) for mode in USER_STATS_MODES)
+        )
+
+        modes = {mode: mode_count for mode, mode_count in zip(USER_STATS_MODES, mode_counts) if mode_count}
+        other = total - sum(mode_counts)
+        if other > 0:
+            modes["unknown"] = other
+        return format_user_stats(total, recent, modes, last[0] if last else None)
+
+
+class CounterHistoryStats:
+    """基于使用计数的统计实现（O(1)）
+
+    近期数量按UTC日期计算最近 USER_STATS_RECENT_DAYS 天（含今天）；
+    user_stats 中还没有计数的用户交给聚合实现。
+    """
+
+    def __init__(self, supabase_service: SupabaseService, counter: HistoryCounter):
+        self.supabase_service = supabase_service
+        self.counter = counter
+        self.fallback = SupabaseHistoryStats(supabase_service)
+
+    async def get_user_stats(self, user_id: str) -> Dict[str, Any]:
+        counts, last = await asyncio.gather(
+            self.counter.get_counts(user_id),
+            self.supabase_service.get_user_optimization_history(user_id, limit=1)
+        )
+        if counts is None:
+            return await self.fallback.get_user_stats(user_id)
+
+        return format_user_stats(
+            counts["total"],
+            self.counter.count_since(counts, USER_STATS_RECENT_DAYS),
+            counts["modes"],
+            last[0] if last else None
+        )
+
+
+def create_history_stats(settings: Settings):
+    """按配置创建统计实现"""
+    if settings.history_stats_backend == "supabase":
+        return SupabaseHistoryStats(get_supabase_service())
+    return CounterHistoryStats(get_supabase_service(), history_counter)
+
+
+@lru_cache()
+def get_history_stats():
+    """获取统计实现（单例模式）"""
+    return create_history_stats(get_settings())
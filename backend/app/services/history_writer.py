@@ -0,0 +1,159 @@
+"""
+历史记录异步写入模块
+优化结果的历史记录先进入进程内队列，由后台协程按批追加到本地暂存区，
+再由回放协程同步到数据库，请求无需等待数据库往返即可返回
+"""
+import asyncio
+import time
+from typing import Any, Dict, List, Optional
+
+from ..config import Settings
+from ..constants import (
+    HISTORY_WRITE_BATCH_SIZE, HISTORY_FLUSH_INTERVAL, HISTORY_QUEUE_MAX, HISTORY_ENQUEUE_TIMEOUT, HISTORY_DRAIN_TIMEOUT
+)
+from .supabase_service import get_supabase_service
+from .history_spool import get_history_spool, get_history_replayer, utc_now_iso
+from .history_counter import history_counter
+
+
+class HistoryWriter:
+    """历史记录批量写入器
+
+    - 攒够 HISTORY_WRITE_BATCH_SIZE 行或距本批第一行超过 HISTORY_FLUSH_INTERVAL 秒时追加一次
+    - 队列已满时生产者最多等待 HISTORY_ENQUEUE_TIMEOUT 秒（背压），
+      仍然写不进队列则由请求方直接追加到暂存区，不丢记录也不无限占用内存
+    - 关闭时把队列中剩余的记录全部写完
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.supabase_service = get_supabase_service()
+        self._queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=HISTORY_QUEUE_MAX)
+        self._task: Optional["asyncio.Task[None]"] = None
+        self.enqueued = 0
+        self.written = 0
+        self.failed = 0
+        self.direct_writes = 0
+        self.batches = 0
+
+    def start(self) -> None:
+        """启动后台写入协程"""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._flush_loop())
+
+    async def enqueue(self, row: Optional[Dict[str, Any]]) -> None:
+        """把一行历史记录放入写入队列（记下入队时间作为 created_at，之后的排队和补写不影响记录时间）"""
+        if row is None:
+            return
+        row = {**row, "created_at": row.get("created_at") or utc_now_iso()}
+        self.start()
+        try:
+            await asyncio.wait_for(self._queue.put(row), timeout=HISTORY_ENQUEUE_TIMEOUT)
+            self.enqueued += 1
+        except asyncio.TimeoutError:
+            # 写入跟不上时由请求方承担一次本地写入
+            self.direct_writes += 1
+            print(f"历史记录队列已满（{self._queue.qsize()}），改为直接追加到暂存区")
+            await self._write([row])
+
+    async def enqueue_many(self, rows: List[Optional[Dict[str, Any]]]) -> None:
+        for row in rows:
+            await self.enqueue(row)
+
+    async def _next_batch(self) -> List[Dict[str, Any]]:
+        """等待下一批记录：攒够批量或超过刷新间隔即返回"""
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + HISTORY_FLUSH_INTERVAL
+        while len(batch) < HISTORY_WRITE_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _flush_loop(self) -> None:
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write(self, rows: List[Dict[str, Any]]) -> None:
+        """追加到本地暂存区并唤醒回放协程；暂存区不可用时直接写入数据库"""
+        self.batches += 1
+        try:
+            await asyncio.to_thread(get_history_spool(self.settings).append, rows)
+        except Exception as e:
+            print(f"历史记录写入本地暂存区失败，直接写入数据库: {e}")
+            if await self.supabase_service.save_optimization_history_batch(rows):
+                self.written += len(rows)
+                history_counter.record_rows(rows)
+            else:
+                self.failed += len(rows)
+            return
+
+        self.written += len(rows)
+        get_history_replayer(self.settings).wake()
+
+    async def close(self) -> None:
+        """写完队列中剩余的记录后停止"""
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout=HISTORY_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                print(f"历史记录队列排空超时，剩余 {self._queue.qsize()} 条直接写入")
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        remaining = []
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+            self._queue.task_done()
+        for start in range(0, len(remaining), HISTORY_WRITE_BATCH_SIZE):
+            await self._write(remaining[start:start + HISTORY_WRITE_BATCH_SIZE])
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue": HISTORY_QUEUE_MAX,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "failed": self.failed,
+            "direct_writes": self.direct_writes,
+            "batches": self.batches
+        }
+
+
+# 进程级历史记录写入器（在应用启动时创建）
+_history_writer: Optional[HistoryWriter] = None
+
+
+def get_history_writer(settings: Settings) -> HistoryWriter:
+    """获取历史记录写入器（未在启动时创建则在首次使用时懒加载）"""
+    global _history_writer
+    if _history_writer is None:
+        _history_writer = HistoryWriter(settings)
+    return _history_writer
+
+
+def init_history_writer(settings: Settings) -> None:
+    """创建并启动历史记录写入器"""
+    get_history_writer(settings).start()
+
+
+async def close_history_writer() -> None:
+    """排空队列并停止写入器"""
+    global _history_writer
+    if _history_writer is not None:
+        await _history_writer.close()
+        _history_writer = None
+
+
+def history_writer_stats() -> Dict[str, Any]:
+    return _history_writer.stats() if _history_writer is not None else {}
@@ -0,0 +1,433 @@
+"""
+快速回答任务队列模块
+客户端提交任务后立即拿到任务ID，进程内的工作协程池异步生成回答；
+任务状态存放在可插拔的本地存储中（内存或SQLite），无需外部服务；
+SQLite存储可由多个进程共享，每个进程为自己的未完成任务定期续约，
+只有所属进程停止续约（已退出）的任务才会被标记为中断
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+
+from ..config import Settings
+from ..constants import (
+    JOB_WORKERS, JOB_QUEUE_MAX_DEPTH, JOB_MAX_PER_USER, JOB_RESULT_TTL, JOB_CLEANUP_INTERVAL,
+    JOB_LEASE_RENEW_INTERVAL, JOB_LEASE_TIMEOUT, LLM_SHED_RETRY_AFTER
+)
+from .scheduler import LLMFlow, current_llm_flow, set_llm_flow
+from .quick_answer_service import QuickAnswerService, get_quick_answer_service
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+JOB_FINISHED_STATES = (JOB_SUCCEEDED, JOB_FAILED)
+
+# 任务中断时的错误信息
+JOB_INTERRUPTED_ERROR = "服务重启，任务已中断，请重新提交"
+
+
+class InMemoryJobStore:
+    """内存任务存储（进程重启后任务丢失）"""
+
+    def __init__(self):
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+
+    async def create(self, job: Dict[str, Any]) -> None:
+        self._jobs[job["id"]] = dict(job)
+
+    async def update(self, job_id: str, fields: Dict[str, Any]) -> None:
+        job = self._jobs.get(job_id)
+        if job is not None:
+            job.update(fields)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+    async def count_active(self, owner: str) -> int:
+        return sum(
+            1 for job in self._jobs.values()
+            if job["owner"] == owner and job["status"] not in JOB_FINISHED_STATES
+        )
+
+    async def delete_expired(self, now: float) -> int:
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job["expires_at"] is not None and job["expires_at"] <= now
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        return len(expired)
+
+    async def renew_leases(self, worker_id: str, now: float) -> None:
+        for job in self._jobs.values():
+            if job["worker_id"] == worker_id and job["status"] not in JOB_FINISHED_STATES:
+                job["heartbeat_at"] = now
+
+    async def fail_abandoned(self, worker_id: str, before: float, error: str) -> int:
+        count = 0
+        now = time.time()
+        for job in self._jobs.values():
+            if (job["status"] not in JOB_FINISHED_STATES and job["worker_id"] != worker_id
+                    and (job["heartbeat_at"] or 0) < before):
+                job.update({
+                    "status": JOB_FAILED, "error": error, "updated_at": now, "expires_at": now + JOB_RESULT_TTL
+                })
+                count += 1
+        return count
+
+    async def close(self) -> None:
+        self._jobs.clear()
+
+
+class SQLiteJobStore:
+    """SQLite任务存储（本地文件持久化，进程重启后可查询已完成任务）
+
+    所有数据库操作在线程中执行，避免阻塞事件循环。
+    """
+
+    _COLUMNS = ("id", "owner", "status", "prompt", "model", "result", "error",
+                "created_at", "updated_at", "expires_at", "worker_id", "heartbeat_at")
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS quick_answer_jobs (
+                id TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                status TEXT NOT NULL,
+                prompt TEXT NOT NULL,
+                model TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL,
+                expires_at REAL,
+                worker_id TEXT,
+                heartbeat_at REAL
+            )
+        """)
+        # 旧版本创建的数据库文件没有租约字段
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(quick_answer_jobs)")}
+        for column, column_type in (("worker_id", "TEXT"), ("heartbeat_at", "REAL")):
+            if column not in columns:
+                self._conn.execute(f"ALTER TABLE quick_answer_jobs ADD COLUMN {column} {column_type}")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_quick_answer_jobs_owner ON quick_answer_jobs (owner, status)"
+        )
+        self._conn.commit()
+
+    def _execute(self, sql: str, params: tuple = ()) -> Tuple[List[tuple], int]:
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            rows = cursor.fetchall()
+            self._conn.commit()
+            return rows, cursor.rowcount
+
+    async def _run(self, sql: str, params: tuple = ()) -> List[tuple]:
+        rows, _ = await asyncio.to_thread(self._execute, sql, params)
+        return rows
+
+    async def _run_write(self, sql: str, params: tuple = ()) -> int:
+        """执行写操作，返回受影响的行数"""
+        _, rowcount = await asyncio.to_thread(self._execute, sql, params)
+        return rowcount
+
+    async def create(self, job: Dict[str, Any]) -> None:
+        values = tuple(
+            json.dumps(job[c], ensure_ascii=False) if c == "result" and job[c] is not None else job[c]
+            for c in self._COLUMNS
+        )
+        placeholders = ", ".join("?" for _ in self._COLUMNS)
+        await self._run(f"INSERT INTO quick_answer_jobs ({', '.join(self._COLUMNS)}) VALUES ({placeholders})", values)
+
+    async def update(self, job_id: str, fields: Dict[str, Any]) -> None:
+        fields = dict(fields)
+        if fields.get("result") is not None:
+            fields["result"] = json.dumps(fields["result"], ensure_ascii=False)
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        await self._run(f"UPDATE quick_answer_jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        rows = await self._run(
+            f"SELECT {', '.join(self._COLUMNS)} FROM quick_answer_jobs WHERE id = ?", (job_id,)
+        )
+        if not rows:
+            return None
+        job = dict(zip(self._COLUMNS, rows[0]))
+        if job["result"] is not None:
+            job["result"] = json.loads(job["result"])
+        return job
+
+    async def count_active(self, owner: str) -> int:
+        rows = await self._run(
+            "SELECT COUNT(*) FROM quick_answer_jobs WHERE owner = ? AND status IN (?, ?)",
+            (owner, JOB_QUEUED, JOB_RUNNING)
+        )
+        return rows[0][0]
+
+    async def delete_expired(self, now: float) -> int:
+        return await self._run_write(
+            "DELETE FROM quick_answer_jobs WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)
+        )
+
+    async def renew_leases(self, worker_id: str, now: float) -> None:
+        await self._run(
+            "UPDATE quick_answer_jobs SET heartbeat_at = ? WHERE worker_id = ? AND status IN (?, ?)",
+            (now, worker_id, JOB_QUEUED, JOB_RUNNING)
+        )
+
+    async def fail_abandoned(self, worker_id: str, before: float, error: str) -> int:
+        """把其他进程留下、且 before 之后没有续约的未完成任务标记为失败"""
+        now = time.time()
+        return await self._run_write(
+            "UPDATE quick_answer_jobs SET status = ?, error = ?, updated_at = ?, expires_at = ? "
+            "WHERE status IN (?, ?) AND (worker_id IS NULL OR worker_id != ?) "
+            "AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+            (JOB_FAILED, error, now, now + JOB_RESULT_TTL, JOB_QUEUED, JOB_RUNNING, worker_id, before)
+        )
+
+    async def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def create_job_store(settings: Settings):
+    """按配置创建任务存储"""
+    if settings.job_store_backend == "sqlite":
+        return SQLiteJobStore(settings.job_store_path)
+    return InMemoryJobStore()
+
+
+class QuickAnswerJobQueue:
+    """快速回答任务队列
+
+    - 队列深度有上限，已满时提交返回503
+    - 每个用户（或匿名IP）同时排队/运行的任务数有上限，超过返回429
+    - 检查上限和创建任务在同一把锁内完成，并发提交不会超过上限，队列满时也不会留下无人处理的任务
+    - 已完成任务的结果保留 JOB_RESULT_TTL 秒后清理
+    - 任务沿用提交者的公平调度队列，与同步请求一起参与上游调度
+    - 每个进程有独立的 worker_id，定期为自己的未完成任务续约；其他进程留下的任务
+      超过 JOB_LEASE_TIMEOUT 秒未续约才被标记为中断，多进程共享SQLite文件时不会误杀运行中的任务
+    """
+
+    def __init__(self, settings: Settings, store):
+        self.settings = settings
+        self.store = store
+        self.worker_id = uuid.uuid4().hex
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue(maxsize=JOB_QUEUE_MAX_DEPTH)
+        self._flows: Dict[str, LLMFlow] = {}
+        self._watchers: Dict[str, List[asyncio.Event]] = {}
+        self._tasks: List["asyncio.Task[None]"] = []
+        # 只有 submit 向队列放入任务，持锁期间检查的名额不会被其他提交占用
+        self._submit_lock = asyncio.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+
+    async def start(self) -> None:
+        """启动工作协程和过期清理协程"""
+        await self._fail_abandoned()
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(JOB_WORKERS)]
+        self._tasks.append(asyncio.ensure_future(self._janitor()))
+        self._tasks.append(asyncio.ensure_future(self._lease_keeper()))
+        print(f"快速回答任务队列已启动，工作协程数: {JOB_WORKERS}")
+
+    async def stop(self) -> None:
+        """停止所有协程并关闭存储"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.store.close()
+
+    async def submit(self, owner: str, prompt: str, model: str) -> Dict[str, Any]:
+        """提交任务，立即返回任务记录"""
+        if not prompt or not prompt.strip():
+            raise HTTPException(status_code=400, detail="提示词不能为空")
+
+        async with self._submit_lock:
+            if self._queue.full():
+                raise HTTPException(
+                    status_code=503,
+                    detail="任务队列已满，请稍后重试",
+                    headers={"Retry-After": str(LLM_SHED_RETRY_AFTER)}
+                )
+            if await self.store.count_active(owner) >= JOB_MAX_PER_USER:
+                raise HTTPException(
+                    status_code=429,
+                    detail=f"进行中的任务过多（最多{JOB_MAX_PER_USER}个），请等待已有任务完成"
+                )
+
+            now = time.time()
+            job = {
+                "id": uuid.uuid4().hex,
+                "owner": owner,
+                "status": JOB_QUEUED,
+                "prompt": prompt,
+                "model": model,
+                "result": None,
+                "error": None,
+                "created_at": now,
+                "updated_at": now,
+                "expires_at": None,
+                "worker_id": self.worker_id,
+                "heartbeat_at": now
+            }
+            await self.store.create(job)
+            try:
+                self._queue.put_nowait(job["id"])
+            except asyncio.QueueFull:
+                # 不应发生（持锁前已检查）；任务标记为失败，不占用用户名额
+                await self._finish(job["id"], error="任务队列已满，请稍后重试")
+                raise HTTPException(
+                    status_code=503,
+                    detail="任务队列已满，请稍后重试",
+                    headers={"Retry-After": str(LLM_SHED_RETRY_AFTER)}
+                )
+            self._flows[job["id"]] = current_llm_flow()
+            self.submitted += 1
+            return job
+
+    async def get(self, job_id: str, owner: str) -> Optional[Dict[str, Any]]:
+        """获取任务（只能查询自己提交的任务）"""
+        job = await self.store.get(job_id)
+        if job is None or job["owner"] != owner:
+            return None
+        return job
+
+    async def wait(self, job_id: str, timeout: float) -> None:
+        """等待任务状态变化，超时直接返回"""
+        event = asyncio.Event()
+        self._watchers.setdefault(job_id, []).append(event)
+        try:
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            watchers = self._watchers.get(job_id, [])
+            if event in watchers:
+                watchers.remove(event)
+            if not watchers:
+                self._watchers.pop(job_id, None)
+
+    async def _set_status(self, job_id: str, fields: Dict[str, Any]) -> None:
+        fields["updated_at"] = time.time()
+        await self.store.update(job_id, fields)
+        for event in self._watchers.get(job_id, []):
+            event.set()
+
+    async def _worker(self) -> None:
+        service = get_quick_answer_service()
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run_job(service, job_id)
+            finally:
+                self._queue.task_done()
+
+    async def _run_job(self, service: QuickAnswerService, job_id: str) -> None:
+        job = await self.store.get(job_id)
+        flow = self._flows.pop(job_id, None)
+        if job is None:
+            return
+
+        if flow is not None:
+            set_llm_flow(flow)
+        await self._set_status(job_id, {"status": JOB_RUNNING})
+        try:
+            result = await service.generate_answer(prompt=job["prompt"], model=job["model"])
+        except asyncio.CancelledError:
+            raise
+        except HTTPException as e:
+            await self._finish(job_id, error=str(e.detail))
+        except Exception as e:
+            await self._finish(job_id, error=f"快速回答生成失败: {str(e)}")
+        else:
+            await self._finish(job_id, result=result)
+
+    async def _finish(self, job_id: str, result: Optional[Dict[str, Any]] = None, error: Optional[str] = None) -> None:
+        if error is None:
+            self.completed += 1
+        else:
+            self.failed += 1
+            print(f"快速回答任务 {job_id} 失败: {error}")
+        await self._set_status(job_id, {
+            "status": JOB_SUCCEEDED if error is None else JOB_FAILED,
+            "result": result,
+            "error": error,
+            "expires_at": time.time() + JOB_RESULT_TTL
+        })
+
+    async def _fail_abandoned(self) -> None:
+        """把已退出进程留下的未完成任务标记为失败"""
+        interrupted = await self.store.fail_abandoned(
+            self.worker_id, time.time() - JOB_LEASE_TIMEOUT, JOB_INTERRUPTED_ERROR
+        )
+        if interrupted:
+            print(f"快速回答任务队列: {interrupted} 个未完成任务的所属进程已退出，标记为失败")
+
+    async def _lease_keeper(self) -> None:
+        while True:
+            await asyncio.sleep(JOB_LEASE_RENEW_INTERVAL)
+            try:
+                await self.store.renew_leases(self.worker_id, time.time())
+            except Exception as e:
+                print(f"任务续约失败: {e}")
+
+    async def _janitor(self) -> None:
+        while True:
+            await asyncio.sleep(JOB_CLEANUP_INTERVAL)
+            try:
+                removed = await self.store.delete_expired(time.time())
+                if removed:
+                    print(f"快速回答任务队列: 清理 {removed} 个过期任务")
+                await self._fail_abandoned()
+            except Exception as e:
+                print(f"清理过期任务失败: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": type(self.store).__name__,
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": JOB_QUEUE_MAX_DEPTH,
+            "workers": JOB_WORKERS,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+
+# 进程级任务队列（在应用启动时创建）
+_job_queue: Optional[QuickAnswerJobQueue] = None
+
+
+async def init_job_queue(settings: Settings) -> QuickAnswerJobQueue:
+    """创建并启动任务队列（未在启动时创建则在首次使用时懒加载）"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = QuickAnswerJobQueue(settings, create_job_store(settings))
+        await _job_queue.start()
+    return _job_queue
+
+
+async def close_job_queue() -> None:
+    """停止任务队列"""
+    global _job_queue
+    if _job_queue is not None:
+        await _job_queue.stop()
+        _job_queue = None
+
+
+def job_queue_stats() -> Dict[str, Any]:
+    return _job_queue.stats() if _job_queue is not None else {}
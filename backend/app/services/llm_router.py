@@ -0,0 +1,181 @@
+"""
+LLM路由模块
+按提供商/模型跟踪滚动延迟和错误率，支持故障切换和对冲请求
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple, Type, TypeVar
+
+from ..constants import (
+    LLM_ROUTER_WINDOW, LLM_ROUTER_MIN_SAMPLES, LLM_ROUTER_ERROR_THRESHOLD, LLM_HEDGE_MAX_RATIO
+)
+
+T = TypeVar("T")
+
+
+class LatencyWindow:
+    """滚动窗口内的延迟样本（只统计成功请求）"""
+
+    def __init__(self, size: int):
+        self.samples: Deque[float] = deque(maxlen=size)
+
+    def record(self, latency: float) -> None:
+        self.samples.append(latency)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """计算分位数，样本为空时返回None"""
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        index = min(len(ordered) - 1, int(q * len(ordered)))
+        return ordered[index]
+
+
+class LLMRouter:
+    """延迟感知的LLM路由器
+
+    - 每个 模型@token上限 维护一个延迟窗口，用于计算p50/p95
+    - 每个模型维护一个结果窗口，用于计算错误率，错误率过高的模型排到候选末尾
+    - 主模型在p95内未返回时向备用模型发送对冲请求，先完成者胜出，另一个被取消
+    - 主模型因 failover_errors 中的错误失败时立即切换到备用模型；其他错误直接抛出，也不计入错误率
+    """
+
+    def __init__(self, failover_errors: Tuple[Type[BaseException], ...] = (Exception,)):
+        self.failover_errors = failover_errors
+        self._latency: Dict[str, LatencyWindow] = {}
+        self._outcomes: Dict[str, Deque[bool]] = {}
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    @staticmethod
+    def _latency_key(model: str, max_tokens: int, kind: str = "call") -> str:
+        return f"{model}@{max_tokens}:{kind}"
+
+    def record(self, model: str, max_tokens: int, latency: float, ok: bool, kind: str = "call") -> None:
+        """记录一次调用结果"""
+        outcomes = self._outcomes.setdefault(model, deque(maxlen=LLM_ROUTER_WINDOW))
+        outcomes.append(ok)
+        if ok:
+            key = self._latency_key(model, max_tokens, kind)
+            window = self._latency.setdefault(key, LatencyWindow(LLM_ROUTER_WINDOW))
+            window.record(latency)
+
+    def error_rate(self, model: str) -> float:
+        outcomes = self._outcomes.get(model)
+        if not outcomes:
+            return 0.0
+        return outcomes.count(False) / len(outcomes)
+
+    def is_healthy(self, model: str) -> bool:
+        """样本不足或错误率低于阈值视为健康"""
+        outcomes = self._outcomes.get(model)
+        if not outcomes or len(outcomes) < LLM_ROUTER_MIN_SAMPLES:
+            return True
+        return self.error_rate(model) < LLM_ROUTER_ERROR_THRESHOLD
+
+    def order(self, models: List[str]) -> List[str]:
+        """按健康状况排序候选模型（保持原有偏好顺序，不健康的排在后面）"""
+        return sorted(models, key=lambda m: 0 if self.is_healthy(m) else 1)
+
+    def hedge_delay(self, model: str, max_tokens: int) -> Optional[float]:
+        """对冲等待时间：主模型的p95延迟，样本不足时不对冲"""
+        window = self._latency.get(self._latency_key(model, max_tokens))
+        if window is None or len(window.samples) < LLM_ROUTER_MIN_SAMPLES:
+            return None
+        return window.percentile(0.95)
+
+    def _can_hedge(self) -> bool:
+        """限制对冲请求比例，避免放大上游负载"""
+        return self.hedges < max(1, self.requests) * LLM_HEDGE_MAX_RATIO
+
+    async def _timed(self, model: str, max_tokens: int, func: Callable[[str], Awaitable[T]]) -> T:
+        start_time = time.monotonic()
+        try:
+            result = await func(model)
+        except asyncio.CancelledError:
+            # 被取消的对冲请求不计入统计
+            raise
+        except self.failover_errors:
+            self.record(model, max_tokens, time.monotonic() - start_time, False)
+            raise
+        self.record(model, max_tokens, time.monotonic() - start_time, True)
+        return result
+
+    def _start(self, model: str, max_tokens: int, func: Callable[[str], Awaitable[T]]) -> "asyncio.Task[T]":
+        return asyncio.ensure_future(self._timed(model, max_tokens, func))
+
+    async def call(self, models: List[str], max_tokens: int, func: Callable[[str], Awaitable[T]]) -> T:
+        """按候选模型调用，必要时故障切换或发送对冲请求
+
+        Args:
+            models: 候选模型列表，第一个为首选
+            max_tokens: token上限（延迟统计按此分桶）
+            func: 以模型名为参数的调用函数
+        """
+        self.requests += 1
+        candidates = self.order(models)
+        primary = candidates[0]
+        secondary = candidates[1] if len(candidates) > 1 else None
+
+        primary_task = self._start(primary, max_tokens, func)
+        if secondary is None:
+            return await primary_task
+
+        pending = {primary_task}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=self.hedge_delay(primary, max_tokens))
+            if done:
+                try:
+                    return primary_task.result()
+                except self.failover_errors as e:
+                    self.failovers += 1
+                    print(f"模型 {primary} 调用失败，切换到备用模型 {secondary}: {e}")
+                    return await self._start(secondary, max_tokens, func)
+
+            if not self._can_hedge():
+                return await primary_task
+
+            self.hedges += 1
+            print(f"模型 {primary} 超过p95延迟未返回，向备用模型 {secondary} 发送对冲请求")
+            hedge_task = self._start(secondary, max_tokens, func)
+            pending = {primary_task, hedge_task}
+            last_error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge_task:
+                            self.hedge_wins += 1
+                        return task.result()
+                    last_error = task.exception()
+                    if not isinstance(last_error, self.failover_errors):
+                        raise last_error
+            raise last_error
+        finally:
+            # 取消落败或调用方已放弃的请求
+            for task in pending:
+                if not task.done():
+                    task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        """路由统计信息"""
+        targets = {}
+        for key, window in self._latency.items():
+            p50 = window.percentile(0.5)
+            p95 = window.percentile(0.95)
+            targets[key] = {
+                "samples": len(window.samples),
+                "p50_seconds": round(p50, 3) if p50 is not None else None,
+                "p95_seconds": round(p95, 3) if p95 is not None else None
+            }
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "error_rates": {model: round(self.error_rate(model), 4) for model in self._outcomes},
+            "latency": targets
+        }
@@ -2,59 +2,125 @@
 LLM API调用服务
 处理与各种LLM API的交互
 """
-from openai import OpenAI
+from openai import AsyncOpenAI
 import openai
+import httpx
+import asyncio
+import hashlib
+import json
+import math
 import time
+from functools import lru_cache
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from fastapi import HTTPException
 
-from ..config import Settings
-from ..constants import API_TIMEOUT, API_TEMPERATURE, API_MAX_TOKENS, API_MAX_TOKENS_THINKING
+from ..config import Settings, get_settings
+from ..constants import (
+    API_TIMEOUT, API_TEMPERATURE, API_MAX_TOKENS, API_MAX_TOKENS_THINKING,
+    LLM_MAX_CONNECTIONS, LLM_MAX_KEEPALIVE_CONNECTIONS, LLM_KEEPALIVE_EXPIRY,
+    LLM_CACHE_MAX_BYTES, LLM_CACHE_TTL, LLM_FALLBACK_MODELS,
+    LLM_MAX_RETRIES, LLM_RETRY_MAX_DELAY
+)
+from .cache import LRUCache
+from .llm_router import LLMRouter
+from .admission import get_admission_gate
+from .resilience import (
+    RetryBudget, UpstreamUnavailableError, get_circuit_breaker, backoff_delay, parse_retry_after
+)
+from .single_flight import SingleFlight
 
 
-class LLMService:
-    """LLM服务类"""
-    
-    def __init__(self, settings: Settings):
-        self.settings = settings
-    
-    def _create_deepseek_client(self) -> OpenAI:
-        """创建DeepSeek客户端"""
-        if not self.settings.my_llm_api_key:
-            raise HTTPException(
-                status_code=500,
-                detail="DeepSeek API密钥未配置：请检查环境变量 MY_LLM_API_KEY 是否正确设置"
-            )
-        
-        return OpenAI(
-            api_key=self.settings.my_llm_api_key,
-            base_url=self.settings.deepseek_base_url
+# 提供商配置：(API密钥属性名, 基础URL属性名, 显示名称, 环境变量名)
+LLM_PROVIDERS = {
+    "deepseek": ("my_llm_api_key", "deepseek_base_url", "DeepSeek", "MY_LLM_API_KEY"),
+    "gemini": ("gemini_api_key", "gemini_base_url", "Gemini", "GEMINI_API_KEY"),
+}
+
+# 进程级共享的异步客户端（每个提供商一个，复用连接池和TLS会话）
+_llm_clients: Dict[str, AsyncOpenAI] = {}
+
+# 进程级LLM结果缓存（键为完整消息+模型+采样参数的哈希）
+llm_result_cache = LRUCache("llm_result", LLM_CACHE_MAX_BYTES, LLM_CACHE_TTL)
+
+# 进程级请求合并器：相同的并发LLM请求只调用一次上游
+llm_single_flight = SingleFlight("llm")
+
+# 进程级LLM路由器：跟踪各模型的延迟和错误率，只在上游暂时不可用时切换到备用模型
+llm_router = LLMRouter(failover_errors=(UpstreamUnavailableError,))
+
+# 进程级重试预算：所有提供商共享，防止重试放大上游故障
+llm_retry_budget = RetryBudget()
+
+# 可重试的上游错误（连接失败/超时、限流、5xx）
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+
+def build_llm_request_key(model: str, messages: list, max_tokens: int) -> str:
+    """根据完整格式化后的消息、模型和采样参数生成内容寻址的请求键（用于缓存和请求合并）"""
+    payload = json.dumps({
+        "model": model,
+        "messages": messages,
+        "temperature": API_TEMPERATURE,
+        "max_tokens": max_tokens
+    }, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _build_llm_client(settings: Settings, provider: str) -> AsyncOpenAI:
+    """创建带连接池的异步客户端"""
+    key_attr, url_attr, _, _ = LLM_PROVIDERS[provider]
+    http_client = httpx.AsyncClient(
+        timeout=httpx.Timeout(API_TIMEOUT, connect=10.0),
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY
         )
-    
-    def _create_gemini_client(self) -> OpenAI:
-        """创建Gemini客户端"""
-        if not self.settings.gemini_api_key:
+    )
+    # 重试由 LLMService 统一处理（受熔断器和重试预算约束），关闭SDK内置重试
+    return AsyncOpenAI(
+        api_key=getattr(settings, key_attr),
+        base_url=getattr(settings, url_attr),
+        http_client=http_client,
+        max_retries=0
+    )
+
+
+def init_llm_clients(settings: Settings) -> None:
+    """在应用启动时为所有已配置密钥的提供商创建共享客户端"""
+    for provider, (key_attr, _, name, _) in LLM_PROVIDERS.items():
+        if provider not in _llm_clients and getattr(settings, key_attr):
+            _llm_clients[provider] = _build_llm_client(settings, provider)
+            print(f"{name} 异步客户端已创建")
+
+
+async def close_llm_clients() -> None:
+    """在应用关闭时释放所有共享客户端的连接池"""
+    for client in _llm_clients.values():
+        await client.close()
+    _llm_clients.clear()
+
+
+def get_llm_client(settings: Settings, provider: str) -> AsyncOpenAI:
+    """获取提供商的共享客户端（未在启动时创建则懒加载，兼容无生命周期事件的Serverless环境）"""
+    client = _llm_clients.get(provider)
+    if client is None:
+        key_attr, _, name, env_name = LLM_PROVIDERS[provider]
+        if not getattr(settings, key_attr):
             raise HTTPException(
                 status_code=500,
-                detail="Gemini API密钥未配置：请检查环境变量 GEMINI_API_KEY 是否正确设置"
+                detail=f"{name} API密钥未配置：请检查环境变量 {env_name} 是否正确设置"
             )
-        
-        return OpenAI(
-            api_key=self.settings.gemini_api_key,
-            base_url=self.settings.gemini_base_url
-        )
+        client = _build_llm_client(settings, provider)
+        _llm_clients[provider] = client
+    return client
+
+
+class LLMService:
+    """LLM服务类"""
     
-    def _create_gemini_quick_client(self) -> OpenAI:
-        """创建Gemini快速回答客户端（使用新的API密钥）"""
-        if not self.settings.gemini_quick_api_key:
-            raise HTTPException(
-                status_code=500,
-                detail="Gemini Quick API密钥未配置：请检查环境变量 GEMINI_QUICK_API_KEY 是否正确设置"
-            )
-        
-        return OpenAI(
-            api_key=self.settings.gemini_quick_api_key,
-            base_url=self.settings.gemini_quick_base_url
-        )
+    def __init__(self, settings: Settings):
+        self.settings = settings
     
     def _create_system_message(self) -> str:
         """创建系统消息"""
@@ -62,114 +128,80 @@ class LLMService:
                 "并将其改写得更清晰、更具体、结构更合理、信息更充分，以便任何AI模型都能更好地理解"
                 "并给出高质量的回复。请直接返回优化后的提示词文本，不要包含任何额外的解释或对话。")
     
-    async def call_deepseek_api(self, model: str, messages: list) -> str:
-        """调用DeepSeek API"""
-        try:
-            client = self._create_deepseek_client()
-            start_time = time.time()
-            
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                stream=False,
-                temperature=API_TEMPERATURE,
-                max_tokens=API_MAX_TOKENS
-            )
+    async def _create_completion(self, provider: str, **params):
+        """调用提供商的chat completions接口
 
-            content = response.choices[0].message.content.strip()
-            print(f"DeepSeek API响应成功，模型: {model}，耗时: {time.time() - start_time:.2f}s，内容长度: {len(content)}")
-            return content
-            
-        except openai.APIConnectionError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"DeepSeek API连接失败: {str(e)}"
-            )
-        except openai.RateLimitError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"DeepSeek API速率限制: {str(e)}"
-            )
-        except openai.APIStatusError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"DeepSeek API状态错误: {str(e)}"
-            )
-        except openai.APIError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"DeepSeek API调用失败: {str(e)}"
-            )
-    
-    async def call_gemini_api(self, model: str, messages: list) -> str:
-        """调用Gemini API"""
-        try:
-            client = self._create_gemini_client()
-            
-            print(f"使用Gemini模型: {model}")
-            print(f"API密钥: {self.settings.gemini_api_key[:10]}...")
-            
-            response = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=API_TEMPERATURE,
-                max_tokens=API_MAX_TOKENS
-            )
-            
-            # 处理响应
-            if response.choices and len(response.choices) > 0:
-                message = response.choices[0].message
-                if message and message.content and message.content.strip():
-                    optimized_prompt = message.content.strip()
-                    print(f"Gemini响应成功，内容长度: {len(optimized_prompt)}")
-                    return optimized_prompt
-                else:
-                    print(f"Gemini响应为空，模型: {model}")
-                    # 对于快速回答功能，不使用备用模型以避免不一致的行为
-                    # 只对提示词优化功能的某些模型使用备用处理
-                    if model == "gemini-2.5-pro-preview-03-25":
-                        print("尝试使用gemini-2.0-flash作为备用")
-                        backup_response = client.chat.completions.create(
-                            model="gemini-2.0-flash",
-                            messages=messages,
-                            temperature=API_TEMPERATURE,
-                            max_tokens=API_MAX_TOKENS
-                        )
-                        if backup_response.choices and backup_response.choices[0].message.content:
-                            optimized_prompt = backup_response.choices[0].message.content.strip()
-                            print(f"备用模型响应成功，内容长度: {len(optimized_prompt)}")
-                            return optimized_prompt
-                        else:
-                            raise HTTPException(
-                                status_code=500,
-                                detail="Gemini模型暂时无法处理此请求，请稍后重试或选择其他模型"
-                            )
-                    else:
-                        raise HTTPException(
-                            status_code=500,
-                            detail="Gemini API返回空响应，请稍后重试"
-                        )
-            else:
-                print("Gemini响应格式错误")
-                raise HTTPException(
-                    status_code=500,
-                    detail="Gemini API响应格式错误"
+        - 上游基础URL的熔断器打开时直接返回503，不再发送注定失败的请求
+        - 连接失败、限流和5xx错误按抖动指数退避重试，限流时遵循 Retry-After
+        - 只有连接失败和5xx计入熔断；限流说明上游正常，只退避重试
+        - 重试次数受全局重试预算约束
+        """
+        _, url_attr, provider_name, _ = LLM_PROVIDERS[provider]
+        client = get_llm_client(self.settings, provider)
+        breaker = get_circuit_breaker(getattr(self.settings, url_attr))
+        llm_retry_budget.record_request()
+
+        attempt = 0
+        while True:
+            if not breaker.allow_request():
+                raise UpstreamUnavailableError(
+                    status_code=503,
+                    detail=f"{provider_name} API暂时不可用，请稍后重试",
+                    headers={"Retry-After": str(math.ceil(breaker.retry_after()))}
                 )
-                
-        except openai.APIError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Gemini API调用失败: {str(e)}"
-            )
-    
+
+            try:
+                response = await client.chat.completions.create(**params)
+            except RETRYABLE_ERRORS as e:
+                retry_after = None
+                if isinstance(e, openai.RateLimitError):
+                    retry_after = parse_retry_after(e.response.headers.get("retry-after"))
+                else:
+                    breaker.record_failure()
+                    if breaker.is_open:
+                        # 本次失败触发熔断，直接快速失败
+                        continue
+                if (attempt >= LLM_MAX_RETRIES
+                        or (retry_after or 0) > LLM_RETRY_MAX_DELAY
+                        or not llm_retry_budget.try_acquire()):
+                    raise
+                delay = backoff_delay(attempt, retry_after)
+                attempt += 1
+                print(f"{provider_name} API调用失败，{delay:.2f}s 后第 {attempt} 次重试: {e}")
+                await asyncio.sleep(delay)
+                continue
+            except openai.APIStatusError:
+                # 其他4xx错误说明上游可达，不计入熔断
+                breaker.record_success()
+                raise
+
+            breaker.record_success()
+            return response
+
+    @staticmethod
+    def _rate_limit_exception(provider_name: str, e: openai.RateLimitError) -> HTTPException:
+        """上游限流转换为503，并透传 Retry-After"""
+        retry_after = parse_retry_after(e.response.headers.get("retry-after"))
+        return UpstreamUnavailableError(
+            status_code=503,
+            detail=f"{provider_name} API速率限制: {str(e)}",
+            headers={"Retry-After": str(math.ceil(retry_after or LLM_RETRY_MAX_DELAY))}
+        )
+
+    @staticmethod
+    def _api_exception(detail: str, e: openai.APIError) -> HTTPException:
+        """上游错误转换为500；连接失败、超时和5xx标记为暂时不可用，可以切换到备用模型"""
+        if isinstance(e, RETRYABLE_ERRORS) or (isinstance(e, openai.APIStatusError) and e.status_code >= 500):
+            return UpstreamUnavailableError(status_code=500, detail=detail)
+        return HTTPException(status_code=500, detail=detail)
+
     async def call_gemini_api_with_tokens(self, model: str, messages: list, max_tokens: int) -> str:
         """调用Gemini API（带自定义token限制）"""
         try:
-            client = self._create_gemini_client()
-            
             print(f"使用Gemini模型: {model}, max_tokens: {max_tokens}")
             
-            response = client.chat.completions.create(
+            response = await self._create_completion(
+                "gemini",
                 model=model,
                 messages=messages,
                 temperature=API_TEMPERATURE,
@@ -186,51 +218,31 @@ class LLMService:
                     print(f"Gemini响应成功，内容长度: {len(optimized_prompt)}")
                     return optimized_prompt
                 else:
+                    # 空响应按失败处理，由路由器切换到备用模型
                     print(f"Gemini响应为空，模型: {model}")
-                    # 对于快速回答功能，不使用备用模型以避免不一致的行为
-                    # 只对提示词优化功能的某些模型使用备用处理
-                    if model == "gemini-2.5-pro-preview-03-25":
-                        print("尝试使用gemini-2.0-flash作为备用")
-                        backup_response = client.chat.completions.create(
-                            model="gemini-2.0-flash",
-                            messages=messages,
-                            temperature=API_TEMPERATURE,
-                            max_tokens=max_tokens
-                        )
-                        if backup_response.choices and backup_response.choices[0].message.content:
-                            optimized_prompt = backup_response.choices[0].message.content.strip()
-                            print(f"备用模型响应成功，内容长度: {len(optimized_prompt)}")
-                            return optimized_prompt
-                        else:
-                            raise HTTPException(
-                                status_code=500,
-                                detail="Gemini模型暂时无法处理此请求，请稍后重试或选择其他模型"
-                            )
-                    else:
-                        raise HTTPException(
-                            status_code=500,
-                            detail="Gemini API返回空响应，请稍后重试"
-                        )
+                    raise UpstreamUnavailableError(
+                        status_code=500,
+                        detail="Gemini API返回空响应，请稍后重试"
+                    )
             else:
                 print("Gemini响应格式错误")
-                raise HTTPException(
+                raise UpstreamUnavailableError(
                     status_code=500,
                     detail="Gemini API响应格式错误"
                 )
                 
+        except openai.RateLimitError as e:
+            raise self._rate_limit_exception("Gemini", e)
         except openai.APIError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Gemini API调用失败: {str(e)}"
-            )
+            raise self._api_exception(f"Gemini API调用失败: {str(e)}", e)
     
     async def call_deepseek_api_with_tokens(self, model: str, messages: list, max_tokens: int) -> str:
         """调用DeepSeek API（带自定义token限制）"""
         try:
-            client = self._create_deepseek_client()
             start_time = time.time()
             
-            response = client.chat.completions.create(
+            response = await self._create_completion(
+                "deepseek",
                 model=model,
                 messages=messages,
                 stream=False,
@@ -243,89 +255,198 @@ class LLMService:
             return content
             
         except openai.APIConnectionError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"DeepSeek API连接失败: {str(e)}"
-            )
+            raise self._api_exception(f"DeepSeek API连接失败: {str(e)}", e)
         except openai.RateLimitError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"DeepSeek API速率限制: {str(e)}"
-            )
+            raise self._rate_limit_exception("DeepSeek", e)
         except openai.APIStatusError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"DeepSeek API状态错误: {str(e)}"
-            )
+            raise self._api_exception(f"DeepSeek API状态错误: {str(e)}", e)
         except openai.APIError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"DeepSeek API调用失败: {str(e)}"
-            )
+            raise self._api_exception(f"DeepSeek API调用失败: {str(e)}", e)
+
+    @staticmethod
+    def _provider_for_model(model: str) -> str:
+        return "gemini" if model.startswith("gemini-") else "deepseek"
+
+    def _route_candidates(self, model: str) -> List[str]:
+        """候选模型：首选模型，加上提供商密钥已配置的备用模型"""
+        candidates = [model]
+        fallback = LLM_FALLBACK_MODELS.get(model)
+        if fallback and fallback != model:
+            key_attr = LLM_PROVIDERS[self._provider_for_model(fallback)][0]
+            if getattr(self.settings, key_attr):
+                candidates.append(fallback)
+                # 首选提供商熔断中时直接改走备用模型
+                if self._is_circuit_open(model):
+                    candidates.reverse()
+        return candidates
+
+    def _is_circuit_open(self, model: str) -> bool:
+        url_attr = LLM_PROVIDERS[self._provider_for_model(model)][1]
+        return get_circuit_breaker(getattr(self.settings, url_attr)).is_open
+
+    async def _call_provider(self, model: str, messages: list, max_tokens: int) -> str:
+        """按模型路由到对应的提供商（在提供商的并发名额内执行）"""
+        provider = self._provider_for_model(model)
+        async with get_admission_gate(provider).slot(cost=max_tokens):
+            if provider == "gemini":
+                return await self.call_gemini_api_with_tokens(model, messages, max_tokens)
+            else:
+                return await self.call_deepseek_api_with_tokens(model, messages, max_tokens)
+
+    async def _call_routed(self, model: str, messages: list, max_tokens: int) -> Tuple[str, str]:
+        """经路由器调用：主模型失败时切换、超过p95时对冲到备用模型
+
+        Returns:
+            (实际返回结果的模型, 内容)
+        """
+        async def call_candidate(candidate: str) -> Tuple[str, str]:
+            return candidate, await self._call_provider(candidate, messages, max_tokens)
+
+        return await llm_router.call(self._route_candidates(model), max_tokens, call_candidate)
+
+    async def _call_coalesced_with_model(self, model: str, messages: list, max_tokens: int) -> Tuple[str, str]:
+        """调用LLM，相同消息、模型和token限制的并发请求共享一次上游调用，返回 (实际返回结果的模型, 内容)"""
+        request_key = build_llm_request_key(model, messages, max_tokens)
+        return await llm_single_flight.do(
+            request_key,
+            lambda: self._call_routed(model, messages, max_tokens)
+        )
+
+    async def _call_coalesced(self, model: str, messages: list, max_tokens: int) -> str:
+        """调用LLM，相同消息、模型和token限制的并发请求共享一次上游调用"""
+        _, content = await self._call_coalesced_with_model(model, messages, max_tokens)
+        return content
     
     async def call_llm_api(self, model: str, messages: list) -> str:
         """统一的LLM API调用接口"""
-        if model.startswith("gemini-"):
-            return await self.call_gemini_api(model, messages)
-        else:
-            return await self.call_deepseek_api(model, messages)
+        return await self._call_coalesced(model, messages, API_MAX_TOKENS)
+
+    async def call_llm_api_cached(self, model: str, messages: list, bypass_cache: bool = False) -> str:
+        """带结果缓存的LLM API调用接口
+
+        相同的消息、模型和采样参数直接返回缓存结果；bypass_cache 为真时
+        跳过读取缓存，强制请求上游，并用新结果刷新缓存。
+        由备用模型（故障切换或对冲）返回的结果不缓存，首选模型恢复后重新请求。
+        """
+        cache_key = build_llm_request_key(model, messages, API_MAX_TOKENS)
+        if not bypass_cache:
+            cached = llm_result_cache.get(cache_key)
+            if cached is not None:
+                print(f"LLM结果缓存命中，模型: {model}，内容长度: {len(cached)}")
+                return cached
+
+        answered_by, content = await self._call_coalesced_with_model(model, messages, API_MAX_TOKENS)
+        if answered_by == model:
+            llm_result_cache.set(cache_key, content)
+        return content
     
     async def call_llm_api_thinking(self, model: str, messages: list) -> str:
         """思考模式专用的LLM API调用接口（使用更高的token限制）"""
-        if model.startswith("gemini-"):
-            return await self.call_gemini_api_with_tokens(model, messages, API_MAX_TOKENS_THINKING)
-        else:
-            return await self.call_deepseek_api_with_tokens(model, messages, API_MAX_TOKENS_THINKING)
+        return await self._call_coalesced(model, messages, API_MAX_TOKENS_THINKING)
     
-    async def call_gemini_quick_api_with_tokens(self, model: str, messages: list, max_tokens: int) -> str:
-        """调用Gemini Quick API（用于快速回答功能）"""
+    async def call_llm_api_with_custom_tokens(self, model: str, messages: list, max_tokens: int = API_MAX_TOKENS) -> str:
+        """带自定义token限制的LLM API调用接口"""
+        # 统一使用标准的API调用，不再使用Google官方API
+        return await self._call_coalesced(model, messages, max_tokens)
+
+    def stream_llm_api(
+        self, model: str, messages: list, max_tokens: int = API_MAX_TOKENS, cache_result: bool = False
+    ) -> AsyncIterator[str]:
+        """流式LLM API调用接口，逐段产出增量文本
+
+        相同请求的并发流共享一个上游流，后加入的订阅者会收到完整输出。
+        cache_result 为真时，首选模型完整返回的非空结果写入结果缓存（由发起上游流的调用决定）。
+        """
+        request_key = build_llm_request_key(model, messages, max_tokens)
+        return llm_single_flight.stream(
+            request_key,
+            lambda: self._stream_routed(model, messages, max_tokens, request_key if cache_result else None)
+        )
+
+    async def _stream_routed(
+        self, model: str, messages: list, max_tokens: int, cache_key: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """按健康状况选择模型流式调用，首个增量到达前上游暂时不可用则切换到下一个候选
+
+        cache_key 不为空时，首选模型返回的完整结果写入结果缓存；备用模型的结果不缓存。
+        """
+        candidates = llm_router.order(self._route_candidates(model))
+        for index, candidate in enumerate(candidates):
+            start_time = time.monotonic()
+            started = False
+            chunks = []
+            try:
+                async for delta in self._stream_provider(candidate, messages, max_tokens):
+                    if not started:
+                        started = True
+                        llm_router.record(candidate, max_tokens, time.monotonic() - start_time, True, kind="stream")
+                    chunks.append(delta)
+                    yield delta
+                content = "".join(chunks).strip()
+                if cache_key is not None and candidate == model and content:
+                    llm_result_cache.set(cache_key, content)
+                return
+            except UpstreamUnavailableError as e:
+                if started or index == len(candidates) - 1:
+                    raise
+                llm_router.record(candidate, max_tokens, time.monotonic() - start_time, False, kind="stream")
+                llm_router.failovers += 1
+                print(f"模型 {candidate} 流式调用失败，切换到备用模型 {candidates[index + 1]}: {e.detail}")
+
+    async def _stream_provider(self, model: str, messages: list, max_tokens: int) -> AsyncIterator[str]:
+        """流式调用对应提供商的API（整个流的生命周期占用一个并发名额）"""
+        provider = self._provider_for_model(model)
+        async with get_admission_gate(provider).slot(cost=max_tokens):
+            async for delta in self._stream_completion(provider, model, messages, max_tokens):
+                yield delta
+
+    async def _stream_completion(self, provider: str, model: str, messages: list, max_tokens: int) -> AsyncIterator[str]:
+        """发起流式请求并逐段产出增量文本（流建立后中断同样计入熔断）"""
+        _, url_attr, provider_name, _ = LLM_PROVIDERS[provider]
+        start_time = time.time()
+        first_token_time = None
+        content_length = 0
+
         try:
-            client = self._create_gemini_quick_client()
-            
-            print(f"使用Gemini Quick模型: {model}, max_tokens: {max_tokens}")
-            
-            response = client.chat.completions.create(
+            stream = await self._create_completion(
+                provider,
                 model=model,
                 messages=messages,
+                stream=True,
                 temperature=API_TEMPERATURE,
                 max_tokens=max_tokens
             )
-            
-            # 处理响应
-            if response.choices and len(response.choices) > 0:
-                choice = response.choices[0]
-                message = choice.message
-                
-                if message and message.content and message.content.strip():
-                    optimized_prompt = message.content.strip()
-                    print(f"Gemini Quick响应成功，内容长度: {len(optimized_prompt)}")
-                    return optimized_prompt
-                else:
-                    print(f"Gemini Quick响应为空，模型: {model}")
-                    raise HTTPException(
+            try:
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        if first_token_time is None:
+                            first_token_time = time.time() - start_time
+                        content_length += len(delta)
+                        yield delta
+            except (openai.APIError, httpx.HTTPError) as e:
+                # 上游4xx（含限流）不计入熔断
+                if not isinstance(e, openai.APIStatusError) or e.status_code >= 500:
+                    get_circuit_breaker(getattr(self.settings, url_attr)).record_failure()
+                if isinstance(e, httpx.HTTPError):
+                    raise UpstreamUnavailableError(
                         status_code=500,
-                        detail="Gemini Quick API返回空响应，请稍后重试"
+                        detail=f"{provider_name} API流式调用中断: {str(e)}"
                     )
-            else:
-                print("Gemini Quick响应格式错误")
-                raise HTTPException(
-                    status_code=500,
-                    detail="Gemini Quick API响应格式错误"
-                )
-                
+                raise
+            finally:
+                # 客户端提前断开时也要释放上游连接
+                await stream.close()
+
+        except openai.RateLimitError as e:
+            raise self._rate_limit_exception(provider_name, e)
         except openai.APIError as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Gemini Quick API调用失败: {str(e)}"
-            )
+            raise self._api_exception(f"{provider_name} API流式调用失败: {str(e)}", e)
 
-    async def call_llm_api_with_custom_tokens(self, model: str, messages: list, max_tokens: int = API_MAX_TOKENS) -> str:
-        """带自定义token限制的LLM API调用接口"""
-        # 统一使用标准的API调用，不再使用Google官方API
-        if model.startswith("gemini-"):
-            return await self.call_gemini_api_with_tokens(model, messages, max_tokens)
-        else:
-            return await self.call_deepseek_api_with_tokens(model, messages, max_tokens)
+        print(f"{provider_name} 流式响应完成，模型: {model}，首字耗时: {first_token_time or 0:.2f}s，"
+              f"总耗时: {time.time() - start_time:.2f}s，内容长度: {content_length}")
     
     def create_messages(self, formatted_content: str) -> list:
         """创建消息列表（用于提示词优化，包含系统消息）"""
@@ -339,3 +460,9 @@ class LLMService:
                 "content": formatted_content
             }
         ]
+
+
+@lru_cache()
+def get_llm_service() -> LLMService:
+    """获取LLM服务（单例模式）"""
+    return LLMService(get_settings())
@@ -3,25 +3,29 @@
 处理提示词优化的业务逻辑
 """
 from fastapi import HTTPException
-from typing import Optional
+from typing import Any, AsyncIterator, List, Optional, Tuple
+import asyncio
 import json
 import re
+from functools import lru_cache
 
-from ..config import Settings
-from ..constants import SUPPORTED_MODELS, get_meta_prompt_template, get_prompt_template_by_mode, get_thinking_optimization_template
+from ..config import Settings, get_settings
+from ..constants import API_MAX_TOKENS, BATCH_DEFAULT_PARALLELISM, SUPPORTED_MODELS, get_meta_prompt_template, get_prompt_template_by_mode, get_thinking_optimization_template
 from ..models import PromptRequest, PromptResponse, ThinkingAnalysisResponse, ThinkingOptimizationRequest, QuickOptionsRequest, QuickOptionsResponse
 from ..auth import User
-from .llm_service import LLMService
-from .supabase_service import SupabaseService
+from ..streaming import sse_event, ndjson_line
+from .llm_service import LLMService, build_llm_request_key, llm_result_cache, get_llm_service
+from .supabase_service import SupabaseService, get_supabase_service
+from .history_writer import get_history_writer
 
 
 class PromptService:
     """提示词优化服务类"""
     
-    def __init__(self, settings: Settings):
+    def __init__(self, settings: Settings, llm_service: Optional[LLMService] = None, supabase_service: Optional[SupabaseService] = None):
         self.settings = settings
-        self.llm_service = LLMService(settings)
-        self.supabase_service = SupabaseService(settings)
+        self.llm_service = llm_service or LLMService(settings)
+        self.supabase_service = supabase_service or SupabaseService(settings)
     
     def validate_model(self, model: str) -> None:
         """验证模型选择"""
@@ -46,8 +50,33 @@ class PromptService:
         template = get_prompt_template_by_mode(mode)
         return template.format(user_input_prompt=original_prompt)
     
-    async def optimize_prompt(self, request: PromptRequest, user: Optional[User] = None, client_ip: str = "unknown") -> PromptResponse:
-        """优化提示词"""
+    def _build_history_row(self, user: Optional[User], client_ip: str, original_prompt: str, optimized_prompt: str, mode: str) -> Optional[dict]:
+        """构建历史记录行（已登录用户使用用户ID，匿名用户使用IP生成的会话ID）"""
+        if user and user.id:
+            return self.supabase_service.build_history_row(
+                user_id=str(user.id),
+                original_prompt=original_prompt,
+                optimized_prompt=optimized_prompt,
+                mode=mode
+            )
+        session_id = f"anonymous_{client_ip}_{hash(client_ip) % 10000}"
+        return self.supabase_service.build_history_row(
+            session_id=session_id,
+            original_prompt=original_prompt,
+            optimized_prompt=optimized_prompt,
+            mode=mode
+        )
+
+    async def _save_history(self, user: Optional[User], client_ip: str, original_prompt: str, optimized_prompt: str, mode: str) -> None:
+        """保存历史记录（放入写入队列，由后台批量写入数据库，不等待写入完成）"""
+        row = self._build_history_row(user, client_ip, original_prompt, optimized_prompt, mode)
+        await get_history_writer(self.settings).enqueue(row)
+
+    async def optimize_prompt(self, request: PromptRequest, user: Optional[User] = None, client_ip: str = "unknown", save_history: bool = True) -> PromptResponse:
+        """优化提示词
+
+        save_history 为False时不保存历史记录（批量优化在结束时统一批量写入）
+        """
         try:
             # 验证模型
             self.validate_model(request.model)
@@ -62,27 +91,16 @@ class PromptService:
             # 创建消息列表
             messages = self.llm_service.create_messages(formatted_content)
             
-            # 调用LLM API
-            optimized_prompt = await self.llm_service.call_llm_api(request.model, messages)
+            # 调用LLM API（相同模板、模型和参数命中缓存时不消耗token）
+            optimized_prompt = await self.llm_service.call_llm_api_cached(
+                request.model,
+                messages,
+                bypass_cache=request.bypass_cache
+            )
 
             # 保存历史记录（支持已登录用户和匿名用户）
-            if user and user.id:
-                # 已登录用户，使用用户ID保存历史记录
-                await self.supabase_service.save_optimization_history(
-                    user_id=str(user.id),
-                    original_prompt=request.original_prompt,
-                    optimized_prompt=optimized_prompt,
-                    mode=request.mode
-                )
-            else:
-                # 匿名用户，使用IP地址生成会话ID保存历史记录
-                session_id = f"anonymous_{client_ip}_{hash(client_ip) % 10000}"
-                await self.supabase_service.save_optimization_history(
-                    session_id=session_id,
-                    original_prompt=request.original_prompt,
-                    optimized_prompt=optimized_prompt,
-                    mode=request.mode
-                )
+            if save_history:
+                await self._save_history(user, client_ip, request.original_prompt, optimized_prompt, request.mode)
 
             # 返回优化结果
             return PromptResponse(
@@ -101,6 +119,121 @@ class PromptService:
             print(f"错误详情: {error_detail}")
             raise HTTPException(status_code=500, detail=error_detail)
 
+    async def optimize_prompt_batch(self, items: List[PromptRequest], user: Optional[User] = None, client_ip: str = "unknown", parallelism: int = BATCH_DEFAULT_PARALLELISM) -> AsyncIterator[str]:
+        """批量优化提示词，按完成顺序逐行返回NDJSON结果
+
+        最多 parallelism 个条目同时优化；所有条目结束后批量写入历史记录，
+        最后输出一行汇总。客户端中途断开时取消未完成的条目，已完成的条目
+        （包括尚未返回给客户端的）照常写入历史记录。
+        """
+        semaphore = asyncio.Semaphore(parallelism)
+
+        async def run_item(index: int, item: PromptRequest) -> Tuple[int, PromptRequest, Any]:
+            async with semaphore:
+                try:
+                    return index, item, await self.optimize_prompt(item, user, client_ip, save_history=False)
+                except HTTPException as e:
+                    return index, item, e
+
+        tasks = [asyncio.ensure_future(run_item(index, item)) for index, item in enumerate(items)]
+        succeeded = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, item, result = await next_done
+                if isinstance(result, HTTPException):
+                    yield ndjson_line({
+                        "index": index,
+                        "success": False,
+                        "status_code": result.status_code,
+                        "error": result.detail
+                    })
+                    continue
+
+                succeeded += 1
+                yield ndjson_line({
+                    "index": index,
+                    "success": True,
+                    "optimized_prompt": result.optimized_prompt,
+                    "model_used": result.model_used
+                })
+        finally:
+            # 客户端提前断开时取消尚未完成的条目，已完成的条目都写入历史记录
+            history_rows = []
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled() and task.exception() is None:
+                    _, item, result = task.result()
+                    if not isinstance(result, HTTPException):
+                        history_rows.append(self._build_history_row(user, client_ip, item.original_prompt, result.optimized_prompt, item.mode))
+            # 请求被取消时也要写完
+            await asyncio.shield(get_history_writer(self.settings).enqueue_many(history_rows))
+
+        yield ndjson_line({
+            "done": True,
+            "total": len(items),
+            "succeeded": succeeded,
+            "failed": len(items) - succeeded
+        })
+
+    def optimize_prompt_stream(self, request: PromptRequest, user: Optional[User] = None, client_ip: str = "unknown") -> AsyncIterator[str]:
+        """流式优化提示词，返回SSE事件流
+
+        模型校验和模板格式化在流开始前完成，校验失败直接抛出HTTP异常；
+        流开始后的错误以 error 事件返回。
+        """
+        self.validate_model(request.model)
+
+        formatted_content = self.format_prompt_template(
+            request.original_prompt,
+            request.model,
+            request.mode
+        )
+        messages = self.llm_service.create_messages(formatted_content)
+
+        return self._optimization_event_stream(request, messages, user, client_ip)
+
+    async def _optimization_event_stream(self, request: PromptRequest, messages: list, user: Optional[User], client_ip: str) -> AsyncIterator[str]:
+        """转发LLM增量输出为SSE事件，完成后保存历史记录"""
+        cache_key = build_llm_request_key(request.model, messages, API_MAX_TOKENS)
+        chunks = []
+        started = False
+        try:
+            cached = None if request.bypass_cache else llm_result_cache.get(cache_key)
+            if cached is not None:
+                # 缓存命中：一次性发送完整结果
+                optimized_prompt = cached
+                started = True
+                yield sse_event("delta", {"content": cached})
+            else:
+                async for delta in self.llm_service.stream_llm_api(request.model, messages, cache_result=True):
+                    chunks.append(delta)
+                    started = True
+                    yield sse_event("delta", {"content": delta})
+
+                optimized_prompt = "".join(chunks).strip()
+                if not optimized_prompt:
+                    yield sse_event("error", {"detail": "AI模型返回空响应，请稍后重试"})
+                    return
+
+            # 流结束后保存历史记录
+            await self._save_history(user, client_ip, request.original_prompt, optimized_prompt, request.mode)
+
+            yield sse_event("done", {
+                "optimized_prompt": optimized_prompt,
+                "model_used": request.model
+            })
+
+        except HTTPException as e:
+            if not started:
+                # 尚未输出任何事件（如过载503），交给路由以HTTP错误返回
+                raise
+            yield sse_event("error", {"detail": e.detail})
+        except Exception as e:
+            error_detail = f"未知错误: {str(e)}"
+            print(f"错误详情: {error_detail}")
+            yield sse_event("error", {"detail": error_detail})
+
     def _extract_json_from_response(self, response_text: str) -> list:
         """从AI响应中提取JSON数据"""
         try:
@@ -194,23 +327,7 @@ class PromptService:
             optimized_prompt = await self.llm_service.call_llm_api_thinking(request.model, messages)
 
             # 保存历史记录（支持已登录用户和匿名用户）
-            if user and user.id:
-                # 已登录用户，使用用户ID保存历史记录
-                await self.supabase_service.save_optimization_history(
-                    user_id=str(user.id),
-                    original_prompt=request.original_prompt,
-                    optimized_prompt=optimized_prompt,
-                    mode="thinking"
-                )
-            else:
-                # 匿名用户，使用IP地址生成会话ID保存历史记录
-                session_id = f"anonymous_{client_ip}_{hash(client_ip) % 10000}"
-                await self.supabase_service.save_optimization_history(
-                    session_id=session_id,
-                    original_prompt=request.original_prompt,
-                    optimized_prompt=optimized_prompt,
-                    mode="thinking"
-                )
+            await self._save_history(user, client_ip, request.original_prompt, optimized_prompt, "thinking")
 
             # 返回优化结果
             return PromptResponse(
@@ -292,3 +409,8 @@ class PromptService:
                 question=request.question
             )
 
+
+@lru_cache()
+def get_prompt_service() -> PromptService:
+    """获取提示词优化服务（单例模式）"""
+    return PromptService(get_settings(), llm_service=get_llm_service(), supabase_service=get_supabase_service())
@@ -2,21 +2,22 @@
 快速回答服务
 处理基于优化提示词的快速回答生成逻辑
 """
-import re
-from typing import Dict, Any
+from functools import lru_cache
+from typing import AsyncIterator, Dict, Any, Optional
 from fastapi import HTTPException
 
-from ..config import Settings
-from ..constants import API_TIMEOUT, API_TEMPERATURE, API_MAX_TOKENS
-from .llm_service import LLMService
+from ..config import Settings, get_settings
+from ..constants import QUICK_ANSWER_MAX_TOKENS
+from ..streaming import sse_event
+from .llm_service import LLMService, get_llm_service
 
 
 class QuickAnswerService:
     """快速回答服务类"""
     
-    def __init__(self, settings: Settings):
+    def __init__(self, settings: Settings, llm_service: Optional[LLMService] = None):
         self.settings = settings
-        self.llm_service = LLMService(settings)
+        self.llm_service = llm_service or LLMService(settings)
     
     def _create_prompt(self, user_prompt: str) -> str:
         """
@@ -76,7 +77,25 @@ class QuickAnswerService:
             "final_answer": final_answer
         }
     
-    
+    def _create_messages(self, prompt: str) -> list:
+        """
+        校验提示词并创建消息列表
+        
+        Args:
+            prompt: 用户的提示词
+        
+        Returns:
+            LLM消息列表
+        """
+        if not prompt or not prompt.strip():
+            raise ValueError("提示词不能为空")
+        
+        return [
+            {
+                "role": "user",
+                "content": self._create_prompt(prompt.strip())
+            }
+        ]
     
     async def generate_answer(self, prompt: str, model: str = "deepseek-v4-flash") -> Dict[str, Any]:
         """
@@ -90,23 +109,11 @@ class QuickAnswerService:
             包含思维过程、最终答案和使用模型的字典
         """
         try:
-            # 验证输入
-            if not prompt or not prompt.strip():
-                raise ValueError("提示词不能为空")
-            
-            # 创建快速回答提示词
-            quick_prompt = self._create_prompt(prompt.strip())
-            
-            # 创建消息列表
-            messages = [
-                {
-                    "role": "user",
-                    "content": quick_prompt
-                }
-            ]
+            # 验证输入并创建消息列表
+            messages = self._create_messages(prompt)
             
             # 调用LLM API (快速回答模式，使用合理的token限制保证速度)
-            max_tokens = 12000
+            max_tokens = QUICK_ANSWER_MAX_TOKENS
             print(f"开始调用快速回答API，模型: {model}，max_tokens: {max_tokens}")
             response = await self.llm_service.call_llm_api_with_custom_tokens(model, messages, max_tokens=max_tokens)
             
@@ -130,9 +137,65 @@ class QuickAnswerService:
             
         except ValueError as e:
             raise e
+        except HTTPException:
+            # 保留上游错误的状态码（如过载503及其Retry-After）
+            raise
         except Exception as e:
             print(f"快速回答生成错误: {str(e)}")
             raise HTTPException(
                 status_code=500,
                 detail=f"快速回答生成失败: {str(e)}"
             )
+
+    def generate_answer_stream(self, prompt: str, model: str = "deepseek-v4-flash") -> AsyncIterator[str]:
+        """
+        流式生成快速回答
+        
+        Args:
+            prompt: 用户的提示词
+            model: 使用的模型
+        
+        Returns:
+            SSE事件流：delta（增量文本）、done（与QuickAnswerResponse字段一致的汇总）、error（错误信息）
+        """
+        # 在流开始前校验输入，空提示词直接抛出ValueError
+        messages = self._create_messages(prompt)
+        return self._answer_event_stream(messages, model)
+
+    async def _answer_event_stream(self, messages: list, model: str) -> AsyncIterator[str]:
+        """转发LLM增量输出为SSE事件，结束时发送完整汇总"""
+        chunks = []
+        try:
+            print(f"开始流式调用快速回答API，模型: {model}，max_tokens: {QUICK_ANSWER_MAX_TOKENS}")
+            async for delta in self.llm_service.stream_llm_api(model, messages, max_tokens=QUICK_ANSWER_MAX_TOKENS):
+                chunks.append(delta)
+                yield sse_event("delta", {"content": delta})
+
+            response = "".join(chunks)
+            if not response.strip():
+                print("错误：API返回空响应")
+                yield sse_event("error", {"detail": "AI模型返回空响应"})
+                return
+
+            parsed_result = self._parse_response(response)
+            yield sse_event("done", {
+                "thinking_process": parsed_result["thinking_process"],
+                "final_answer": parsed_result["final_answer"],
+                "model_used": model,
+                "success": True
+            })
+
+        except HTTPException as e:
+            if not chunks:
+                # 尚未输出任何事件（如过载503），交给路由以HTTP错误返回
+                raise
+            yield sse_event("error", {"detail": e.detail})
+        except Exception as e:
+            print(f"快速回答生成错误: {str(e)}")
+            yield sse_event("error", {"detail": f"快速回答生成失败: {str(e)}"})
+
+
+@lru_cache()
+def get_quick_answer_service() -> QuickAnswerService:
+    """获取快速回答服务（单例模式）"""
+    return QuickAnswerService(get_settings(), llm_service=get_llm_service())
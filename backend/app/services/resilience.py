@@ -0,0 +1,162 @@
+"""
+容错模块
+熔断器（按上游基础URL）、全局重试预算和可切换到备用模型的上游错误
+"""
+import random
+import time
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+
+from ..constants import (
+    CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RECOVERY_TIMEOUT,
+    LLM_RETRY_BASE_DELAY, LLM_RETRY_MAX_DELAY,
+    LLM_RETRY_BUDGET_RATIO, LLM_RETRY_BUDGET_CAPACITY
+)
+
+
+class UpstreamUnavailableError(HTTPException):
+    """上游暂时不可用：连接失败或超时、限流、5xx、空响应、熔断打开
+
+    只有这类错误会切换到备用模型；上游4xx和本地准入拒绝原样返回给调用方。
+    """
+
+
+class CircuitBreaker:
+    """熔断器
+
+    - closed: 正常放行，连续失败达到阈值后进入 open
+    - open: 直接拒绝请求，recovery_timeout 后进入 half_open
+    - half_open: 每个 recovery_timeout 周期放行一个探测请求，成功则恢复 closed，失败则重新 open
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 recovery_timeout: float = CIRCUIT_RECOVERY_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+
+    def allow_request(self) -> bool:
+        """判断是否放行请求"""
+        if self.state == self.CLOSED:
+            return True
+
+        now = time.monotonic()
+        if now - self.opened_at >= self.recovery_timeout:
+            # 放行一个探测请求；探测未返回前，下一次探测要再等一个周期
+            self.state = self.HALF_OPEN
+            self.opened_at = now
+            return True
+
+        self.rejected += 1
+        return False
+
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            print(f"熔断器 {self.name} 探测成功，恢复正常")
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+
+    def record_failure(self) -> None:
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                print(f"熔断器 {self.name} 打开，连续失败 {self.consecutive_failures} 次")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    @property
+    def is_open(self) -> bool:
+        return self.state == self.OPEN and time.monotonic() - self.opened_at < self.recovery_timeout
+
+    def retry_after(self) -> float:
+        """距离下一次允许探测的秒数"""
+        if self.state == self.CLOSED:
+            return 0.0
+        return max(0.0, self.recovery_timeout - (time.monotonic() - self.opened_at))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "rejected": self.rejected,
+            "retry_after_seconds": round(self.retry_after(), 1)
+        }
+
+
+class RetryBudget:
+    """全局重试预算（令牌桶）
+
+    每个请求存入 ratio 个令牌，每次重试消耗一个令牌，令牌数不超过 capacity。
+    上游整体故障时重试很快耗尽预算，避免重试放大故障。
+    """
+
+    def __init__(self, ratio: float = LLM_RETRY_BUDGET_RATIO, capacity: float = LLM_RETRY_BUDGET_CAPACITY):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.tokens = capacity
+        self.retries = 0
+        self.exhausted = 0
+
+    def record_request(self) -> None:
+        self.tokens = min(self.capacity, self.tokens + self.ratio)
+
+    def try_acquire(self) -> bool:
+        """尝试获取一次重试机会"""
+        if self.tokens >= 1:
+            self.tokens -= 1
+            self.retries += 1
+            return True
+        self.exhausted += 1
+        return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "tokens": round(self.tokens, 2),
+            "capacity": self.capacity,
+            "retries": self.retries,
+            "exhausted": self.exhausted
+        }
+
+
+def backoff_delay(attempt: int, retry_after: Optional[float] = None) -> float:
+    """计算重试等待时间：全抖动指数退避，上游给出 Retry-After 时不早于该时间"""
+    delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 响应头（只支持秒数格式）"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+# 按上游基础URL划分的熔断器
+_circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_circuit_breaker(base_url: str) -> CircuitBreaker:
+    """获取上游基础URL对应的熔断器"""
+    breaker = _circuit_breakers.get(base_url)
+    if breaker is None:
+        breaker = CircuitBreaker(base_url)
+        _circuit_breakers[base_url] = breaker
+    return breaker
+
+
+def circuit_breaker_stats() -> Dict[str, Any]:
+    return {name: breaker.stats() for name, breaker in _circuit_breakers.items()}
@@ -0,0 +1,48 @@
+"""
+LLM调度上下文模块
+为每个请求确定公平调度的队列（用户ID或匿名IP）及其权重
+"""
+from contextvars import ContextVar
+from typing import NamedTuple, Optional
+
+from ..config import Settings
+from ..constants import LLM_DEFAULT_WEIGHT, LLM_SUBSCRIBER_WEIGHT, ACTIVE_SUBSCRIPTION_STATUSES
+from ..auth import User
+from .supabase_service import get_supabase_service
+
+
+class LLMFlow(NamedTuple):
+    """公平调度的队列标识"""
+    flow_id: str
+    weight: float
+
+
+# 未绑定请求上下文时（如后台任务）使用的默认队列
+DEFAULT_LLM_FLOW = LLMFlow("default", LLM_DEFAULT_WEIGHT)
+
+# 当前请求所属的调度队列（随异步任务上下文传递，请求合并产生的上游任务沿用发起者的队列）
+_current_llm_flow: ContextVar[LLMFlow] = ContextVar("llm_flow", default=DEFAULT_LLM_FLOW)
+
+
+def current_llm_flow() -> LLMFlow:
+    """获取当前请求的调度队列"""
+    return _current_llm_flow.get()
+
+
+def set_llm_flow(flow: LLMFlow) -> None:
+    """设置当前请求的调度队列"""
+    _current_llm_flow.set(flow)
+
+
+async def resolve_user_weight(settings: Settings, user: Optional[User]) -> float:
+    """确定用户的调度权重：有效订阅用户获得更高权重
+
+    订阅信息读取 get_user_subscription 的缓存（SUBSCRIPTION_CACHE_TTL 秒），不另设缓存。
+    """
+    if not user or not user.id:
+        return LLM_DEFAULT_WEIGHT
+
+    subscription = await get_supabase_service().get_user_subscription(str(user.id))
+    if subscription.get("status") in ACTIVE_SUBSCRIPTION_STATUSES:
+        return LLM_SUBSCRIBER_WEIGHT
+    return LLM_DEFAULT_WEIGHT
@@ -0,0 +1,128 @@
+"""
+请求合并模块
+相同键的并发请求共享一次上游调用（single-flight）
+"""
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+# 流结束标记
+_STREAM_END = object()
+
+
+class _StreamBroadcast:
+    """将一个上游流广播给多个订阅者
+
+    上游增量缓存在 chunks 中，后加入的订阅者会先补发已产生的内容，
+    因此每个订阅者都能拿到完整输出。所有订阅者离开后取消上游流。
+    """
+
+    def __init__(self, source: AsyncIterator[str]):
+        self.chunks: List[Any] = []
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[str]) -> None:
+        try:
+            async for chunk in source:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = asyncio.CancelledError()
+            raise
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.chunks.append(_STREAM_END)
+            self._notify()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                if index < len(self.chunks):
+                    chunk = self.chunks[index]
+                    index += 1
+                    if chunk is _STREAM_END:
+                        if self.error is not None:
+                            raise self.error
+                        return
+                    yield chunk
+                else:
+                    await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.task.done():
+                self.task.cancel()
+
+
+class SingleFlight:
+    """合并相同键的并发请求
+
+    - do(): 并发的相同调用只执行一次，结果或异常同时返回给所有等待者
+    - stream(): 并发的相同流式调用共享一个上游流
+    上游调用在独立任务中运行，单个等待者取消不会影响其他等待者。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, "asyncio.Future[Any]"] = {}
+        self._streams: Dict[str, _StreamBroadcast] = {}
+        self.upstream_calls = 0
+        self.coalesced_calls = 0
+
+    async def do(self, key: str, func: Callable[[], Awaitable[T]]) -> T:
+        """执行调用，键相同的并发调用共享同一个结果"""
+        task = self._calls.get(key)
+        if task is None:
+            self.upstream_calls += 1
+            task = asyncio.ensure_future(func())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finish_call(key, t))
+        else:
+            self.coalesced_calls += 1
+
+        return await asyncio.shield(task)
+
+    def _finish_call(self, key: str, task: "asyncio.Future[Any]") -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # 所有等待者都已取消时，读取异常避免"未获取的异常"警告
+        if not task.cancelled():
+            task.exception()
+
+    async def stream(self, key: str, func: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """流式调用，键相同的并发调用订阅同一个上游流"""
+        broadcast = self._streams.get(key)
+        if broadcast is None or broadcast.task.done():
+            self.upstream_calls += 1
+            broadcast = _StreamBroadcast(func())
+            self._streams[key] = broadcast
+            broadcast.task.add_done_callback(lambda t: self._finish_stream(key, broadcast))
+        else:
+            self.coalesced_calls += 1
+
+        async for chunk in broadcast.subscribe():
+            yield chunk
+
+    def _finish_stream(self, key: str, broadcast: _StreamBroadcast) -> None:
+        if self._streams.get(key) is broadcast:
+            del self._streams[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """请求合并统计信息"""
+        return {
+            "name": self.name,
+            "in_flight_calls": len(self._calls),
+            "in_flight_streams": len(self._streams),
+            "upstream_calls": self.upstream_calls,
+            "coalesced_calls": self.coalesced_calls
+        }
@@ -2,12 +2,90 @@
 Supabase服务模块
 处理数据库操作和用户历史记录
 """
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
+from postgrest import ReturnMethod
+from postgrest.exceptions import APIError
 from fastapi import HTTPException
-from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple
 from datetime import datetime
-
-from ..config import Settings
+import asyncio
+import httpx
+
+from ..config import Settings, get_settings
+from ..constants import (
+    SUPABASE_TIMEOUT, SUPABASE_MAX_CONNECTIONS, SUPABASE_MAX_KEEPALIVE_CONNECTIONS, SUPABASE_KEEPALIVE_EXPIRY,
+    SUPABASE_THREAD_POOL_SIZE, HISTORY_CACHE_MAX_PAGES,
+    PROFILE_CACHE_MAX_BYTES, PROFILE_CACHE_TTL, SUBSCRIPTION_CACHE_TTL, PROFILE_NEGATIVE_CACHE_TTL
+)
+from .cache import LRUCache
+from .history_cache import history_cache, history_owner
+
+# 返回给客户端的profile字段
+PROFILE_COLUMNS = ("id", "username", "avatar_url", "updated_at")
+SUBSCRIPTION_COLUMNS = ("id", "status", "plan_id", "current_period_start", "current_period_end")
+
+# 进程级profile和订阅信息缓存（键为用户ID；不存在的记录缓存为空字典，有效期较短）
+profile_cache = LRUCache("profiles", PROFILE_CACHE_MAX_BYTES, PROFILE_CACHE_TTL)
+subscription_cache = LRUCache("subscriptions", PROFILE_CACHE_MAX_BYTES, SUBSCRIPTION_CACHE_TTL)
+
+# 进程级共享的Supabase客户端（在应用启动时创建）
+_supabase_client: Optional[Client] = None
+_supabase_http_client: Optional[httpx.Client] = None
+
+# supabase-py 的查询是同步阻塞的，统一放到有界线程池中执行，
+# 数据库慢时最多占用 SUPABASE_THREAD_POOL_SIZE 个线程，不会拖住事件循环
+_db_executor = ThreadPoolExecutor(max_workers=SUPABASE_THREAD_POOL_SIZE, thread_name_prefix="supabase")
+# 暂存区回放专用的单线程池：同一时间最多一次回放写入，不占用请求查询的线程
+_replay_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="supabase-replay")
+
+
+def init_supabase_client(settings: Settings) -> Optional[Client]:
+    """创建共享的Supabase客户端：长连接连接池，HTTP/2 复用到PostgREST的连接"""
+    global _supabase_client, _supabase_http_client
+    if _supabase_client is not None:
+        return _supabase_client
+    if not settings.supabase_url or not settings.supabase_key:
+        print("警告：Supabase配置未完成，跳过客户端创建")
+        return None
+
+    _supabase_http_client = httpx.Client(
+        http2=True,
+        timeout=httpx.Timeout(SUPABASE_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=SUPABASE_MAX_CONNECTIONS,
+            max_keepalive_connections=SUPABASE_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY
+        )
+    )
+    _supabase_client = create_client(
+        settings.supabase_url,
+        settings.supabase_key,
+        options=ClientOptions(httpx_client=_supabase_http_client)
+    )
+    print("Supabase 共享客户端已创建")
+    return _supabase_client
+
+
+def close_supabase_client() -> None:
+    """在应用关闭时释放Supabase连接池"""
+    global _supabase_client, _supabase_http_client
+    if _supabase_http_client is not None:
+        _supabase_http_client.close()
+    _supabase_client = None
+    _supabase_http_client = None
+
+
+def get_supabase_client(settings: Settings) -> Client:
+    """获取共享的Supabase客户端（未在启动时创建则懒加载，兼容无生命周期事件的Serverless环境）"""
+    client = _supabase_client or init_supabase_client(settings)
+    if client is None:
+        raise HTTPException(
+            status_code=500,
+            detail="Supabase配置未完成：请检查环境变量 SUPABASE_URL 和 SUPABASE_ANON_KEY"
+        )
+    return client
 
 
 class SupabaseService:
@@ -15,25 +93,50 @@ class SupabaseService:
     
     def __init__(self, settings: Settings):
         self.settings = settings
-        self._client: Optional[Client] = None
     
     @property
     def client(self) -> Client:
-        """获取Supabase客户端（懒加载）"""
-        if self._client is None:
-            if not self.settings.supabase_url or not self.settings.supabase_key:
-                raise HTTPException(
-                    status_code=500,
-                    detail="Supabase配置未完成：请检查环境变量 SUPABASE_URL 和 SUPABASE_ANON_KEY"
-                )
-            
-            self._client = create_client(
-                self.settings.supabase_url,
-                self.settings.supabase_key
-            )
-        
-        return self._client
+        """获取进程级共享的Supabase客户端"""
+        return get_supabase_client(self.settings)
+
+    async def _execute(self, query: Any, executor: ThreadPoolExecutor = _db_executor) -> Any:
+        """在数据库专用线程池中执行查询，不阻塞事件循环"""
+        return await asyncio.get_running_loop().run_in_executor(executor, query.execute)
     
+    @staticmethod
+    def build_history_row(
+        user_id: str = None,
+        session_id: str = None,
+        original_prompt: str = "",
+        optimized_prompt: str = "",
+        mode: str = "general"
+    ) -> Optional[Dict[str, Any]]:
+        """构建优化历史记录行（已认证用户按user_id，匿名用户按session_id），两者都未提供时返回None"""
+        row = {
+            "original_prompt": original_prompt,
+            "optimized_prompt": optimized_prompt,
+            "mode": mode
+        }
+
+        if user_id:
+            # 已登录用户
+            row.update({
+                "user_id": user_id,
+                "user_type": "authenticated",
+                "session_id": None
+            })
+        elif session_id:
+            # 匿名用户
+            row.update({
+                "user_id": None,
+                "user_type": "anonymous",
+                "session_id": session_id
+            })
+        else:
+            return None
+
+        return row
+
     async def save_optimization_history(
         self,
         user_id: str = None,
@@ -45,32 +148,14 @@ class SupabaseService:
         """保存优化历史记录（支持已认证用户和匿名用户）"""
         try:
             # 构建插入数据
-            insert_data = {
-                "original_prompt": original_prompt,
-                "optimized_prompt": optimized_prompt,
-                "mode": mode
-            }
-
-            if user_id:
-                # 已登录用户
-                insert_data.update({
-                    "user_id": user_id,
-                    "user_type": "authenticated",
-                    "session_id": None
-                })
-            elif session_id:
-                # 匿名用户
-                insert_data.update({
-                    "user_id": None,
-                    "user_type": "anonymous",
-                    "session_id": session_id
-                })
-            else:
+            insert_data = self.build_history_row(user_id, session_id, original_prompt, optimized_prompt, mode)
+            if insert_data is None:
                 print("保存历史记录失败: 必须提供 user_id 或 session_id")
                 return False
 
             # 插入历史记录到optimization_history表
-            result = self.client.table("optimization_history").insert(insert_data).execute()
+            result = await self._execute(self.client.table("optimization_history").insert(insert_data))
+            history_cache.invalidate_rows([insert_data])
 
             return True
 
@@ -78,6 +163,38 @@ class SupabaseService:
             # 不抛出异常，只记录错误，避免影响主要功能
             print(f"保存历史记录失败: {e}")
             return False
+
+    async def save_optimization_history_batch(self, rows: list) -> bool:
+        """批量保存优化历史记录（一次插入请求写入多行）"""
+        if not rows:
+            return True
+
+        try:
+            await self._execute(self.client.table("optimization_history").insert(rows))
+            history_cache.invalidate_rows(rows)
+            print(f"批量保存历史记录成功，共 {len(rows)} 条")
+            return True
+
+        except Exception as e:
+            # 不抛出异常，只记录错误，避免影响主要功能
+            print(f"批量保存历史记录失败: {e}")
+            return False
+
+    async def upsert_optimization_history_batch(self, rows: list) -> None:
+        """按 client_key 幂等地批量写入历史记录（已存在的行忽略），失败时抛出异常由调用方重试
+
+        在回放专用的单线程池中执行，Supabase变慢时回放不会占满请求查询的线程池。
+        """
+        if not rows:
+            return
+
+        await self._execute(self.client.table("optimization_history").upsert(
+            rows,
+            on_conflict="client_key",
+            ignore_duplicates=True,
+            returning=ReturnMethod.minimal
+        ), executor=_replay_executor)
+        history_cache.invalidate_rows(rows)
     
     async def get_user_optimization_history(
         self,
@@ -85,25 +202,29 @@ class SupabaseService:
         session_id: str = None,
         limit: int = 50
     ) -> list:
-        """获取用户的优化历史记录（支持已登录用户和匿名用户）"""
-        try:
+        """获取用户的优化历史记录（支持已登录用户和匿名用户，结果按用户或会话缓存）"""
+        owner = history_owner(user_id, session_id)
+        if owner is None:
+            print("获取历史记录失败: 必须提供 user_id 或 session_id")
+            return []
+
+        async def load() -> list:
             query = self.client.table("optimization_history")\
                 .select("id, original_prompt, optimized_prompt, mode, created_at, user_type")
 
             if user_id:
                 # 已登录用户的历史记录
                 query = query.eq("user_id", user_id).eq("user_type", "authenticated")
-            elif session_id:
+            else:
                 # 匿名用户的历史记录
                 query = query.eq("session_id", session_id).eq("user_type", "anonymous")
-            else:
-                print("获取历史记录失败: 必须提供 user_id 或 session_id")
-                return []
-
-            result = query.order("created_at", desc=True).limit(limit).execute()
 
+            result = await self._execute(query.order("created_at", desc=True).limit(limit))
             return result.data
 
+        try:
+            return await history_cache.get_or_load(owner, ("recent", limit), load)
+
         except Exception as e:
             print(f"获取历史记录失败: {e}")
             return []
@@ -114,16 +235,27 @@ class SupabaseService:
         page: int = 1,
         page_size: int = 20,
         start_date: datetime = None,
-        end_date: datetime = None
-    ) -> list:
-        """获取用户的优化历史记录（分页版本，仅支持已登录用户）"""
+        end_date: datetime = None,
+        with_count: bool = False
+    ) -> Tuple[list, Optional[int]]:
+        """获取用户的优化历史记录（分页版本，仅支持已登录用户）
+
+        with_count 为True时在同一次请求中返回符合条件的总记录数，否则总数为None。
+        不带日期筛选的前 HISTORY_CACHE_MAX_PAGES 页按用户缓存。
+
+        Returns:
+            (当前页记录, 总记录数)
+        """
         try:
             # 计算偏移量
             offset = (page - 1) * page_size
 
             # 构建查询
             query = self.client.table("optimization_history")\
-                .select("id, user_id, original_prompt, optimized_prompt, mode, created_at, user_type")\
+                .select(
+                    "id, user_id, original_prompt, optimized_prompt, mode, created_at, user_type",
+                    count="exact" if with_count else None
+                )\
                 .eq("user_id", user_id)\
                 .eq("user_type", "authenticated")
 
@@ -133,12 +265,20 @@ class SupabaseService:
             if end_date:
                 query = query.lte("created_at", end_date.isoformat())
 
-            # 添加排序和分页
+            # 添加排序和分页（时间相同时按ID排序，保证顺序稳定）
             query = query.order("created_at", desc=True)\
+                .order("id", desc=True)\
                 .range(offset, offset + page_size - 1)
 
-            result = query.execute()
-            return result.data
+            async def load() -> Tuple[list, Optional[int]]:
+                result = await self._execute(query)
+                return result.data, result.count
+
+            if start_date or end_date or page > HISTORY_CACHE_MAX_PAGES:
+                return await load()
+            return await history_cache.get_or_load(
+                history_owner(user_id), ("page", page, page_size, with_count), load
+            )
 
         except Exception as e:
             print(f"获取分页历史记录失败: {e}")
@@ -147,27 +287,95 @@ class SupabaseService:
                 detail="数据库查询失败"
             )
 
+    async def get_user_optimization_history_keyset(
+        self,
+        user_id: str,
+        limit: int = 20,
+        after: Optional[Tuple[str, int]] = None,
+        start_date: datetime = None,
+        end_date: datetime = None,
+        use_cache: bool = True
+    ) -> list:
+        """获取用户的优化历史记录（游标分页，仅支持已登录用户）
+
+        按 (created_at, id) 降序排列，after 为上一页最后一条记录的 (created_at, id)，
+        查询直接从该位置开始，不需要扫描前面的记录。不带日期筛选的第一页按用户缓存。
+        """
+        try:
+            query = self.client.table("optimization_history")\
+                .select("id, user_id, original_prompt, optimized_prompt, mode, created_at, user_type")\
+                .eq("user_id", user_id)\
+                .eq("user_type", "authenticated")
+
+            # 添加日期筛选
+            if start_date:
+                query = query.gte("created_at", start_date.isoformat())
+            if end_date:
+                query = query.lte("created_at", end_date.isoformat())
+
+            # 从游标位置之后开始：created_at 更早，或 created_at 相同且 id 更小
+            if after:
+                created_at, last_id = after
+                query = query.or_(
+                    f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{last_id})'
+                )
+
+            query = query.order("created_at", desc=True)\
+                .order("id", desc=True)\
+                .limit(limit)
+
+            async def load() -> list:
+                result = await self._execute(query)
+                return result.data
+
+            if after or start_date or end_date or not use_cache:
+                return await load()
+            return await history_cache.get_or_load(history_owner(user_id), ("keyset", limit), load)
+
+        except Exception as e:
+            print(f"获取游标分页历史记录失败: {e}")
+            raise HTTPException(
+                status_code=500,
+                detail="数据库查询失败"
+            )
+
+    async def iter_user_optimization_history(self, user_id: str, chunk_size: int) -> AsyncIterator[List[dict]]:
+        """按游标分页逐批读取用户的全部历史记录（每批最多 chunk_size 行，不经过读取缓存）"""
+        after = None
+        while True:
+            rows = await self.get_user_optimization_history_keyset(
+                user_id=user_id, limit=chunk_size, after=after, use_cache=False
+            )
+            if rows:
+                yield rows
+            if len(rows) < chunk_size:
+                return
+            after = (rows[-1]["created_at"], rows[-1]["id"])
+
     async def get_user_optimization_history_count(
         self,
         user_id: str,
         start_date: datetime = None,
-        end_date: datetime = None
+        end_date: datetime = None,
+        mode: str = None
     ) -> int:
-        """获取用户的优化历史记录总数（仅支持已登录用户）"""
+        """获取用户的优化历史记录总数（仅支持已登录用户，只返回计数，不读取记录）"""
         try:
             # 构建查询
             query = self.client.table("optimization_history")\
-                .select("id", count="exact")\
+                .select("id", count="exact", head=True)\
                 .eq("user_id", user_id)\
                 .eq("user_type", "authenticated")
 
+            if mode:
+                query = query.eq("mode", mode)
             # 添加日期筛选
             if start_date:
                 query = query.gte("created_at", start_date.isoformat())
             if end_date:
                 query = query.lte("created_at", end_date.isoformat())
 
-            result = query.execute()
+            result = await self._execute(query)
             return result.count if result.count is not None else 0
 
         except Exception as e:
@@ -177,16 +385,120 @@ class SupabaseService:
                 detail="数据库查询失败"
             )
 
-    async def get_user_profile(self, user_id: str) -> dict:
-        """获取用户profile信息"""
+    async def get_optimization_history_item(
+        self,
+        item_id: int,
+        user_id: str = None,
+        session_id: str = None
+    ) -> Optional[dict]:
+        """按ID获取一条完整的历史记录（只能读取本人或本会话的记录），不存在时返回None"""
+        try:
+            query = self.client.table("optimization_history")\
+                .select("id, user_id, original_prompt, optimized_prompt, mode, created_at, user_type")\
+                .eq("id", item_id)
+
+            if user_id:
+                query = query.eq("user_id", user_id).eq("user_type", "authenticated")
+            else:
+                query = query.eq("session_id", session_id).eq("user_type", "anonymous")
+
+            result = await self._execute(query.limit(1))
+            return result.data[0] if result.data else None
+
+        except Exception as e:
+            print(f"获取历史记录详情失败: {e}")
+            raise HTTPException(
+                status_code=500,
+                detail="数据库查询失败"
+            )
+
+    async def get_user_history_stats(self, user_id: str, since: datetime) -> Optional[dict]:
+        """调用数据库统计函数 get_user_history_stats（失败时抛出异常）
+
+        Returns:
+            {"total": 总数, "recent": since之后的数量, "modes": {模式: 数量}, "last": 最近一条记录}
+        """
+        result = await self._execute(self.client.rpc(
+            "get_user_history_stats",
+            {"p_user_id": user_id, "p_since": since.isoformat()}
+        ))
+        return result.data
+
+    async def search_user_history(
+        self,
+        user_id: str,
+        query: str,
+        patterns: List[str],
+        limit: int,
+        offset: int
+    ) -> dict:
+        """调用数据库搜索函数 search_user_history（失败时抛出异常）
+
+        Returns:
+            {"total": 匹配总数, "items": [当前页记录]}
+        """
+        result = await self._execute(self.client.rpc("search_user_history", {
+            "p_user_id": user_id,
+            "p_query": query,
+            "p_patterns": patterns,
+            "p_limit": limit,
+            "p_offset": offset
+        }))
+        return result.data or {}
+
+    async def get_user_stats_row(self, user_id: str) -> Optional[dict]:
+        """获取 user_stats 表中的用户计数，没有记录或查询失败时返回None"""
         try:
-            result = self.client.table("profiles")\
-                .select("id, username, avatar_url, updated_at")\
-                .eq("id", user_id)\
-                .single()\
-                .execute()
+            result = await self._execute(
+                self.client.table("user_stats")
+                .select("total, mode_counts, daily_counts")
+                .eq("user_id", user_id)
+                .limit(1)
+            )
+            return result.data[0] if result.data else None
 
-            return result.data if result.data else {}
+        except Exception as e:
+            print(f"获取用户计数失败: {e}")
+            return None
+
+    async def increment_user_stats(self, deltas: list) -> None:
+        """把多个用户的计数增量一次性合并到 user_stats 表（失败时抛出异常由调用方重试）
+
+        Args:
+            deltas: [{"user_id", "total", "modes": {模式: 数量}, "days": {日期: 数量}}]
+        """
+        if not deltas:
+            return
+
+        await self._execute(self.client.rpc("increment_user_stats", {"p_deltas": deltas}))
+
+    async def _get_cached_row(self, cache: LRUCache, table: str, columns: Tuple[str, ...], user_id: str) -> dict:
+        """按用户ID读取单行并缓存；没有记录时缓存空字典（PROFILE_NEGATIVE_CACHE_TTL 秒），查询失败时抛出异常"""
+        row = cache.get(user_id)
+        if row is not None:
+            return row
+
+        try:
+            result = await self._execute(
+                self.client.table(table)
+                .select(", ".join(columns))
+                .eq("id", user_id)
+                .single()
+            )
+            row = result.data or {}
+        except APIError as e:
+            # .single() 没有匹配的行时返回 PGRST116
+            if e.code != "PGRST116":
+                raise
+            row = {}
+
+        cache.set(user_id, row, ttl=None if row else PROFILE_NEGATIVE_CACHE_TTL)
+        return row
+
+    async def get_user_profile(self, user_id: str) -> dict:
+        """获取用户profile信息（缓存 PROFILE_CACHE_TTL 秒）"""
+        try:
+            return await self._get_cached_row(profile_cache, "profiles", PROFILE_COLUMNS, user_id)
 
         except Exception as e:
             print(f"获取用户profile失败: {e}")
@@ -199,7 +511,8 @@ class SupabaseService:
             if username:
                 profile_data["username"] = username
 
-            result = self.client.table("profiles").insert(profile_data).execute()
+            result = await self._execute(self.client.table("profiles").insert(profile_data))
+            profile_cache.delete(user_id)
             print(f"成功创建用户 {user_id} 的profile")
             return True
 
@@ -207,48 +520,45 @@ class SupabaseService:
             print(f"创建用户profile失败: {e}")
             return False
 
-    async def update_user_profile(self, user_id: str, update_data: dict) -> bool:
-        """更新用户profile信息"""
+    async def update_user_profile(self, user_id: str, update_data: dict) -> Optional[dict]:
+        """更新用户profile信息（不存在时创建）
+
+        一次 upsert 请求完成更新或创建，并直接返回写入后的profile；
+        只覆盖 update_data 中的字段。失败时返回None。
+        """
         try:
             # 添加更新时间戳
             update_data["updated_at"] = datetime.now().isoformat()
 
-            # 执行更新操作
-            result = self.client.table("profiles")\
-                .update(update_data)\
-                .eq("id", user_id)\
-                .execute()
+            result = await self._execute(
+                self.client.table("profiles").upsert(
+                    {"id": user_id, **update_data},
+                    on_conflict="id",
+                    returning=ReturnMethod.representation,
+                    default_to_null=False
+                )
+            )
+
+            if not result.data:
+                print(f"更新用户 {user_id} 的profile失败: 未返回数据")
+                profile_cache.delete(user_id)
+                return None
 
-            # 检查是否有数据被更新
-            if result.data:
-                print(f"成功更新用户 {user_id} 的profile")
-                return True
-            else:
-                # 如果没有找到记录，尝试创建一个新的profile
-                print(f"用户 {user_id} 的profile不存在，尝试创建新的profile")
-                create_data = {"id": user_id, **update_data}
-                create_result = self.client.table("profiles").insert(create_data).execute()
-                if create_result.data:
-                    print(f"成功为用户 {user_id} 创建新的profile")
-                    return True
-                else:
-                    print(f"创建用户 {user_id} 的profile失败")
-                    return False
+            # 用写入后的profile替换缓存
+            profile = {column: result.data[0].get(column) for column in PROFILE_COLUMNS}
+            profile_cache.set(user_id, profile)
+            print(f"成功更新用户 {user_id} 的profile")
+            return profile
 
         except Exception as e:
             print(f"更新用户profile失败: {e}")
-            return False
+            profile_cache.delete(user_id)
+            return None
 
     async def get_user_subscription(self, user_id: str) -> dict:
-        """获取用户订阅信息"""
+        """获取用户订阅信息（缓存 SUBSCRIPTION_CACHE_TTL 秒）"""
         try:
-            result = self.client.table("subscriptions")\
-                .select("id, status, plan_id, current_period_start, current_period_end")\
-                .eq("id", user_id)\
-                .single()\
-                .execute()
-
-            return result.data if result.data else {}
+            return await self._get_cached_row(subscription_cache, "subscriptions", SUBSCRIPTION_COLUMNS, user_id)
 
         except Exception as e:
             print(f"获取用户订阅信息失败: {e}")
@@ -259,7 +569,7 @@ class SupabaseService:
         try:
             # 方法1：尝试调用数据库RPC函数来检查（如果有管理员权限）
             try:
-                result = self.client.rpc('check_user_email_exists', {'email_to_check': email}).execute()
+                result = await self._execute(self.client.rpc('check_user_email_exists', {'email_to_check': email}))
                 if result.data is not None:
                     exists = bool(result.data)
                     return {
@@ -300,3 +610,9 @@ class SupabaseService:
                 'message': '无法检查邮箱状态，请继续注册流程',
                 'error': str(e)
             }
+
+
+@lru_cache()
+def get_supabase_service() -> SupabaseService:
+    """获取Supabase服务（单例模式）"""
+    return SupabaseService(get_settings())
@@ -0,0 +1,54 @@
+"""
+流式响应辅助模块
+Server-Sent Events、NDJSON 格式化和流式gzip压缩工具
+"""
+import json
+import zlib
+from typing import Any, AsyncIterator, Dict
+
+# SSE响应头：禁用缓存和反向代理缓冲，确保增量内容立即送达客户端
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no"
+}
+
+# NDJSON（每行一个JSON对象）的媒体类型
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """格式化一条SSE事件"""
+    payload = json.dumps(data, ensure_ascii=False)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+def ndjson_line(data: Dict[str, Any]) -> str:
+    """格式化一行NDJSON"""
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+
+async def gzip_stream(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """边读取边gzip压缩，只保留压缩器的内部缓冲区"""
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+async def prime_event_stream(events: AsyncIterator[str]) -> AsyncIterator[str]:
+    """预取事件流的第一个事件
+
+    在返回 StreamingResponse 之前等待首个事件，流开始前抛出的HTTP异常
+    （如过载时的503）会作为普通HTTP错误响应返回，而不是200后的error事件。
+    """
+    first_event = await events.__anext__()
+
+    async def chained() -> AsyncIterator[str]:
+        yield first_event
+        async for event in events:
+            yield event
+
+    return chained()
@@ -0,0 +1,9 @@
+-- 历史记录幂等写入键
+-- 本地暂存区为每条记录生成 client_key，回放时按该键去重（on conflict do nothing），
+-- 重复同步同一批记录不会产生重复行。已有记录的 client_key 为 NULL，不受唯一约束影响。
+
+alter table public.optimization_history
+    add column if not exists client_key uuid;
+
+create unique index if not exists optimization_history_client_key_idx
+    on public.optimization_history (client_key);
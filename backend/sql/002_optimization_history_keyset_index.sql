@@ -0,0 +1,4 @@
+-- 历史记录游标分页索引
+-- /api/history 按 (created_at, id) 降序做游标分页，该索引让每一页都从游标位置直接开始读取
+create index if not exists optimization_history_user_created_id_idx
+    on public.optimization_history (user_id, created_at desc, id desc);
@@ -0,0 +1,36 @@
+-- 用户使用统计聚合
+-- /api/user/stats 调用该函数，在数据库中一次扫描得到总数、按模式计数和近期计数，
+-- 不再下载历史记录正文到应用中统计。SQLite 实现见 app/services/history_stats.py，契约相同。
+--
+-- 返回: {"total": 总数, "recent": p_since 之后的数量, "modes": {模式: 数量}, "last": 最近一条记录}
+
+create or replace function public.get_user_history_stats(p_user_id uuid, p_since timestamptz)
+returns jsonb
+language sql
+stable
+as $$
+    with mode_counts as (
+        select coalesce(mode, 'unknown') as mode,
+               count(*) as total,
+               count(*) filter (where created_at >= p_since) as recent
+        from public.optimization_history
+        where user_id = p_user_id and user_type = 'authenticated'
+        group by 1
+    )
+    select jsonb_build_object(
+        'total', coalesce(sum(total), 0),
+        'recent', coalesce(sum(recent), 0),
+        'modes', coalesce(jsonb_object_agg(mode, total), '{}'::jsonb),
+        'last', (
+            select to_jsonb(h)
+            from (
+                select id, original_prompt, optimized_prompt, mode, created_at, user_type
+                from public.optimization_history
+                where user_id = p_user_id and user_type = 'authenticated'
+                order by created_at desc, id desc
+                limit 1
+            ) h
+        )
+    )
+    from mode_counts;
+$$;
@@ -0,0 +1,95 @@
+-- 用户使用计数
+-- 应用在历史记录写入成功后于进程内累加计数，定期调用 increment_user_stats 批量合并到该表，
+-- 历史记录总数（X-Total-Count）和 /api/user/stats 直接读取，不再扫描 optimization_history。
+-- daily_counts 以UTC日期（YYYY-MM-DD）为键，只保留最近30天。
+
+create table if not exists public.user_stats (
+    user_id uuid primary key,
+    total bigint not null default 0,
+    mode_counts jsonb not null default '{}'::jsonb,
+    daily_counts jsonb not null default '{}'::jsonb,
+    updated_at timestamptz not null default now()
+);
+
+-- 按键累加两个 {键: 数量} 对象
+create or replace function public.jsonb_add_counts(a jsonb, b jsonb)
+returns jsonb
+language sql
+immutable
+as $$
+    select coalesce(jsonb_object_agg(key, total), '{}'::jsonb)
+    from (
+        select key, sum(value::bigint) as total
+        from (
+            select * from jsonb_each_text(coalesce(a, '{}'::jsonb))
+            union all
+            select * from jsonb_each_text(coalesce(b, '{}'::jsonb))
+        ) counts
+        group by key
+    ) merged;
+$$;
+
+-- 批量合并计数增量: [{"user_id", "total", "modes": {...}, "days": {...}}]
+create or replace function public.increment_user_stats(p_deltas jsonb)
+returns void
+language plpgsql
+as $$
+declare
+    delta jsonb;
+begin
+    for delta in select * from jsonb_array_elements(p_deltas) loop
+        insert into public.user_stats as s (user_id, total, mode_counts, daily_counts, updated_at)
+        values (
+            (delta->>'user_id')::uuid,
+            coalesce((delta->>'total')::bigint, 0),
+            coalesce(delta->'modes', '{}'::jsonb),
+            coalesce(delta->'days', '{}'::jsonb),
+            now()
+        )
+        on conflict (user_id) do update set
+            total = s.total + excluded.total,
+            mode_counts = public.jsonb_add_counts(s.mode_counts, excluded.mode_counts),
+            daily_counts = (
+                select coalesce(jsonb_object_agg(key, value), '{}'::jsonb)
+                from jsonb_each(public.jsonb_add_counts(s.daily_counts, excluded.daily_counts))
+                where key >= to_char((now() at time zone 'utc')::date - 29, 'YYYY-MM-DD')
+            ),
+            updated_at = now();
+    end loop;
+end;
+$$;
+
+-- 为已有历史记录的用户初始化计数（只在首次部署时执行，已存在的计数不覆盖）
+insert into public.user_stats (user_id, total, mode_counts, daily_counts)
+select
+    u.user_id,
+    (
+        select count(*)
+        from public.optimization_history h
+        where h.user_id = u.user_id and h.user_type = 'authenticated'
+    ),
+    (
+        select coalesce(jsonb_object_agg(mode, n), '{}'::jsonb)
+        from (
+            select coalesce(h.mode, 'unknown') as mode, count(*) as n
+            from public.optimization_history h
+            where h.user_id = u.user_id and h.user_type = 'authenticated'
+            group by 1
+        ) m
+    ),
+    (
+        select coalesce(jsonb_object_agg(day, n), '{}'::jsonb)
+        from (
+            select to_char(h.created_at at time zone 'utc', 'YYYY-MM-DD') as day, count(*) as n
+            from public.optimization_history h
+            where h.user_id = u.user_id and h.user_type = 'authenticated'
+              and h.created_at >= (now() at time zone 'utc')::date - 29
+            group by 1
+        ) d
+    )
+from (
+    select distinct user_id
+    from public.optimization_history
+    where user_type = 'authenticated' and user_id is not null
+) u
+on conflict (user_id) do nothing;
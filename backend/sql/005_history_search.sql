@@ -0,0 +1,50 @@
+-- 历史记录搜索
+-- /api/history/search 调用 search_user_history，在数据库中完成匹配、排序和分页，一次往返返回一页结果。
+-- 每个搜索词都必须以子串形式出现在原始或优化后的提示词中（不区分大小写），
+-- 按与查询的 word_similarity 排序，相同时最新的在前。
+-- 三元组GIN索引让长搜索词不必逐行扫描；短搜索词（1-2个字符）由用户ID索引限定范围后过滤。
+-- 未创建该函数时，应用使用进程内的CJK二元组倒排索引（见 app/services/history_search.py）。
+--
+-- 参数: p_patterns 为应用转义后的 ILIKE 模式（'%词%'），按长度降序，第一个用于命中三元组索引
+-- 返回: {"total": 匹配总数, "items": [当前页记录]}
+
+create extension if not exists pg_trgm;
+
+create index if not exists optimization_history_search_trgm_idx
+    on public.optimization_history
+    using gin ((original_prompt || ' ' || optimized_prompt) gin_trgm_ops);
+
+create or replace function public.search_user_history(
+    p_user_id uuid,
+    p_query text,
+    p_patterns text[],
+    p_limit integer,
+    p_offset integer
+)
+returns jsonb
+language sql
+stable
+as $$
+    with matches as (
+        select id, user_id, original_prompt, optimized_prompt, mode, created_at, user_type,
+               word_similarity(p_query, original_prompt) + word_similarity(p_query, optimized_prompt) as rank
+        from public.optimization_history
+        where user_id = p_user_id
+          and user_type = 'authenticated'
+          and (original_prompt || ' ' || optimized_prompt) ilike p_patterns[1]
+          and (original_prompt || ' ' || optimized_prompt) ilike all (p_patterns)
+    ),
+    page as (
+        select *
+        from matches
+        order by rank desc, created_at desc, id desc
+        limit p_limit offset p_offset
+    )
+    select jsonb_build_object(
+        'total', (select count(*) from matches),
+        'items', coalesce(
+            (select jsonb_agg(to_jsonb(p) - 'rank' order by p.rank desc, p.created_at desc, p.id desc) from page p),
+            '[]'::jsonb
+        )
+    );
+$$;
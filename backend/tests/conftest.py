@@ -0,0 +1,7 @@
+"""
+测试公共配置：把 backend 目录加入导入路径，测试以 app 包的形式导入被测模块
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
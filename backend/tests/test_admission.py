@@ -0,0 +1,121 @@
+"""
+准入控制（加权公平排队）测试
+"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.services.admission import AdmissionGate
+from app.services.scheduler import LLMFlow, set_llm_flow
+
+
+async def _queue(gate, order, flow, label, cost=10, hold=0.0):
+    """以 flow 的身份排队，获得名额后记录 label"""
+    set_llm_flow(flow)
+    async with gate.slot(cost=cost):
+        order.append(label)
+        await asyncio.sleep(hold)
+
+
+async def _enqueue_all(gate, specs):
+    """依次排队（每个请求入队后再提交下一个），返回任务列表"""
+    tasks = []
+    for spec in specs:
+        tasks.append(asyncio.ensure_future(_queue(gate, *spec)))
+        await asyncio.sleep(0)
+    return tasks
+
+
+def test_heavy_flow_does_not_starve_others():
+    async def scenario():
+        gate = AdmissionGate("test", max_concurrency=1, max_queue=10, queue_timeout=5)
+        heavy, light = LLMFlow("heavy", 1), LLMFlow("light", 1)
+        order = []
+        await gate.acquire()
+        tasks = await _enqueue_all(gate, [
+            (order, heavy, "heavy-1"), (order, heavy, "heavy-2"), (order, heavy, "heavy-3"),
+            (order, light, "light-1"),
+        ])
+        assert gate.stats()["queue_depth"] == 4
+        assert gate.stats()["queued_flows"] == 2
+
+        gate.release()
+        await asyncio.gather(*tasks)
+        return gate, order
+
+    gate, order = asyncio.run(scenario())
+    assert order == ["heavy-1", "light-1", "heavy-2", "heavy-3"]
+    assert gate.in_flight == 0
+    assert gate.stats()["queued_flows"] == 0
+    # 所有请求完成后历史标签不再保留
+    assert gate._last_finish == {}
+
+
+def test_higher_weight_gets_more_turns():
+    async def scenario():
+        gate = AdmissionGate("test", max_concurrency=1, max_queue=10, queue_timeout=5)
+        free, subscriber = LLMFlow("free", 1), LLMFlow("subscriber", 4)
+        order = []
+        await gate.acquire()
+        tasks = await _enqueue_all(gate, [(order, free, "free")] * 2 + [(order, subscriber, "sub")] * 4)
+        gate.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(scenario()) == ["sub", "sub", "sub", "free", "sub", "free"]
+
+
+def test_queue_full_is_rejected_immediately():
+    async def scenario():
+        gate = AdmissionGate("test", max_concurrency=1, max_queue=1, queue_timeout=5)
+        await gate.acquire()
+        waiting = asyncio.ensure_future(gate.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(HTTPException) as exc_info:
+            await gate.acquire()
+        gate.release()
+        await waiting
+        gate.release()
+        return gate, exc_info.value
+
+    gate, error = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert "Retry-After" in error.headers
+    assert gate.rejected_queue_full == 1
+    assert gate.in_flight == 0
+
+
+def test_queue_timeout_rejects_and_frees_the_queue():
+    async def scenario():
+        gate = AdmissionGate("test", max_concurrency=1, max_queue=5, queue_timeout=0.05)
+        await gate.acquire()
+        with pytest.raises(HTTPException) as exc_info:
+            await gate.acquire()
+        assert exc_info.value.status_code == 503
+        assert gate.stats()["queue_depth"] == 0
+        gate.release()
+        # 超时的等待者不会占用名额
+        await gate.acquire()
+        gate.release()
+        return gate
+
+    gate = asyncio.run(scenario())
+    assert gate.rejected_timeout == 1
+    assert gate.in_flight == 0
+
+
+def test_cancelled_waiter_does_not_leak_a_slot():
+    async def scenario():
+        gate = AdmissionGate("test", max_concurrency=1, max_queue=5, queue_timeout=5)
+        await gate.acquire()
+        waiting = asyncio.ensure_future(gate.acquire())
+        await asyncio.sleep(0)
+        waiting.cancel()
+        await asyncio.gather(waiting, return_exceptions=True)
+        gate.release()
+        return gate
+
+    gate = asyncio.run(scenario())
+    assert gate.in_flight == 0
+    assert gate.stats()["queue_depth"] == 0
@@ -0,0 +1,163 @@
+"""
+LRU缓存和LLM结果缓存测试
+"""
+import asyncio
+
+import pytest
+
+from app.config import Settings
+from app.constants import API_MAX_TOKENS
+from app.services import cache as cache_module
+from app.services.cache import LRUCache, estimate_size
+from app.services.llm_service import LLMService, build_llm_request_key, llm_result_cache
+from app.services.resilience import UpstreamUnavailableError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(cache_module, "time", fake)
+    return fake
+
+
+def test_estimate_size_counts_utf8_bytes():
+    assert estimate_size("abc") == 3
+    assert estimate_size("中文") == 6
+    assert estimate_size(b"\x00\x01") == 2
+    assert estimate_size({"键": 1}) == len('{"键": 1}'.encode("utf-8"))
+
+
+def test_evicts_least_recently_used_by_bytes():
+    cache = LRUCache("test", max_bytes=10, ttl=60)
+    cache.set("a", "aaaa")
+    cache.set("b", "bbbb")
+    assert cache.get("a") == "aaaa"  # a 成为最近使用
+    cache.set("c", "cccc")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "aaaa"
+    assert cache.get("c") == "cccc"
+    assert cache.stats()["bytes"] == 8
+    assert cache.evictions == 1
+
+
+def test_oversized_values_are_not_cached():
+    cache = LRUCache("test", max_bytes=4, ttl=60)
+    cache.set("big", "12345")
+    assert len(cache) == 0
+    cache.set("sized", object(), size=4)
+    assert len(cache) == 1
+
+
+def test_replacing_a_key_updates_size():
+    cache = LRUCache("test", max_bytes=100, ttl=60)
+    cache.set("a", "x" * 10)
+    cache.set("a", "x" * 3)
+    assert cache.stats()["bytes"] == 3
+    cache.delete("a")
+    cache.delete("missing")
+    assert cache.stats()["bytes"] == 0
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = LRUCache("test", max_bytes=100, ttl=10)
+    cache.set("default", "v")
+    cache.set("short", "v", ttl=1)
+
+    clock.now += 2
+    assert cache.get("short") is None
+    assert cache.get("default") == "v"
+
+    clock.now += 10
+    assert cache.get("default", "missing") == "missing"
+    assert len(cache) == 0
+    assert cache.stats()["bytes"] == 0
+
+
+def test_hit_and_miss_counters():
+    cache = LRUCache("test", max_bytes=100, ttl=60)
+    cache.get("a")
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("a")
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["hit_rate"]) == (2, 1, 0.6667)
+    cache.clear()
+    assert cache.stats()["entries"] == 0 and cache.stats()["bytes"] == 0
+
+
+def _service(monkeypatch, answers):
+    """候选模型为 [model, model-backup]；answers: 模型 -> 结果，异常表示该模型不可用"""
+    service = LLMService(Settings())
+    monkeypatch.setattr(service, "_route_candidates", lambda model: [model, f"{model}-backup"])
+    calls = []
+
+    async def call_provider(model, messages, max_tokens):
+        calls.append(model)
+        answer = answers[model]
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    async def stream_provider(model, messages, max_tokens):
+        calls.append(model)
+        answer = answers[model]
+        if isinstance(answer, Exception):
+            raise answer
+        for char in answer:
+            yield char
+
+    monkeypatch.setattr(service, "_call_provider", call_provider)
+    monkeypatch.setattr(service, "_stream_provider", stream_provider)
+    return service, calls
+
+
+def _unavailable():
+    return UpstreamUnavailableError(status_code=503, detail="上游不可用")
+
+
+def test_cached_call_skips_fallback_answers(monkeypatch):
+    messages = [{"role": "user", "content": "缓存测试-故障切换"}]
+    answers = {"cache-primary": _unavailable(), "cache-primary-backup": "备用结果"}
+    service, calls = _service(monkeypatch, answers)
+
+    assert asyncio.run(service.call_llm_api_cached("cache-primary", messages)) == "备用结果"
+    key = build_llm_request_key("cache-primary", messages, API_MAX_TOKENS)
+    assert llm_result_cache.get(key) is None
+
+    answers["cache-primary"] = "首选结果"
+    assert asyncio.run(service.call_llm_api_cached("cache-primary", messages)) == "首选结果"
+    assert llm_result_cache.get(key) == "首选结果"
+
+    # 缓存命中不再请求上游；bypass_cache 跳过读取并刷新缓存
+    calls.clear()
+    assert asyncio.run(service.call_llm_api_cached("cache-primary", messages)) == "首选结果"
+    assert calls == []
+    answers["cache-primary"] = "新结果"
+    assert asyncio.run(service.call_llm_api_cached("cache-primary", messages, bypass_cache=True)) == "新结果"
+    assert llm_result_cache.get(key) == "新结果"
+
+
+def test_stream_caches_only_primary_answers(monkeypatch):
+    messages = [{"role": "user", "content": "缓存测试-流式"}]
+    answers = {"stream-primary": _unavailable(), "stream-primary-backup": "备用"}
+    service, _ = _service(monkeypatch, answers)
+    key = build_llm_request_key("stream-primary", messages, API_MAX_TOKENS)
+
+    async def consume():
+        return "".join([delta async for delta in service.stream_llm_api("stream-primary", messages, cache_result=True)])
+
+    assert asyncio.run(consume()) == "备用"
+    assert llm_result_cache.get(key) is None
+
+    answers["stream-primary"] = " 首选 "
+    assert asyncio.run(consume()) == " 首选 "
+    assert llm_result_cache.get(key) == "首选"
@@ -0,0 +1,67 @@
+"""
+用户使用计数测试
+"""
+import asyncio
+
+from app.services import history_counter as history_counter_module
+from app.services.history_counter import HistoryCounter, _add_counts
+
+
+class FakeSupabase:
+    """user_stats 表；increment_user_stats 等待 release 后才提交"""
+
+    def __init__(self, total):
+        self.row = {"total": total, "mode_counts": {}, "daily_counts": {}}
+        self.release = asyncio.Event()
+        self.incrementing = asyncio.Event()
+
+    async def get_user_stats_row(self, user_id):
+        await asyncio.sleep(0)
+        return {**self.row, "mode_counts": dict(self.row["mode_counts"]), "daily_counts": dict(self.row["daily_counts"])}
+
+    async def increment_user_stats(self, deltas):
+        self.incrementing.set()
+        await self.release.wait()
+        counts = {"total": self.row["total"], "modes": self.row["mode_counts"], "days": self.row["daily_counts"]}
+        for delta in deltas:
+            _add_counts(counts, {key: delta[key] for key in ("total", "modes", "days")})
+        self.row["total"] = counts["total"]
+
+
+def test_read_during_flush_sees_deltas_being_merged(monkeypatch):
+    async def scenario():
+        supabase = FakeSupabase(total=10)
+        monkeypatch.setattr(history_counter_module, "get_supabase_service", lambda: supabase)
+        counter = HistoryCounter()
+        counter._task = asyncio.get_running_loop().create_future()  # 不启动定期合并
+        counter.record("u1", "general", 3)
+
+        flush = asyncio.ensure_future(counter.flush())
+        await supabase.incrementing.wait()
+        read = asyncio.ensure_future(counter.get_total("u1"))
+        await asyncio.sleep(0.01)
+        assert not read.done()
+
+        supabase.release.set()
+        await flush
+        assert await read == 13
+        assert counter._pending == {}
+
+    asyncio.run(scenario())
+
+
+def test_failed_flush_keeps_deltas_pending(monkeypatch):
+    class FailingSupabase:
+        async def increment_user_stats(self, deltas):
+            raise ConnectionError("Supabase不可用")
+
+    async def scenario():
+        monkeypatch.setattr(history_counter_module, "get_supabase_service", lambda: FailingSupabase())
+        counter = HistoryCounter()
+        counter._task = asyncio.get_running_loop().create_future()
+        counter.record("u1", "general", 2)
+        await counter.flush()
+        assert counter._pending["u1"]["total"] == 2
+        assert counter.flush_failures == 1
+
+    asyncio.run(scenario())
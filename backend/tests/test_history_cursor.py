@@ -0,0 +1,38 @@
+"""
+历史记录游标编码测试
+"""
+import pytest
+from fastapi import HTTPException
+
+from app.routers.history import encode_history_cursor, decode_history_cursor
+
+
+@pytest.mark.parametrize("created_at", [
+    "2024-05-01T10:00:00+00:00",
+    "2024-05-01T10:00:00.1+00:00",
+    "2024-05-01T10:00:00.12+00:00",
+    "2024-05-01T10:00:00.123+00:00",
+    "2024-05-01T10:00:00.1234+00:00",
+    "2024-05-01T10:00:00.12345+00:00",
+    "2024-05-01T10:00:00.123456+00:00",
+    "2024-05-01T10:00:00.12Z",
+    "2024-05-01 10:00:00.12345+08",
+])
+def test_cursor_round_trip(created_at):
+    cursor = encode_history_cursor({"created_at": created_at, "id": 42})
+    assert "=" not in cursor
+    assert decode_history_cursor(cursor) == (created_at, 42)
+
+
+@pytest.mark.parametrize("cursor", [
+    "not-a-cursor",
+    "",
+    encode_history_cursor({"created_at": "yesterday", "id": 1}),
+    encode_history_cursor({"created_at": '2024-05-01T10:00:00"),id.gt.(0', "id": 1}),
+    encode_history_cursor({"created_at": "2024-05-01T10:00:00+00:00\n", "id": 1}),
+    encode_history_cursor({"created_at": "2024-05-01T10:00:00+00:00", "id": "x"}),
+])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as excinfo:
+        decode_history_cursor(cursor)
+    assert excinfo.value.status_code == 400
@@ -0,0 +1,129 @@
+"""
+历史记录搜索测试
+"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from postgrest.exceptions import APIError
+
+from app.services import history_search as history_search_module
+from app.services.history_search import HistorySearch, HistorySearchIndex, like_patterns, split_terms, tokenize
+
+
+ROWS = [
+    {"id": 1, "original_prompt": "写一篇关于机器学习的文章", "optimized_prompt": "请撰写一篇介绍机器学习基础的文章"},
+    {"id": 2, "original_prompt": "Python sorting", "optimized_prompt": "Explain python sorting algorithms in Python"},
+    {"id": 3, "original_prompt": "翻译这段话", "optimized_prompt": "请把下面的段落翻译成英文，保持学习笔记的语气"},
+    {"id": 4, "original_prompt": "100% 的折扣", "optimized_prompt": None},
+]
+
+
+def _ids(rows):
+    return [row["id"] for row in rows]
+
+
+def test_tokenize_splits_cjk_into_bigrams():
+    assert tokenize("机器学习 AI2024") == ["机器", "器学", "学习", "ai2024"]
+    assert tokenize("学") == ["学"]
+
+
+def test_split_terms_and_like_patterns():
+    assert split_terms("  Python python  排序 ") == ["python", "排序"]
+    assert like_patterns(["a", "100%", "x_y"]) == ["%100\\%%", "%x\\_y%", "%a%"]
+
+
+@pytest.mark.parametrize("terms, expected", [
+    (["学习"], [1, 3]),  # 原始提示词中的匹配权重更高
+    (["学"], [1, 3]),  # 单字按子串匹配
+    (["器学习"], [1]),  # 奇数长度的中文词
+    (["python"], [2]),
+    (["pyth"], [2]),  # 字母数字按子串匹配
+    (["python", "学习"], []),  # 每个词都必须出现
+    (["100%"], [4]),
+    (["不存在"], []),
+])
+def test_index_search_matches_substring_semantics(terms, expected):
+    rows, total = HistorySearchIndex(ROWS).search(terms, 0, 10)
+    assert _ids(rows) == expected
+    assert total == len(expected)
+
+
+def test_index_search_paginates_ranked_results():
+    rows = [
+        {"id": i, "original_prompt": "提示词 " * (i % 3), "optimized_prompt": "提示词"}
+        for i in range(10)
+    ]
+    index = HistorySearchIndex(rows)
+    first_page, total = index.search(["提示词"], 0, 4)
+    second_page, _ = index.search(["提示词"], 4, 4)
+    assert total == 10
+    assert _ids(first_page) == [2, 5, 8, 1]
+    assert _ids(second_page) == [4, 7, 0, 3]
+    assert index.size > 0
+
+
+class FakeSupabase:
+    def __init__(self, error=None):
+        self.error = error
+        self.rpc_calls = 0
+        self.scans = 0
+
+    async def search_user_history(self, user_id, query, patterns, limit, offset):
+        self.rpc_calls += 1
+        if self.error is not None:
+            raise self.error
+        return {"total": 1, "items": [ROWS[0]]}
+
+    async def iter_user_optimization_history(self, user_id, chunk_size):
+        self.scans += 1
+        yield ROWS
+
+
+@pytest.fixture(autouse=True)
+def fresh_history_cache(monkeypatch):
+    from app.services.history_cache import HistoryReadCache
+    monkeypatch.setattr(history_search_module, "history_cache", HistoryReadCache())
+
+
+def test_uses_database_function():
+    supabase = FakeSupabase()
+    rows, total = asyncio.run(HistorySearch(supabase).search("u1", "机器学习", 1, 20))
+    assert (_ids(rows), total) == ([1], 1)
+    assert supabase.scans == 0
+
+
+@pytest.mark.parametrize("code", ["PGRST202", "42883"])
+def test_missing_function_is_remembered(code):
+    supabase = FakeSupabase(error=APIError({"code": code, "message": "Could not find the function"}))
+    search = HistorySearch(supabase)
+
+    async def scenario():
+        first = await search.search("u1", "学习", 1, 20)
+        second = await search.search("u1", "python", 1, 20)
+        return first, second
+
+    (first_rows, _), (second_rows, _) = asyncio.run(scenario())
+    assert _ids(first_rows) == [1, 3]
+    assert _ids(second_rows) == [2]
+    assert supabase.rpc_calls == 1
+    # 索引只建立一次
+    assert supabase.scans == 1
+
+
+@pytest.mark.parametrize("error", [
+    APIError({"code": "57014", "message": "canceling statement due to statement timeout"}),
+    ConnectionError("Supabase不可用"),
+])
+def test_transient_errors_return_503(error):
+    supabase = FakeSupabase(error=error)
+    search = HistorySearch(supabase)
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(search.search("u1", "学习", 1, 20))
+    assert exc_info.value.status_code == 503
+    assert supabase.scans == 0
+
+    # 下一次请求仍然先尝试数据库函数
+    with pytest.raises(HTTPException):
+        asyncio.run(search.search("u1", "学习", 1, 20))
+    assert supabase.rpc_calls == 2
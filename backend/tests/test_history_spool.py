@@ -0,0 +1,152 @@
+"""
+历史记录暂存与回放测试
+"""
+import asyncio
+import json
+
+from postgrest.exceptions import APIError
+
+from app.config import get_settings
+from app.services import history_spool
+from app.services.history_spool import HistorySpool, HistoryReplayer
+
+
+class FakeSupabase:
+    """记录写入的行；rejected 中的 client_key 被数据库拒绝，down 为真时模拟服务不可用"""
+
+    def __init__(self, rejected=()):
+        self.rows = []
+        self.calls = 0
+        self.rejected = set(rejected)
+        self.down = False
+
+    async def upsert_optimization_history_batch(self, rows):
+        self.calls += 1
+        if self.down:
+            raise ConnectionError("Supabase不可用")
+        if any(row["client_key"] in self.rejected for row in rows):
+            raise APIError({"code": "23502", "message": "null value violates not-null constraint"})
+        for row in rows:
+            if row["client_key"] not in {existing["client_key"] for existing in self.rows}:
+                self.rows.append(row)
+
+
+class FakeCounter:
+    def __init__(self):
+        self.rows = []
+
+    def record_rows(self, rows):
+        self.rows.extend(row for row in rows if row.get("user_id"))
+
+
+def _rows(count, user_id="u1"):
+    return [
+        {"client_key": f"key-{i}", "user_id": user_id, "mode": "general", "original_prompt": str(i)}
+        for i in range(count)
+    ]
+
+
+def _replayer(tmp_path, monkeypatch, supabase):
+    counter = FakeCounter()
+    monkeypatch.setattr(history_spool, "history_counter", counter)
+    replayer = HistoryReplayer(get_settings(), HistorySpool(str(tmp_path / "spool.sqlite3")))
+    replayer.supabase_service = supabase
+    return replayer, counter
+
+
+def test_replay_ships_rows_and_dead_letters_rejected_ones(tmp_path, monkeypatch):
+    supabase = FakeSupabase(rejected={"key-3"})
+    replayer, counter = _replayer(tmp_path, monkeypatch, supabase)
+    replayer.spool.append(_rows(10))
+
+    async def scenario():
+        while await replayer.replay_once():
+            pass
+
+    asyncio.run(scenario())
+
+    assert [row["client_key"] for row in supabase.rows] == [f"key-{i}" for i in range(10) if i != 3]
+    assert replayer.spool.counts() == {"pending": 0, "dead": 1}
+    assert replayer.stats()["dead_lettered"] == 1
+    # 只有写入成功的行计入用户计数
+    assert len(counter.rows) == 9
+    replayer.spool.close()
+
+
+def test_spool_deduplicates_by_client_key(tmp_path, monkeypatch):
+    supabase = FakeSupabase()
+    replayer, _ = _replayer(tmp_path, monkeypatch, supabase)
+    replayer.spool.append(_rows(3))
+    replayer.spool.append(_rows(3))
+    assert replayer.spool.counts() == {"pending": 3, "dead": 0}
+    replayer.spool.close()
+
+
+def test_outage_pauses_the_whole_replayer(tmp_path, monkeypatch):
+    monkeypatch.setattr(history_spool, "_retry_delay", lambda attempts: 60)
+    supabase = FakeSupabase()
+    supabase.down = True
+    replayer, counter = _replayer(tmp_path, monkeypatch, supabase)
+    replayer.spool.append(_rows(3))
+
+    async def drain():
+        while await replayer.replay_once():
+            pass
+
+    asyncio.run(drain())
+    assert supabase.calls == 1
+
+    # 暂停期间新写入的记录也不尝试同步
+    replayer.spool.append([{"client_key": "late", "user_id": "u1", "mode": "general"}])
+    asyncio.run(drain())
+    assert supabase.calls == 1
+    assert replayer.stats()["consecutive_failures"] == 1
+    assert replayer.stats()["paused_for"] > 0
+
+    # 服务恢复、暂停结束后全部补写，连续失败次数清零
+    supabase.down = False
+    replayer._paused_until = 0.0
+    replayer.spool._conn.execute("UPDATE history_spool SET next_attempt_at = 0")
+    asyncio.run(drain())
+    assert len(supabase.rows) == 4
+    assert len(counter.rows) == 4
+    assert replayer.spool.counts() == {"pending": 0, "dead": 0}
+    assert replayer.stats()["consecutive_failures"] == 0
+    replayer.spool.close()
+
+
+def test_replayed_rows_keep_their_original_created_at(tmp_path, monkeypatch):
+    supabase = FakeSupabase()
+    supabase.down = True
+    replayer, _ = _replayer(tmp_path, monkeypatch, supabase)
+    monkeypatch.setattr(history_spool, "utc_now_iso", lambda: "2026-01-01T08:00:00+00:00")
+    replayer.spool.append(_rows(1))
+    replayer.spool.append([{**_rows(2)[1], "created_at": "2026-01-01T07:59:00+00:00"}])
+    asyncio.run(replayer.replay_once())
+
+    # 服务在第二天恢复
+    monkeypatch.setattr(history_spool, "utc_now_iso", lambda: "2026-01-02T09:00:00+00:00")
+    supabase.down = False
+    replayer._paused_until = 0.0
+    replayer.spool._conn.execute("UPDATE history_spool SET next_attempt_at = 0")
+    asyncio.run(replayer.replay_once())
+
+    assert {row["client_key"]: row["created_at"] for row in supabase.rows} == {
+        "key-0": "2026-01-01T08:00:00+00:00",
+        "key-1": "2026-01-01T07:59:00+00:00",
+    }
+    replayer.spool.close()
+
+
+def test_rows_spooled_without_created_at_are_stamped_on_replay(tmp_path, monkeypatch):
+    supabase = FakeSupabase()
+    replayer, _ = _replayer(tmp_path, monkeypatch, supabase)
+    replayer.spool._conn.execute(
+        "INSERT INTO history_spool (client_key, payload, next_attempt_at) VALUES (?, ?, 0)",
+        ("old", json.dumps({"client_key": "old", "user_id": "u1", "mode": "general"}))
+    )
+    replayer.spool.append(_rows(1))
+    asyncio.run(replayer.replay_once())
+    assert all(row.get("created_at") for row in supabase.rows)
+    assert len(supabase.rows) == 2
+    replayer.spool.close()
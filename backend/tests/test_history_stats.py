@@ -0,0 +1,128 @@
+"""
+使用统计测试：各统计实现对同一批历史记录返回相同结果
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.services import history_counter as history_counter_module
+from app.services.history_counter import HistoryCounter
+from app.services.history_stats import CounterHistoryStats, SupabaseHistoryStats
+
+
+def _rows():
+    now = datetime.now(timezone.utc)
+    spec = [
+        ("general", timedelta(hours=1)),
+        ("general", timedelta(days=2)),
+        ("business", timedelta(days=3)),
+        ("drawing", timedelta(days=20)),
+        ("academic", timedelta(days=1)),
+        (None, timedelta(days=40)),
+    ]
+    rows = [
+        {"id": i, "user_id": "u1", "user_type": "authenticated", "mode": mode,
+         "original_prompt": f"p{i}", "optimized_prompt": f"o{i}", "created_at": (now - age).isoformat()}
+        for i, (mode, age) in enumerate(spec)
+    ]
+    rows.append({**rows[0], "id": 99, "user_id": "u2"})
+    return rows
+
+
+EXPECTED = {
+    "total_optimizations": 6,
+    "recent_7_days": 4,
+    "mode_statistics": {"general": 2, "business": 1, "drawing": 1, "academic": 1, "unknown": 1},
+}
+
+
+class FakeSupabase:
+    """按 rows 回答查询；stats_function 为假时模拟数据库统计函数不存在"""
+
+    def __init__(self, rows, stats_function=True):
+        self.rows = rows
+        self.stats_function = stats_function
+        self.fetched_rows = 0
+
+    def _user_rows(self, user_id):
+        return [row for row in self.rows if row["user_id"] == user_id]
+
+    @staticmethod
+    def _mode(row):
+        return row["mode"] or "unknown"
+
+    async def get_user_history_stats(self, user_id, since):
+        if not self.stats_function:
+            raise Exception("Could not find the function public.get_user_history_stats")
+        rows = self._user_rows(user_id)
+        modes = {}
+        for row in rows:
+            modes[self._mode(row)] = modes.get(self._mode(row), 0) + 1
+        return {
+            "total": len(rows),
+            "recent": sum(datetime.fromisoformat(row["created_at"]) >= since for row in rows),
+            "modes": modes,
+            "last": (await self.get_user_optimization_history(user_id, limit=1))[0],
+        }
+
+    async def get_user_optimization_history_count(self, user_id, start_date=None, end_date=None, mode=None):
+        rows = self._user_rows(user_id)
+        if start_date:
+            rows = [row for row in rows if datetime.fromisoformat(row["created_at"]) >= start_date]
+        if mode:
+            rows = [row for row in rows if row["mode"] == mode]
+        return len(rows)
+
+    async def get_user_optimization_history(self, user_id=None, session_id=None, limit=50):
+        rows = sorted(self._user_rows(user_id), key=lambda row: row["created_at"], reverse=True)[:limit]
+        self.fetched_rows += len(rows)
+        return rows
+
+    async def get_user_stats_row(self, user_id):
+        rows = self._user_rows(user_id)
+        modes, days = {}, {}
+        for row in rows:
+            modes[self._mode(row)] = modes.get(self._mode(row), 0) + 1
+            day = row["created_at"][:10]
+            days[day] = days.get(day, 0) + 1
+        return {"total": len(rows), "mode_counts": modes, "daily_counts": days}
+
+
+def _supabase_rpc(monkeypatch):
+    return SupabaseHistoryStats(FakeSupabase(_rows()))
+
+
+def _supabase_fallback(monkeypatch):
+    return SupabaseHistoryStats(FakeSupabase(_rows(), stats_function=False))
+
+
+def _counters(monkeypatch):
+    supabase = FakeSupabase(_rows())
+    monkeypatch.setattr(history_counter_module, "get_supabase_service", lambda: supabase)
+    return CounterHistoryStats(supabase, HistoryCounter())
+
+
+@pytest.mark.parametrize("make_stats", [_supabase_rpc, _supabase_fallback, _counters])
+def test_stats_implementations_share_the_contract(monkeypatch, make_stats):
+    stats = asyncio.run(make_stats(monkeypatch).get_user_stats("u1"))
+    last = stats.pop("last_optimization")
+    assert stats == EXPECTED
+    assert last["id"] == 0
+
+
+def test_fallback_counts_exactly_without_reading_rows(monkeypatch):
+    supabase = FakeSupabase(_rows() * 1000, stats_function=False)
+    stats = asyncio.run(SupabaseHistoryStats(supabase).get_user_stats("u1"))
+    assert stats["total_optimizations"] == 6000
+    assert stats["recent_7_days"] == 4000
+    assert stats["mode_statistics"]["general"] == 2000
+    # 只读取最近一条记录
+    assert supabase.fetched_rows == 1
+
+
+def test_fallback_groups_other_modes_as_unknown():
+    rows = _rows()
+    rows[4]["mode"] = "custom"
+    stats = asyncio.run(SupabaseHistoryStats(FakeSupabase(rows, stats_function=False)).get_user_stats("u1"))
+    assert stats["mode_statistics"] == {"general": 2, "business": 1, "drawing": 1, "unknown": 2}
@@ -0,0 +1,114 @@
+"""
+快速回答任务队列测试
+"""
+import asyncio
+import sqlite3
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app.config import get_settings
+from app.constants import JOB_MAX_PER_USER, JOB_LEASE_TIMEOUT
+from app.services.job_queue import (
+    InMemoryJobStore, SQLiteJobStore, QuickAnswerJobQueue, JOB_QUEUED, JOB_FAILED
+)
+
+
+def _stores(tmp_path):
+    return [InMemoryJobStore(), SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))]
+
+
+async def _submit_concurrently(queue, owners):
+    results = await asyncio.gather(
+        *(queue.submit(owner, "问题", "gemini-2.5-flash") for owner in owners),
+        return_exceptions=True
+    )
+    accepted = [r for r in results if isinstance(r, dict)]
+    rejected = [r for r in results if isinstance(r, HTTPException)]
+    assert len(accepted) + len(rejected) == len(owners), results
+    return accepted, rejected
+
+
+@pytest.mark.parametrize("store_index", [0, 1])
+def test_concurrent_submits_respect_per_owner_limit(tmp_path, store_index):
+    async def scenario():
+        store = _stores(tmp_path)[store_index]
+        queue = QuickAnswerJobQueue(get_settings(), store)
+        accepted, rejected = await _submit_concurrently(queue, ["user:a"] * (JOB_MAX_PER_USER * 2))
+
+        assert len(accepted) == JOB_MAX_PER_USER
+        assert {e.status_code for e in rejected} == {429}
+        assert await store.count_active("user:a") == JOB_MAX_PER_USER
+        # 其他用户不受影响
+        accepted_other, _ = await _submit_concurrently(queue, ["user:b"])
+        assert len(accepted_other) == 1
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("store_index", [0, 1])
+def test_concurrent_submits_on_full_queue_return_503(tmp_path, store_index):
+    async def scenario():
+        store = _stores(tmp_path)[store_index]
+        queue = QuickAnswerJobQueue(get_settings(), store)
+        queue._queue = asyncio.Queue(maxsize=1)
+        accepted, rejected = await _submit_concurrently(queue, ["user:a", "user:b", "user:c"])
+
+        assert len(accepted) == 1
+        assert {e.status_code for e in rejected} == {503}
+        assert all(e.headers.get("Retry-After") for e in rejected)
+        # 被拒绝的提交不留下任务记录，只有被接受的任务占用名额
+        active = [await store.count_active(owner) for owner in ("user:a", "user:b", "user:c")]
+        assert sum(active) == 1
+        assert (await store.get(accepted[0]["id"]))["status"] == JOB_QUEUED
+        await store.close()
+
+    asyncio.run(scenario())
+
+
+def test_starting_worker_keeps_jobs_of_live_workers(tmp_path):
+    async def scenario():
+        path = str(tmp_path / "jobs.sqlite3")
+        live = QuickAnswerJobQueue(get_settings(), SQLiteJobStore(path))
+        job = await live.submit("user:a", "问题", "gemini-2.5-flash")
+
+        # 第二个进程启动（多进程部署或滚动重启），不能中断仍在续约的任务
+        starting = QuickAnswerJobQueue(get_settings(), SQLiteJobStore(path))
+        await starting._fail_abandoned()
+        assert (await starting.store.get(job["id"]))["status"] == JOB_QUEUED
+
+        # 所属进程退出后不再续约，超过租约时间后被标记为失败
+        await live.store.renew_leases(live.worker_id, time.time() - JOB_LEASE_TIMEOUT - 1)
+        await starting._fail_abandoned()
+        interrupted = await starting.store.get(job["id"])
+        assert interrupted["status"] == JOB_FAILED
+        assert interrupted["expires_at"] is not None
+        assert await starting.store.count_active("user:a") == 0
+
+        await live.store.close()
+        await starting.store.close()
+
+    asyncio.run(scenario())
+
+
+def test_sqlite_store_upgrades_files_without_lease_columns(tmp_path):
+    path = str(tmp_path / "jobs.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE quick_answer_jobs (id TEXT PRIMARY KEY, owner TEXT NOT NULL, status TEXT NOT NULL, "
+        "prompt TEXT NOT NULL, model TEXT NOT NULL, result TEXT, error TEXT, created_at REAL NOT NULL, "
+        "updated_at REAL NOT NULL, expires_at REAL)"
+    )
+    conn.execute("INSERT INTO quick_answer_jobs VALUES ('old', 'user:a', 'running', 'p', 'm', NULL, NULL, 0, 0, NULL)")
+    conn.commit()
+    conn.close()
+
+    async def scenario():
+        queue = QuickAnswerJobQueue(get_settings(), SQLiteJobStore(path))
+        await queue._fail_abandoned()
+        assert (await queue.store.get("old"))["status"] == JOB_FAILED
+        await queue.store.close()
+
+    asyncio.run(scenario())
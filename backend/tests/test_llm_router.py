@@ -0,0 +1,117 @@
+"""
+LLM路由器故障切换与对冲测试
+"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.constants import LLM_ROUTER_MIN_SAMPLES
+from app.services.llm_router import LLMRouter
+from app.services.resilience import UpstreamUnavailableError
+
+
+def _router() -> LLMRouter:
+    return LLMRouter(failover_errors=(UpstreamUnavailableError,))
+
+
+def _warm_up(router: LLMRouter, model: str, latency: float) -> None:
+    """填满延迟窗口，使对冲等待时间约为 latency"""
+    for _ in range(LLM_ROUTER_MIN_SAMPLES):
+        router.record(model, 100, latency, True)
+
+
+def test_fails_over_on_upstream_unavailable():
+    router = _router()
+    calls = []
+
+    async def func(model):
+        calls.append(model)
+        if model == "primary":
+            raise UpstreamUnavailableError(status_code=503, detail="限流")
+        return f"{model}-result"
+
+    assert asyncio.run(router.call(["primary", "backup"], 100, func)) == "backup-result"
+    assert calls == ["primary", "backup"]
+    assert router.failovers == 1
+    assert router.error_rate("primary") == 1.0
+
+
+@pytest.mark.parametrize("error", [
+    HTTPException(status_code=500, detail="上游400：请求参数错误"),
+    HTTPException(status_code=503, detail="排队已满"),
+    ValueError("bug"),
+])
+def test_other_errors_do_not_fail_over(error):
+    router = _router()
+    calls = []
+
+    async def func(model):
+        calls.append(model)
+        raise error
+
+    with pytest.raises(type(error)):
+        asyncio.run(router.call(["primary", "backup"], 100, func))
+    assert calls == ["primary"]
+    assert router.failovers == 0
+    # 不是上游故障，不计入错误率
+    assert router.error_rate("primary") == 0.0
+
+
+def test_unhealthy_model_is_tried_last():
+    router = _router()
+    for _ in range(LLM_ROUTER_MIN_SAMPLES):
+        router.record("primary", 100, 0.1, False)
+    assert router.order(["primary", "backup"]) == ["backup", "primary"]
+
+
+def test_hedges_slow_primary_and_cancels_loser():
+    router = _router()
+    _warm_up(router, "primary", 0.01)
+    cancelled = []
+
+    async def func(model):
+        try:
+            await asyncio.sleep(1 if model == "primary" else 0.01)
+        except asyncio.CancelledError:
+            cancelled.append(model)
+            raise
+        return model
+
+    async def scenario():
+        result = await router.call(["primary", "backup"], 100, func)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(scenario()) == "backup"
+    assert cancelled == ["primary"]
+    assert (router.hedges, router.hedge_wins) == (1, 1)
+
+
+def test_hedge_non_failover_error_is_raised():
+    router = _router()
+    _warm_up(router, "primary", 0.01)
+
+    async def func(model):
+        if model == "primary":
+            await asyncio.sleep(1)
+            return model
+        await asyncio.sleep(0.01)
+        raise HTTPException(status_code=500, detail="上游400")
+
+    with pytest.raises(HTTPException) as exc_info:
+        asyncio.run(router.call(["primary", "backup"], 100, func))
+    assert not isinstance(exc_info.value, UpstreamUnavailableError)
+
+
+def test_hedge_ratio_is_capped():
+    router = _router()
+    _warm_up(router, "primary", 0.001)
+    router.hedges = 1  # 已达到比例上限
+
+    async def func(model):
+        await asyncio.sleep(0.01)
+        return model
+
+    assert asyncio.run(router.call(["primary", "backup"], 100, func)) == "primary"
+    assert router.hedges == 1
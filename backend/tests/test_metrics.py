@@ -0,0 +1,37 @@
+"""
+运行指标接口访问控制测试
+"""
+import pytest
+from fastapi.testclient import TestClient
+
+from app.config import Settings, get_settings
+from app.main import app
+
+
+@pytest.fixture
+def client_with_token():
+    def override(token):
+        settings = Settings()
+        settings.metrics_token = token
+        app.dependency_overrides[get_settings] = lambda: settings
+        return TestClient(app)
+
+    yield override
+    app.dependency_overrides.clear()
+
+
+def test_metrics_disabled_without_token_setting(client_with_token):
+    assert client_with_token("").get("/api/metrics").status_code == 404
+
+
+@pytest.mark.parametrize("authorization", [None, "Bearer wrong", "secret", "Basic secret"])
+def test_metrics_rejects_missing_or_wrong_token(client_with_token, authorization):
+    headers = {"Authorization": authorization} if authorization else {}
+    response = client_with_token("secret").get("/api/metrics", headers=headers)
+    assert response.status_code == 401
+
+
+def test_metrics_with_token(client_with_token):
+    response = client_with_token("secret").get("/api/metrics", headers={"Authorization": "Bearer secret"})
+    assert response.status_code == 200
+    assert "llm_cache" in response.json()
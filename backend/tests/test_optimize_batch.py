@@ -0,0 +1,74 @@
+"""
+批量优化测试
+"""
+import asyncio
+
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+from app.auth import User
+from app.config import Settings
+from app.main import app
+from app.models import PromptRequest, PromptResponse
+from app.services import prompt_service as prompt_service_module
+from app.services.prompt_service import PromptService
+from app.services.supabase_service import SupabaseService
+
+
+def test_batch_requires_authentication():
+    response = TestClient(app).post("/api/optimize/batch", json={"items": [{"original_prompt": "你好"}]})
+    assert response.status_code == 401
+
+
+class FakeHistoryWriter:
+    def __init__(self):
+        self.rows = []
+
+    async def enqueue_many(self, rows):
+        self.rows.extend(rows)
+
+
+class FakeSupabase:
+    build_history_row = staticmethod(SupabaseService.build_history_row)
+
+
+class SlowPromptService(PromptService):
+    """第 i 条耗时 DELAYS[i] 秒；提示词为"失败"的条目返回上游错误"""
+
+    DELAYS = [0.0, 0.01, 0.01, 5.0]
+
+    def __init__(self):
+        super().__init__(Settings(), llm_service=object(), supabase_service=FakeSupabase())
+        self.cancelled = 0
+
+    async def optimize_prompt(self, request, user=None, client_ip="unknown", save_history=True):
+        index = int(request.original_prompt.split("-")[1])
+        try:
+            await asyncio.sleep(self.DELAYS[index])
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if request.original_prompt.startswith("失败"):
+            raise HTTPException(status_code=503, detail="上游不可用")
+        return PromptResponse(optimized_prompt=f"优化-{index}", model_used=request.model)
+
+
+def test_disconnect_mid_batch_saves_finished_items(monkeypatch):
+    writer = FakeHistoryWriter()
+    monkeypatch.setattr(prompt_service_module, "get_history_writer", lambda settings: writer)
+    service = SlowPromptService()
+    items = [PromptRequest(original_prompt=f"{prefix}-{i}") for i, prefix in enumerate(["提示词", "提示词", "失败", "提示词"])]
+
+    async def scenario():
+        results = service.optimize_prompt_batch(items, User({"sub": "u1", "email": "a@b.c"}), parallelism=4)
+        first = await results.__anext__()
+        # 其余快速条目完成后、尚未读取结果时客户端断开
+        await asyncio.sleep(0.05)
+        await results.aclose()
+        return first
+
+    first = asyncio.run(scenario())
+    assert '"index": 0' in first
+    assert sorted(row["optimized_prompt"] for row in writer.rows) == ["优化-0", "优化-1"]
+    assert all(row["user_id"] == "u1" for row in writer.rows)
+    assert service.cancelled == 1
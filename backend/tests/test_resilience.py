@@ -0,0 +1,174 @@
+"""
+熔断器、重试预算和LLM调用容错测试
+"""
+import asyncio
+import time
+
+import httpx
+import openai
+import pytest
+
+from app.config import Settings
+from app.services import llm_service
+from app.services.llm_service import LLMService
+from app.services.resilience import (
+    CircuitBreaker, RetryBudget, UpstreamUnavailableError, backoff_delay, get_circuit_breaker, parse_retry_after
+)
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker("test", failure_threshold=3, recovery_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    breaker.record_failure()
+    assert breaker.is_open
+    assert not breaker.allow_request()
+    assert breaker.rejected == 1
+    assert 0 < breaker.retry_after() <= 30
+
+
+def test_breaker_half_open_allows_one_probe():
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout=30)
+    breaker.record_failure()
+    breaker.opened_at = time.monotonic() - 31
+
+    assert breaker.allow_request()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # 探测未返回前不再放行
+    assert not breaker.allow_request()
+
+    # 探测失败重新打开，成功则恢复
+    breaker.record_failure()
+    assert breaker.is_open
+    breaker.opened_at = time.monotonic() - 31
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_retry_budget_refills_per_request_up_to_capacity():
+    budget = RetryBudget(ratio=0.5, capacity=2)
+    assert budget.try_acquire() and budget.try_acquire()
+    assert not budget.try_acquire()
+    assert budget.exhausted == 1
+
+    budget.record_request()
+    assert not budget.try_acquire()
+    budget.record_request()
+    assert budget.try_acquire()
+
+    for _ in range(10):
+        budget.record_request()
+    assert budget.tokens == 2
+
+
+def test_backoff_respects_retry_after():
+    assert backoff_delay(0, retry_after=7) >= 7
+    assert parse_retry_after("3") == 3.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") is None
+    assert parse_retry_after(None) is None
+
+
+def _request():
+    return httpx.Request("POST", "http://upstream.test/v1/chat/completions")
+
+
+class FakeClient:
+    """chat.completions.create 依次返回或抛出 outcomes 中的结果"""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.chat = self
+        self.completions = self
+
+    async def create(self, **params):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def service(monkeypatch):
+    def make(base_url, client):
+        settings = Settings()
+        settings.deepseek_base_url = base_url
+        monkeypatch.setattr(llm_service, "get_llm_client", lambda settings, provider: client)
+        monkeypatch.setattr(llm_service, "backoff_delay", lambda attempt, retry_after=None: 0)
+        monkeypatch.setattr(llm_service, "llm_retry_budget", RetryBudget(ratio=1, capacity=10))
+        return LLMService(settings)
+    return make
+
+
+def test_rate_limits_do_not_trip_the_breaker(service):
+    rate_limited = openai.RateLimitError(
+        "rate limited", response=httpx.Response(429, request=_request()), body=None
+    )
+    client = FakeClient([rate_limited] * 10)
+    llm = service("http://rate-limited.test/v1", client)
+
+    for _ in range(3):
+        with pytest.raises(openai.RateLimitError):
+            asyncio.run(llm._create_completion("deepseek", model="deepseek-chat", messages=[]))
+
+    breaker = get_circuit_breaker("http://rate-limited.test/v1")
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.consecutive_failures == 0
+    assert client.calls == 9  # 每次调用都按重试次数上限退避重试
+
+
+def test_connection_errors_trip_the_breaker(service):
+    client = FakeClient([openai.APIConnectionError(request=_request())] * 10)
+    llm = service("http://unreachable.test/v1", client)
+
+    # 第一次调用连同重试失败3次，第二次调用中达到阈值后熔断，快速失败
+    with pytest.raises(openai.APIConnectionError):
+        asyncio.run(llm._create_completion("deepseek", model="deepseek-chat", messages=[]))
+    with pytest.raises(UpstreamUnavailableError) as exc_info:
+        asyncio.run(llm._create_completion("deepseek", model="deepseek-chat", messages=[]))
+    assert exc_info.value.status_code == 503
+    assert "Retry-After" in exc_info.value.headers
+    assert get_circuit_breaker("http://unreachable.test/v1").is_open
+    assert client.calls == 5
+
+
+class BrokenStream:
+    """产出一个增量后连接中断的流"""
+
+    def __init__(self):
+        self.closed = False
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        delta = type("Delta", (), {"content": "你好"})()
+        yield type("Chunk", (), {"choices": [type("Choice", (), {"delta": delta})()]})()
+        raise httpx.ReadError("connection reset", request=_request())
+
+    async def close(self):
+        self.closed = True
+
+
+def test_stream_failure_after_first_chunk_counts_toward_breaker(service):
+    stream = BrokenStream()
+    llm = service("http://broken-stream.test/v1", FakeClient([stream]))
+
+    async def consume():
+        deltas = []
+        async for delta in llm._stream_completion("deepseek", "deepseek-chat", [], 100):
+            deltas.append(delta)
+        return deltas
+
+    with pytest.raises(UpstreamUnavailableError):
+        asyncio.run(consume())
+    assert stream.closed
+    assert get_circuit_breaker("http://broken-stream.test/v1").consecutive_failures == 1
@@ -0,0 +1,152 @@
+"""
+请求合并测试
+"""
+import asyncio
+
+import pytest
+
+from app.services.single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    async def scenario():
+        flight = SingleFlight("test")
+        calls = []
+
+        async def func():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "结果"
+
+        results = await asyncio.gather(*(flight.do("key", func) for _ in range(5)))
+        # 完成后相同的键重新调用上游
+        again = await flight.do("key", func)
+        return flight, calls, results, again
+
+    flight, calls, results, again = asyncio.run(scenario())
+    assert results == ["结果"] * 5
+    assert again == "结果"
+    assert len(calls) == 2
+    assert flight.stats()["upstream_calls"] == 2
+    assert flight.stats()["coalesced_calls"] == 4
+    assert flight.stats()["in_flight_calls"] == 0
+
+
+def test_errors_are_shared_by_all_waiters():
+    async def scenario():
+        flight = SingleFlight("test")
+
+        async def func():
+            await asyncio.sleep(0.01)
+            raise ValueError("上游失败")
+
+        return await asyncio.gather(*(flight.do("key", func) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, ValueError) for result in results)
+
+
+def test_cancelled_waiter_does_not_cancel_others():
+    async def scenario():
+        flight = SingleFlight("test")
+
+        async def func():
+            await asyncio.sleep(0.02)
+            return "结果"
+
+        first = asyncio.ensure_future(flight.do("key", func))
+        second = asyncio.ensure_future(flight.do("key", func))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second, first.cancelled()
+
+    assert asyncio.run(scenario()) == ("结果", True)
+
+
+async def _gated_stream(gate, chunks):
+    for chunk in chunks:
+        await gate.wait()
+        gate.clear()
+        yield chunk
+
+
+def test_late_subscriber_receives_full_stream():
+    async def scenario():
+        flight = SingleFlight("test")
+        gate = asyncio.Event()
+        starts = []
+
+        def func():
+            starts.append(1)
+            return _gated_stream(gate, ["一", "二", "三"])
+
+        first = flight.stream("key", func)
+        received = []
+        gate.set()
+        received.append(await first.__anext__())
+
+        # 第一段产生后才加入的订阅者
+        second = flight.stream("key", func)
+
+        async def drain(stream, into):
+            async for chunk in stream:
+                into.append(chunk)
+
+        late = []
+        drain_second = asyncio.ensure_future(drain(second, late))
+        drain_first = asyncio.ensure_future(drain(first, received))
+        for _ in range(2):
+            await asyncio.sleep(0.01)
+            gate.set()
+        await asyncio.gather(drain_first, drain_second)
+        return flight, starts, received, late
+
+    flight, starts, received, late = asyncio.run(scenario())
+    assert received == late == ["一", "二", "三"]
+    assert len(starts) == 1
+    assert flight.stats()["coalesced_calls"] == 1
+    assert flight.stats()["in_flight_streams"] == 0
+
+
+def test_stream_error_reaches_every_subscriber():
+    async def failing():
+        yield "一"
+        raise ValueError("上游中断")
+
+    async def scenario():
+        flight = SingleFlight("test")
+
+        async def consume():
+            chunks = []
+            with pytest.raises(ValueError):
+                async for chunk in flight.stream("key", failing):
+                    chunks.append(chunk)
+            return chunks
+
+        return await asyncio.gather(consume(), consume())
+
+    assert asyncio.run(scenario()) == [["一"], ["一"]]
+
+
+def test_upstream_is_cancelled_when_all_subscribers_leave():
+    async def scenario():
+        flight = SingleFlight("test")
+        cancelled = asyncio.Event()
+
+        async def endless():
+            try:
+                while True:
+                    yield "增量"
+                    await asyncio.sleep(0.001)
+            finally:
+                cancelled.set()
+
+        stream = flight.stream("key", endless)
+        assert await stream.__anext__() == "增量"
+        await stream.aclose()
+        await asyncio.wait_for(cancelled.wait(), timeout=1)
+        await asyncio.sleep(0)
+        return flight
+
+    flight = asyncio.run(scenario())
+    assert flight.stats()["in_flight_streams"] == 0